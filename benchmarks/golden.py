@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+
+import argparse     # Parsing command line arguments
+import json         # Saving the report
+import math         # floor for the reference binning
+import os           # Path related stuff
+import sys          # Exit code for failures
+
+import numpy as np  # Comparing the outputs
+import scipy.signal as signal           # Peak finding, for the reference fits
+from scipy.optimize import curve_fit    # Fitting, for the reference fits
+import matplotlib   # Plotting, without showing anything
+matplotlib.use('Agg')
+
+import synthetic    # Makes the input files, this also finds the modules below
+
+import data_files.safari_input as safari_input
+import data_files.detect_processor as detect
+import spec_files.load_spec as load_spec
+import spec_files.fit_esa as esa
+
+# Checks that the fast paths give the same results as the plain reference
+# implementations, on the synthetic files from synthetic.py, eg:
+#
+#     python benchmarks/golden.py -s 10k 1m
+#
+# The references are slow, so their outputs are cached in golden.npz next
+# to the synthetic files, and only remade if the files change, if
+# REFERENCE_VERSION changes, or with --refresh.
+#
+# Each case compares some outputs of a candidate against a reference, and
+# passes if the maximum deviation of each is within the tolerance given.
+# Arrays are compared by the largest absolute difference, and selections
+# (sets of trajectory indices) by how many are in only one of the two.
+#
+# The references are frozen copies of the original code, including reading
+# the files, so they don't use any of the code they check. The fit_esa one
+# fits the image from the reference process_data.
+
+# Change this when a reference below changes, so the cache is remade
+REFERENCE_VERSION = 4
+
+# Limits used for the cleaning, (emin, emax, phimin, phimax, thmin, thmax),
+# the energies are fractions of E0, see limits
+LIMITS = (0.25, 1, -180, 180, 0, 90)
+
+def limits(safio):
+    emin, emax, phimin, phimax, thmin, thmax = LIMITS
+    return (emin * safio.E0, emax * safio.E0, phimin, phimax, thmin, thmax)
+
+# Spot detector (theta, size) and stripe detector (theta1, theta2, width),
+# both at PHI0
+SPOT = (45, 20)
+STRIPE = (0, 90, 10)
+
+# Stripe detector (theta1, theta2, phi, width) just below phi = 360, so it
+# covers the wrap at phi = 0, where its phi distances jump
+STRIPE_WRAP = (0, 90, -4.4, 22)
+
+def spot_detector(safio):
+    return detect.SpotDetector(SPOT[0], safio.PHI0, SPOT[1])
+
+def stripe_detector(safio):
+    return detect.StripeDetector(STRIPE[0], STRIPE[1], safio.PHI0, STRIPE[2])
+
+def stripe_wrap_detector(safio):
+    return detect.StripeDetector(*STRIPE_WRAP)
+
+# Reference implementations, these are the plain versions of what the
+# fast paths do, each returns a dict of name -> array.
+
+# Copy of the original unit in detect_processor
+def reference_unit(theta, phi):
+    th = theta * math.pi / 180
+    ph = phi * math.pi / 180
+    sinth = math.sin(th)
+    x = sinth * math.cos(ph)
+    y = sinth * math.sin(ph)
+    z = math.cos(th)
+    s = math.sqrt(x*x + y*y + z*z)
+    return np.array([x/s, y/s, z/s])
+
+# Copy of the original SpotDetector.isInDetector, as a function of
+# (theta, phi, e), for SPOT
+def reference_spot(safio):
+    theta, size = SPOT
+    phi = safio.PHI0
+    centre = reference_unit(theta, phi)
+    quad_dots = [centre.dot(reference_unit(theta - size/2, phi)),\
+                 centre.dot(reference_unit(theta + size/2, phi)),\
+                 centre.dot(reference_unit(theta, phi - size/2)),\
+                 centre.dot(reference_unit(theta, phi + size/2))]
+    def is_in(t, p, e):
+        if e < 0:
+            return False
+        dotdir = reference_unit(t, p).dot(centre)
+        for dot in quad_dots:
+            if dotdir >= dot:
+                return True
+        return False
+    return is_in
+
+# The reference stripe tests for STRIPE and STRIPE_WRAP
+def reference_stripe(safio):
+    return stripe_test(STRIPE[0], STRIPE[1], safio.PHI0, STRIPE[2])
+
+def reference_stripe_wrap(safio):
+    return stripe_test(*STRIPE_WRAP)
+
+# Copy of the original StripeDetector.isInDetector, as a function of
+# (theta, phi, e)
+def stripe_test(theta1, theta2, phi, width):
+    tmin = min(theta1, theta2)
+    tmax = max(theta1, theta2)
+    width = abs(width)
+    centre = (phi + 360) % 360
+    def is_in(t, p, e):
+        if e < 0:
+            return False
+        if not (t > tmin and t < tmax):
+            return False
+        p = (p + 360) % 360
+        if abs(p - centre) < width:
+            return True
+        if abs(((360 - p) % 360) - centre) < width:
+            return True
+        return False
+    return is_in
+
+# The original loadFromText, the rows of the .data file as lists of
+# x, y, z, E, theta, phi, index, weight
+def reference_rows(filename):
+    rows = []
+    with open(filename, 'r', errors='ignore') as f:
+        next(f, None)
+        for line in f:
+            arr = line.split()
+            if len(arr) < 10:
+                continue
+            try:
+                rows.append([float(arr[0]), float(arr[1]), float(arr[2]),\
+                             float(arr[3]), float(arr[4]), float(arr[5]),\
+                             float(arr[6]), 1.0])
+            except ValueError:
+                continue
+    return rows
+
+# Row by row version of the original Spectrum.clean, on the text file,
+# make_test is one of the reference_spot or reference_stripe functions
+def reference_clean(files, make_test):
+    safio = safari_input.SafariInput(files['input'])
+    is_in = make_test(safio)
+    emin, emax, phimin, phimax, thmin, thmax = limits(safio)
+    index = []
+    stuck = 0
+    buried = 0
+    other = 0
+    energy = []
+    theta = []
+    for traj in reference_rows(files['data']):
+        e = traj[3]
+        t = traj[4]
+        p = traj[5]
+        if e == -100:
+            stuck = stuck + 1
+            continue
+        if e == -200:
+            buried = buried + 1
+            continue
+        if e < 0:
+            other = other + 1
+            continue
+        if e < emin or e > emax\
+        or t > thmax or t < thmin\
+        or p > phimax or p < phimin:
+            continue
+        if is_in(t, p, e):
+            index.append(traj[6])
+            energy.append(e)
+            theta.append(t)
+    return {'index': np.array(index), 'failed': np.array([stuck, buried, other]),\
+            'energy': np.array(energy), 'theta': np.array(theta)}
+
+# Spectrum from the original integrate loop, on the reference detections
+def reference_spectrum(files, clean_out, res=None, numpoints=512):
+    safio = safari_input.SafariInput(files['input'])
+    res = (safio.ESIZE if res is None else res) / safio.E0
+    emin = limits(safio)[0]
+    step = (safio.E0 - emin)/(numpoints * safio.E0)
+    energy = np.array([(emin / safio.E0 + x*step) for x in range(numpoints)])
+    points = clean_out['energy'] / safio.E0
+    intensity, scale = detect.integrate(numpoints, 1/res, points, np.ones(len(points)), energy)
+    return {'energy': energy, 'intensity': intensity}
+
+# Energy vs theta image, binned one point at a time, as plotThetaE did
+def reference_theta_e(files, clean_out, size=1024):
+    safio = safari_input.SafariInput(files['input'])
+    e_min, e_max, _, _, t_min, t_max = limits(safio)
+    del_e = e_max - e_min
+    del_t = t_max - t_min
+    while True:
+        img = np.zeros((size, size))
+        de = del_e/size
+        dt = del_t/size
+        for e, t in zip(clean_out['energy'], clean_out['theta']):
+            e = e - e_min
+            t = t - t_min
+            if e >= 0 and e < del_e and t >= 0 and t < del_t:
+                img[math.floor(e/de)][math.floor(t/dt)] += 1
+        if size <= 2 or np.max(img) >= 100:
+            return {'image': img}
+        size = int(size / 2)
+
+# Copy of the original Spec.load, returns the header values (e_range,
+# t_range, p_range, energy and phi), and the tables of counts, one
+# (theta, phi) table per energy
+def reference_spec(filename):
+    with open(filename, 'r') as f:
+        components = f.read().split('--------------------------------------------------------')
+    header = {'e_range': [0, 0], 't_range': [0, 0], 'p_range': [0, 0], 'energy': 0, 'phi': 0}
+    for line in components[1].split('\n'):
+        vars = line.split(' ')
+        if line.startswith('Energy range:'):
+            header['e_range'] = [float(vars[2]), float(vars[4])]
+        elif line.startswith('Theta range:'):
+            header['t_range'] = [float(vars[2]), float(vars[4])]
+        elif line.startswith('Phi range:'):
+            header['p_range'] = [float(vars[2]), float(vars[4])]
+        elif line.startswith('Energy:'):
+            header['energy'] = float(vars[1])
+        elif line.startswith('Phi:'):
+            header['phi'] = float(vars[1])
+    detections = []
+    table = []
+    for row in components[2].split('\n'):
+        if not row.startswith('\t'):
+            table = []
+            detections.append(table)
+        elif not row.startswith('\t\t'):
+            vars = row.strip().split()
+            del vars[0]
+            table.append(np.array([int(i) for i in vars]))
+    del detections[0]
+    return header, detections
+
+# Copy of the original Spec.process_data loop
+def reference_process_data(files, d_phi=10):
+    header, detections = reference_spec(files['spec'])
+    p_range, phi = header['p_range'], header['phi']
+    l_E = len(detections) - 1
+    l_T = len(detections[1])
+    l_P = len(detections[1][0])
+    img = np.zeros((l_E, l_T))
+    theta_phi = np.zeros((l_T, l_P))
+    for n_E in range(l_E):
+        table = detections[n_E]
+        for n_T in range(l_T):
+            row = table[n_T]
+            for n_P in range(l_P):
+                P = p_range[0] + n_P * (p_range[1] - p_range[0]) / l_P
+                theta_phi[n_T][n_P] = theta_phi[n_T][n_P] + row[n_P]
+                if P > phi - d_phi/2 and P < phi + d_phi/2:
+                    img[n_E][n_T] = img[n_E][n_T] + row[n_P]
+    return {'img': img, 'theta_phi': theta_phi}
+
+# Copy of the original integrate in detect_processor, with its gauss
+def reference_integrate(numpoints, winv, points, areas, axis):
+    intensity = np.array([1e-60 for x in range(numpoints)])
+    zero = np.sum(areas)==0
+    for i in range(numpoints):
+        x = points - axis[i]
+        gauss = np.exp(-x*x*2.*winv*winv)*winv*0.7978845608
+        if zero:
+            intensity[i] = np.sum(gauss)
+        else:
+            intensity[i] = np.sum(gauss * areas)
+        if intensity[i] <= 1e-60:
+            intensity[i] = 0
+    m = np.max(intensity)
+    if m != 0:
+        intensity /= m
+    return intensity, m
+
+# Copy of the original fit_esa.multiples, any number of gaussians
+def reference_multiples(x, *params):
+    y = np.zeros(len(x))
+    for i in range(0, len(params), 3):
+        a = params[i]
+        sigma = params[i+1]
+        mu = params[i+2]
+        y = y + a*np.exp(-(x-mu)*(x-mu)/(2*sigma*sigma))
+    return y
+
+# Copy of the original fit_esa.peak_finder
+def reference_peak_finder(values, axis, min_h=10, min_w=1, grad=True, integrate=None, winv=5, min_x=0):
+    if grad:
+        derivative = np.gradient(values)
+        derivative -= np.min(derivative)
+        derivative /= np.max(derivative)
+        grad2 = -np.gradient(derivative)
+        grad2 = grad2.clip(0)
+        grad2 /= (np.max(grad2) - np.min(grad2))
+        if integrate is not None:
+            grad2, scale = integrate(len(grad2), winv, axis, grad2, axis)
+        matched, properties = signal.find_peaks(grad2, prominence=0.0, width=1)
+    else:
+        matched, properties = signal.find_peaks(values, prominence=min_h, width=min_w)
+    if len(matched) == 0:
+        if grad:
+            return reference_peak_finder(values, axis, min_h, min_w, False)
+        return None
+    width = properties['widths']
+    height = properties['prominences']
+    max_h = np.max(values) / np.max(height)
+    params = []
+    for i in range(len(matched)):
+        index = matched[i]
+        u = axis[index]
+        if u < min_x:
+            continue
+        w = (axis[index]-axis[index-1])*width[i]
+        if not grad:
+            w /= 2
+        h = height[i] * max_h
+        h = (values[index] + h) / 2
+        params.extend([h, w, u])
+    return params
+
+# Copy of the original fit_esa, without the plots, returns the fit params
+# or None
+def reference_fit_esa(values, axis, min_h, min_w, integrate, winv, min_x):
+    params = reference_peak_finder(values, axis, min_h, min_w, integrate=integrate, winv=winv, min_x=min_x)
+    if params is None:
+        return None
+    try:
+        popt, pcov = curve_fit(reference_multiples, axis, values, p0=params)
+    except Exception:
+        return None
+    return popt
+
+# Copy of the original Spec.try_fit, as set up by fit_spec, on img
+def reference_fit(files, img):
+    header, detections = reference_spec(files['spec'])
+    e_min, e_max = header['e_range']
+    t_min, t_max = header['t_range']
+    energy = header['energy']
+    size = img.shape[0]
+    dE = (e_max/energy - e_min/energy) / size
+    axis = np.array([e_min/energy + dE * x for x in range(size)]) * energy
+    X = []
+    Y = []
+    S = []
+    for i in range(img.shape[1]):
+        slyce = img[:,i]
+        max_h = np.max(slyce)
+        slyce, scale = reference_integrate(size, 100/energy, axis, slyce, axis)
+        slyce *= max_h
+        params = reference_fit_esa(slyce, axis, max(np.max(slyce)/100, 1), 5, reference_integrate, 5, 0)
+        T = t_min + (i+0.5) * (t_max - t_min) / img.shape[1]
+        if params is not None and len(params) > 2:
+            for j in range(0, len(params), 3):
+                E = params[j+2]
+                if E > energy or E < 0:
+                    continue
+                X.append(T)
+                Y.append(E)
+                S.append(abs(params[j+1]))
+    return {'theta': np.array(X), 'energy': np.array(Y), 'width': np.array(S)}
+
+# Candidates, these run the code as it is now.
+
+def make_spectrum(files, make_detector, use_index=False):
+    safio = safari_input.SafariInput(files['input'])
+    spectrum = detect.Spectrum()
+    spectrum.plots = False
+    spectrum.pics = False
+    spectrum.name = files['data'].replace('.data', '')
+    spectrum.safio = safio
+    spectrum.use_index = use_index
+    spectrum.detector = make_detector(safio)
+    emin, emax, phimin, phimax, thmin, thmax = limits(safio)
+    spectrum.clean(emin=emin, emax=emax, phimin=phimin, phimax=phimax, thmin=thmin, thmax=thmax)
+    return spectrum
+
+def candidate_clean(files, make_detector, use_index=False):
+    spectrum = make_spectrum(files, make_detector, use_index)
+    detections = spectrum.detector.detections
+    return {'index': detections.index, 'failed': np.array([len(spectrum.stuck),\
+            len(spectrum.buried), len(spectrum.other_failed)])}
+
+def candidate_spectrum(files):
+    spectrum = make_spectrum(files, spot_detector)
+    energy, intensity, scale = spectrum.detector.computeSpectrumE(spectrum.safio.ESIZE, 512, False)
+    return {'energy': energy, 'intensity': intensity}
+
+def candidate_theta_e(files):
+    spectrum = make_spectrum(files, stripe_detector)
+    img, x, size = spectrum.thetaEImage()
+    return {'image': img}
+
+def candidate_process_data(files):
+    spec = load_spec.Spec(files['spec'])
+    spec.process_data(d_phi=10)
+    return {'img': spec.img, 'theta_phi': spec.theta_phi}
+
+# Fits of each column of the .spec image, as done by the GUI
+def fit_spec(files):
+    spec = load_spec.Spec(files['spec'])
+    spec.process_data(d_phi=10)
+    axis = esa.make_axis(spec.e_range[0], spec.e_range[1], spec.energy, spec.img.shape[0]) * spec.energy
+    spec.min_e = 0
+    spec.e_res = spec.energy / 100
+    spec.winv = 5
+    spec.integrate = detect.integrate
+    spec.try_fit(esa.fit_esa, axis, None)
+    X, Y, S = spec.fit_points
+    return {'theta': np.array(X), 'energy': np.array(Y), 'width': np.array(S)}
+
+# Makes the reference outputs, name -> {output: array}
+def make_references(files):
+    refs = {}
+    print("Running reference clean")
+    refs['clean_spot'] = reference_clean(files, reference_spot)
+    refs['clean_stripe'] = reference_clean(files, reference_stripe)
+    refs['clean_stripe_wrap'] = reference_clean(files, reference_stripe_wrap)
+    print("Running reference integrate")
+    refs['spectrum'] = reference_spectrum(files, refs['clean_spot'])
+    print("Running reference binning")
+    refs['theta_e'] = reference_theta_e(files, refs['clean_stripe'])
+    print("Running reference process_data")
+    refs['process_data'] = reference_process_data(files)
+    print("Running reference fits")
+    refs['fit_esa'] = reference_fit(files, refs['process_data']['img'])
+    check_references(files, refs)
+    return refs
+
+# Makes sure the references have something in them, so the cases can't
+# pass by comparing empty outputs
+def check_references(files, refs):
+    for name in ['clean_spot', 'clean_stripe', 'clean_stripe_wrap']:
+        if len(refs[name]['index']) == 0:
+            raise ValueError("No detections for {} in {}".format(name, files['data']))
+    if np.count_nonzero(refs['theta_e']['image'].sum(axis=1)) < 2:
+        raise ValueError("The theta vs energy image of {} only uses one energy".format(files['data']))
+    if refs['process_data']['img'].sum() == 0:
+        raise ValueError("No counts near the phi of {}, delete it so it is remade".format(files['spec']))
+    for output, values in refs['fit_esa'].items():
+        if len(values) == 0:
+            raise ValueError("No fits found in {}".format(files['spec']))
+
+# Cases: (name, reference, candidate, {output: (kind, tolerance)}), kind is
+# 'array' or 'selection'.
+CASES = [
+    ('clean', 'clean_spot', lambda f: candidate_clean(f, spot_detector),\
+        {'index': ('selection', 0), 'failed': ('array', 0)}),
+    ('clean_indexed', 'clean_spot', lambda f: candidate_clean(f, spot_detector, True),\
+        {'index': ('selection', 0), 'failed': ('array', 0)}),
+    ('clean_stripe', 'clean_stripe', lambda f: candidate_clean(f, stripe_detector),\
+        {'index': ('selection', 0), 'failed': ('array', 0)}),
+    ('clean_stripe_indexed', 'clean_stripe', lambda f: candidate_clean(f, stripe_detector, True),\
+        {'index': ('selection', 0), 'failed': ('array', 0)}),
+    ('clean_stripe_wrap', 'clean_stripe_wrap', lambda f: candidate_clean(f, stripe_wrap_detector),\
+        {'index': ('selection', 0), 'failed': ('array', 0)}),
+    ('clean_stripe_wrap_indexed', 'clean_stripe_wrap', lambda f: candidate_clean(f, stripe_wrap_detector, True),\
+        {'index': ('selection', 0), 'failed': ('array', 0)}),
+    ('integrate', 'spectrum', candidate_spectrum,\
+        {'energy': ('array', 1e-12), 'intensity': ('array', 1e-5)}),
+    ('theta_e_image', 'theta_e', candidate_theta_e,\
+        {'image': ('array', 0)}),
+    ('process_data', 'process_data', candidate_process_data,\
+        {'img': ('array', 1e-9), 'theta_phi': ('array', 1e-9)}),
+    ('fit_esa', 'fit_esa', fit_spec,\
+        {'theta': ('array', 1e-9), 'energy': ('array', 1e-4), 'width': ('array', 1e-4)}),
+]
+
+# Maximum deviation between the reference and candidate output
+def deviation(kind, ref, new):
+    ref = np.asarray(ref)
+    new = np.asarray(new)
+    if kind == 'selection':
+        ref = np.unique(ref.astype(np.int64))
+        new = np.unique(new.astype(np.int64))
+        return float(len(np.setxor1d(ref, new)))
+    if ref.shape != new.shape:
+        return math.inf
+    if ref.size == 0:
+        return 0.0
+    return float(np.max(np.abs(ref.astype(float) - new.astype(float))))
+
+# Key for the cache, this changes if any of the files do
+def cache_key(files):
+    parts = [str(REFERENCE_VERSION)]
+    for ext in sorted(files.keys()):
+        stat = os.stat(files[ext])
+        parts.append('{}:{}:{}'.format(ext, stat.st_size, stat.st_mtime))
+    return ';'.join(parts)
+
+# The reference outputs for files, from the cache if it is up to date
+def load_references(files, directory, refresh=False):
+    cache_file = os.path.join(directory, 'golden.npz')
+    key = cache_key(files)
+    if not refresh and os.path.isfile(cache_file):
+        with np.load(cache_file) as cache:
+            if str(cache['key']) == key:
+                refs = {}
+                for name in cache.files:
+                    if '/' in name:
+                        ref, output = name.split('/')
+                        refs.setdefault(ref, {})[output] = cache[name]
+                return refs
+    refs = make_references(files)
+    arrays = {'key': key}
+    for ref, outputs in refs.items():
+        for output, value in outputs.items():
+            arrays[ref + '/' + output] = value
+    np.savez(cache_file, **arrays)
+    return refs
+
+# Runs the cases, returns a list of (case, output, deviation, tolerance, ok)
+def run_cases(files, refs, only=None):
+    report = []
+    for name, ref_name, candidate, outputs in CASES:
+        if only is not None and name not in only:
+            continue
+        new = candidate(files)
+        for output, (kind, tolerance) in outputs.items():
+            dev = deviation(kind, refs[ref_name][output], new[output])
+            report.append((name, output, dev, tolerance, dev <= tolerance))
+    return report
+
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--scales", nargs='+', default=['10k'], choices=list(synthetic.SCALES.keys()),\
+                        help="Scales to run at")
+    parser.add_argument("-d", "--directory", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'),\
+                        help="Where the synthetic files and the cached references go")
+    parser.add_argument("-t", "--template", help="SAFARI .input file to base the synthetic files on")
+    parser.add_argument("-c", "--cases", nargs='+', help="Only run these cases")
+    parser.add_argument("-r", "--refresh", help="Remake the cached reference outputs", action='store_true')
+    parser.add_argument("-o", "--output", help="Save the report to this .json file")
+    args = parser.parse_args()
+
+    failed = 0
+    out = {}
+    for scale in args.scales:
+        directory = os.path.join(args.directory, scale)
+        files = synthetic.make_all(directory, scale, args.template)
+        refs = load_references(files, directory, args.refresh)
+        report = run_cases(files, refs, args.cases)
+        print("{:<6} {:<26} {:<12} {:>12} {:>12}".format('Scale', 'Case', 'Output', 'Deviation', 'Tolerance'))
+        for name, output, dev, tolerance, ok in report:
+            print("{:<6} {:<26} {:<12} {:>12.4g} {:>12.4g} {}".format(scale, name, output, dev, tolerance,\
+                                                                     'ok' if ok else 'FAILED'))
+            if not ok:
+                failed = failed + 1
+        out[scale] = [{'case': name, 'output': output, 'deviation': dev, 'tolerance': tolerance, 'ok': ok}\
+                      for name, output, dev, tolerance, ok in report]
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(out, f, indent=2)
+
+    if failed > 0:
+        print("{} outputs differ by more than their tolerance".format(failed))
+        sys.exit(1)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import argparse     # Parsing command line arguments
+import json         # Saving and comparing the results
+import os           # Path related stuff
+import platform     # Recording what this was run on
+import sys          # Exit code for regressions
+import time         # Timing things
+
+import numpy as np  # Random points for the lookups
+import matplotlib   # Plotting, without showing anything
+matplotlib.use('Agg')
+
+import synthetic    # Makes the input files, this also finds the modules below
+
+import data_files.safari_input as safari_input
+import data_files.detect_processor as detect
+import spec_files.load_spec as load_spec
+import spec_files.fit_esa as esa
+import misc.timing as timing
+
+# Times the main analysis pipelines on synthetic data, eg:
+#
+#     python benchmarks/run_benchmarks.py -s 10k 1m -o results.json
+#     python benchmarks/run_benchmarks.py -s 10k 1m -c results.json
+#
+# The second compares against the first, and exits with 1 if anything got
+# slower by more than its threshold. The synthetic files are made the first
+# time, in benchmarks/data/<scale>, and reused after that.
+
+# A case is slower if new/old best time is more than this, unless it is
+# listed in THRESHOLDS. Differences under MIN_DELTA seconds are ignored.
+THRESHOLD = 1.2
+THRESHOLDS = {
+    # These include matplotlib, which varies more between runs
+    'plotThetaE': 1.5,
+    'try_fit': 1.3,
+}
+MIN_DELTA = 0.005
+
+# Runs fn repeat times, after setup() each time, returns the times taken
+def measure(fn, setup=None, repeat=3):
+    runs = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+# Forgets the loaded datasets, and the .npz sidecar if sidecar
+def forget_dataset(filename, sidecar):
+    detect._datasets.clear()
+    cache_file = detect.getCacheFile(filename)
+    if sidecar and os.path.isfile(cache_file):
+        os.remove(cache_file)
+
+def make_spectrum(files, theta, size):
+    safio = safari_input.SafariInput(files['input'])
+    spectrum = detect.Spectrum()
+    spectrum.plots = False
+    spectrum.pics = False
+    spectrum.name = files['data'].replace('.data', '')
+    spectrum.safio = safio
+    spectrum.detector = detect.SpotDetector(theta, safio.PHI0, size)
+    return spectrum
+
+def clean(spectrum):
+    spectrum.clean(emin=0, emax=1e6, phimin=-180, phimax=180, thmin=0, thmax=90)
+
+# Times each of the pipelines for the files, returns name -> times
+def run_cases(files, repeat):
+    results = {}
+    data_file = files['data']
+
+    results['load'] = measure(lambda: detect.loadDataset(data_file),\
+                              lambda: forget_dataset(data_file, True), repeat)
+    results['load_cached'] = measure(lambda: detect.loadDataset(data_file),\
+                              lambda: forget_dataset(data_file, False), repeat)
+
+    # Big spot detector, so there is plenty in it for the later stages
+    spectrum = make_spectrum(files, 45, 20)
+    def reset():
+        spectrum.last_set = None
+    results['clean'] = measure(lambda: clean(spectrum), reset, repeat)
+    spectrum.use_index = True
+    results['clean_indexed'] = measure(lambda: clean(spectrum), reset, repeat)
+    # Without the accumulator from last time, so it integrates everything
+    def reset_spectrum():
+        spectrum.detector.accumulator = None
+    results['spectrumE'] = measure(lambda: spectrum.detector.computeSpectrumE(\
+                                   spectrum.safio.ESIZE, 512, False), reset_spectrum, repeat)
+
+    # Wide stripe, as used for the energy vs theta images
+    stripe = make_spectrum(files, 45, 20)
+    stripe.detector = detect.StripeDetector(0, 90, stripe.safio.PHI0, 10)
+    clean(stripe)
+    plt = detect.pyplot()
+    results['plotThetaE'] = measure(stripe.plotThetaE, lambda: plt.close('all'), repeat)
+    plt.close('all')
+
+    # Clicking on the impact plot looks up the nearest detection
+    detections = spectrum.detector.detections
+    points = np.random.default_rng(1).uniform(0, 10, (100, 2))
+    def lookups():
+        for px, py in points:
+            detect.nearestPoint(detections.x, detections.y, px, py)
+    results['nearest_x100'] = measure(lookups, None, repeat)
+
+    results['spec_load'] = measure(lambda: load_spec.Spec(files['spec']), None, repeat)
+    spec = load_spec.Spec(files['spec'])
+    results['process_data'] = measure(lambda: spec.process_data(d_phi=10), None, repeat)
+    # Otherwise try_fit would just be timing fitting nothing
+    if spec.img.sum() == 0:
+        print("No counts near phi = {} in {}, delete it so it is remade".format(spec.phi, files['spec']))
+        sys.exit(1)
+    axis = esa.make_axis(spec.e_range[0], spec.e_range[1], spec.energy, spec.img.shape[0]) * spec.energy
+    spec.min_e = 0
+    spec.e_res = spec.energy / 100
+    spec.winv = 5
+    spec.integrate = detect.integrate
+    results['try_fit'] = measure(lambda: spec.try_fit(esa.fit_esa, axis, None), None, repeat)
+    if len(spec.fit_points[0]) == 0:
+        print("No fits found in {}".format(files['spec']))
+        sys.exit(1)
+    return results
+
+# Best and mean of each case
+def summarise(results):
+    summary = {}
+    for name, runs in results.items():
+        summary[name] = {'best': min(runs), 'mean': sum(runs) / len(runs), 'runs': runs}
+    return summary
+
+# Compares new against old, prints the ratios, returns the regressions
+def compare(old, new):
+    slower = []
+    print("{:<6} {:<16} {:>10} {:>10} {:>7}".format('Scale', 'Case', 'Old (s)', 'New (s)', 'Ratio'))
+    for scale, cases in new['results'].items():
+        for name, values in cases.items():
+            if name not in old['results'].get(scale, {}):
+                continue
+            before = old['results'][scale][name]['best']
+            after = values['best']
+            ratio = after / before if before > 0 else 1
+            limit = THRESHOLDS.get(name, THRESHOLD)
+            flag = ''
+            if ratio > limit and after - before > MIN_DELTA:
+                flag = ' SLOWER'
+                slower.append((scale, name, ratio))
+            print("{:<6} {:<16} {:>10.4f} {:>10.4f} {:>7.2f}{}".format(scale, name, before, after, ratio, flag))
+    return slower
+
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--scales", nargs='+', default=['10k'], choices=list(synthetic.SCALES.keys()),\
+                        help="Scales to run at")
+    parser.add_argument("-d", "--directory", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'),\
+                        help="Where the synthetic files go")
+    parser.add_argument("-t", "--template", help="SAFARI .input file to base the synthetic files on")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of runs of each case")
+    parser.add_argument("-o", "--output", help="Save the results to this .json file")
+    parser.add_argument("-c", "--compare", help="Compare against the results in this .json file")
+    args = parser.parse_args()
+
+    timing.enabled = True
+    out = {
+        'meta': {'time': time.strftime("%Y-%m-%d %H:%M:%S"), 'python': platform.python_version(),\
+                 'numpy': np.__version__, 'machine': platform.platform(), 'repeat': args.repeat},
+        'results': {},
+        'stages': {},
+    }
+    for scale in args.scales:
+        files = synthetic.make_all(os.path.join(args.directory, scale), scale, args.template)
+        print("Running {}".format(scale))
+        timing.reset()
+        out['results'][scale] = summarise(run_cases(files, args.repeat))
+        out['stages'][scale] = timing.report()
+        for name, values in out['results'][scale].items():
+            print("{:<16} {:>10.4f}s best {:>10.4f}s mean".format(name, values['best'], values['mean']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(out, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            old = json.load(f)
+        slower = compare(old, out)
+        if len(slower) > 0:
+            print("{} cases got slower".format(len(slower)))
+            sys.exit(1)
@@ -0,0 +1,167 @@
+import os           # Path related stuff
+import sys          # Finding the other modules
+import numpy as np  # Making the data
+
+# The repo root, so data_files, spec_files and misc can be imported
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import data_files.safari_input as safari_input
+import data_files.detect_processor as detect
+
+# Makes synthetic SAFARI output files, for the benchmarks. These are not
+# physically meaningful, but have the same formats, sizes and rough shape
+# (failed trajectories, peaks in the spectra, etc) as real runs.
+
+# Sizes of each file for each scale, the name is the number of .data rows,
+# spec is (energy, theta, phi) bins, traj is time steps and crys is the
+# number of unit cells in (x, y, z)
+SCALES = {
+    '10k': {'rows': 10000, 'spec': (50, 20, 10), 'traj': 1000, 'crys': (6, 6, 4)},
+    '1m': {'rows': 1000000, 'spec': (100, 90, 36), 'traj': 100000, 'crys': (25, 25, 8)},
+    '10m': {'rows': 10000000, 'spec': (200, 90, 72), 'traj': 1000000, 'crys': (80, 80, 10)},
+}
+
+# The input file, from template if given, otherwise the defaults
+def make_input(filename, template=None):
+    safio = safari_input.SafariInput(template if template is not None else filename)
+    safio.save(filename)
+    safio = safari_input.SafariInput(filename)
+    return safio
+
+# Change this when the files made below change, so old ones are remade
+VERSION = 2
+
+# .data file with rows trajectories, 5% of these are failed ones. 1% are
+# exactly on phi = 0 or +-180, where the stripe detector wraps around.
+def make_data(filename, safio, rows, seed=1, block=1000000):
+    rng = np.random.default_rng(seed)
+    with open(filename, 'w') as f:
+        f.write('x\ty\tz\tE\ttheta\tphi\tindex\tweight\tdelta_t\tn_steps\n')
+        for start in range(0, rows, block):
+            n = min(block, rows - start)
+            x = rng.uniform(safio.XSTART, safio.XSTOP, n)
+            y = rng.uniform(safio.YSTART, safio.YSTOP, n)
+            z = rng.uniform(-2, 0, n)
+            e = rng.uniform(safio.EMIN, safio.E0, n)
+            theta = rng.uniform(0, 90, n)
+            phi = rng.uniform(-180, 180, n)
+            wrap = rng.random(n) < 0.01
+            phi[wrap] = rng.choice([0.0, 180.0, -180.0], np.count_nonzero(wrap))
+            fail = rng.random(n)
+            e[fail < 0.02] = -100
+            e[(fail >= 0.02) & (fail < 0.04)] = -200
+            e[(fail >= 0.04) & (fail < 0.05)] = -5
+            index = np.arange(start + 1, start + n + 1)
+            detect.writeColumns(f, (x, y, z, e, theta, phi, index,\
+                                    np.ones(n), np.zeros(n), np.zeros(n)), '%.8g')
+
+# .spec file with the given (energy, theta, phi) bins, each theta has a
+# peak in energy which moves with theta, so there is something to fit. The
+# phi bins go all the way round, with one on PHI0, as Spec.process_data
+# only uses the bins near it. The counts are the expected ones, without
+# noise, so each column has one clear peak, and its fit comes out the same
+# every time for golden.py.
+def make_spec(filename, safio, bins):
+    n_e, n_t, n_p = bins
+    e_min, e_max = 0, safio.E0
+    t_min, t_max = 0, 90
+    p_min = safio.PHI0 - (n_p // 2) * 360 / n_p
+    p_max = p_min + 360
+    energy = (np.arange(n_e) + 0.5) * (e_max - e_min) / n_e + e_min
+    theta = (np.arange(n_t) + 0.5) * (t_max - t_min) / n_t + t_min
+    peak = safio.E0 * (0.5 + 0.4 * theta / 90)
+    width = safio.E0 * 0.03
+    # energy x theta shape, same for every phi
+    shape = 200 * np.exp(-(energy[:,None] - peak[None,:])**2 / (2 * width**2))
+    counts = np.rint(shape[:,:,None] * np.ones(n_p)).astype(int)
+
+    dashes = '--------------------------------------------------------'
+    with open(filename, 'w') as f:
+        f.write('Synthetic spectrum\n')
+        f.write(dashes + '\n')
+        f.write('Energy range: {} to {}\n'.format(e_min, e_max))
+        f.write('Theta range: {} to {}\n'.format(t_min, t_max))
+        f.write('Phi range: {} to {}\n'.format(p_min, p_max))
+        f.write('Energy: {}\n'.format(safio.E0))
+        f.write('Theta: {}\n'.format(safio.THETA0))
+        f.write('Phi: {}\n'.format(safio.PHI0))
+        f.write('Total Counts: {}\n'.format(int(counts.sum())))
+        f.write(dashes + '\n')
+        header = '\t\t' + '\t'.join('{:.2f}'.format(p) for p in\
+                  np.linspace(p_min, p_max, n_p, endpoint=False)) + '\n'
+        line = '\t{:.2f}\t' + '\t'.join(['%d'] * n_p) + '\n'
+        for i in range(n_e):
+            f.write('{:.2f}\n'.format(energy[i]))
+            f.write(header)
+            for j in range(n_t):
+                f.write(line.format(theta[j]) % tuple(counts[i, j]))
+
+# .traj file with steps time steps, the ion comes in, bounces off the
+# surface, and leaves again.
+def make_traj(filename, safio, steps, seed=1):
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 200, steps)
+    dt = np.full(steps, t[1] - t[0])
+    x = (safio.XSTART + safio.XSTOP) / 2 + 0.05 * t
+    y = (safio.YSTART + safio.YSTOP) / 2 + 0.02 * t
+    z = 5 + np.abs(t - 100) * 0.1 + rng.normal(0, 0.01, steps)
+    px = np.gradient(x, t)
+    py = np.gradient(y, t)
+    pz = np.gradient(z, t)
+    V = 10 * np.exp(-(t - 100)**2 / 50)
+    # Loses some energy in the collision
+    E = safio.E0 - rng.uniform(20, 80) / (1 + np.exp(-(t - 100) / 2))
+    T = E - V
+    n = np.arange(steps)
+    near = rng.integers(0, 10, steps)
+    with open(filename, 'w') as f:
+        f.write('x\ty\tz\tpx\tpy\tpz\tt\tn\tT\tV\tE\tnear\tdt\n')
+        detect.writeColumns(f, (x, y, z, px, py, pz, t, n, T, V, E, near, dt), '%.8g')
+
+# .crys file for cells unit cells of the lattice of the input file
+def make_crys(filename, safio, cells):
+    nx, ny, nz = cells
+    sites = []
+    for i in range(nx):
+        for j in range(ny):
+            for k in range(nz):
+                for basis in safio.BASIS:
+                    atom = safio.ATOMS[int(basis[3]) - 1]
+                    sites.append([(i + basis[0]) * safio.AX, (j + basis[1]) * safio.AY,\
+                                  -(k + basis[2]) * safio.AZ, atom[1], atom[0]])
+    sites = np.array(sites)
+    with open(filename, 'w') as f:
+        detect.writeColumns(f, sites.T, '%.6g')
+
+# Makes the files for the scale in directory, named syn.input, syn.data etc.
+# Files which already exist are kept, unless force, or they were made by
+# another VERSION. Returns the paths.
+def make_all(directory, scale, template=None, force=False):
+    sizes = SCALES[scale]
+    os.makedirs(directory, exist_ok=True)
+    version_file = os.path.join(directory, 'version.txt')
+    version = None
+    if os.path.isfile(version_file):
+        with open(version_file, 'r') as f:
+            version = f.read().strip()
+    if version != str(VERSION):
+        force = True
+    base = os.path.join(directory, 'syn')
+    files = dict((ext, base + '.' + ext) for ext in ['input', 'data', 'spec', 'traj', 'crys'])
+    if force or not os.path.isfile(files['input']):
+        safio = make_input(files['input'], template)
+    else:
+        safio = safari_input.SafariInput(files['input'])
+    makers = {
+        'data': lambda f: make_data(f, safio, sizes['rows']),
+        'spec': lambda f: make_spec(f, safio, sizes['spec']),
+        'traj': lambda f: make_traj(f, safio, sizes['traj']),
+        'crys': lambda f: make_crys(f, safio, sizes['crys']),
+    }
+    for ext, maker in makers.items():
+        if force or not os.path.isfile(files[ext]):
+            print("Making {}".format(files[ext]))
+            maker(files[ext])
+    with open(version_file, 'w') as f:
+        f.write(str(VERSION))
+    return files
@@ -0,0 +1,126 @@
+import os                                            # Path related stuff
+import numpy as np                                   # General array stuff.
+
+# The crystal from a .crys file, as used by the impact plots, and the 3D
+# crystal and trajectory plots. Each line of the file is one atom:
+#
+#   x y z atomic_number mass
+#
+# The file is parsed once into arrays, and kept by loadCrystal until it
+# changes, along with a grid of the atoms in x and y for region queries.
+
+# path -> (mtime, size, Crystal)
+_crystals = {}
+
+# The .crys file for name, which may also be the .input or .dbug file
+def getCrystalFile(name):
+    for ext in ['.dbug', '.input', '.crys']:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return name + '.crys'
+
+# Parses the .crys file into an (atoms, 5) array, lines without 5 values
+# are skipped.
+def parseCrystalFile(filename):
+    try:
+        return np.loadtxt(filename, usecols=range(5), ndmin=2)
+    except (ValueError, IndexError):
+        rows = []
+        with open(filename, 'r') as f:
+            for line in f:
+                args = line.split()
+                if len(args) != 5:
+                    continue
+                try:
+                    rows.append([float(x) for x in args])
+                except ValueError:
+                    continue
+        return np.array(rows).reshape(-1, 5)
+
+# Loads the crystal for name, see getCrystalFile. This is reused until the
+# file changes, so the returned Crystal should not be modified.
+def loadCrystal(name):
+    filename = getCrystalFile(name)
+    stat = os.stat(filename)
+    cached = _crystals.get(filename)
+    if cached is not None and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached[2]
+    crys = Crystal(parseCrystalFile(filename))
+    _crystals[filename] = (stat.st_mtime, stat.st_size, crys)
+    return crys
+
+class Crystal:
+
+    # sites is the (atoms, 5) array from parseCrystalFile, cell is the size
+    # of the grid cells for the region queries, in Å.
+    def __init__(self, sites, cell=5.0):
+        self.sites = sites
+        self.x = np.ascontiguousarray(sites[:,0])
+        self.y = np.ascontiguousarray(sites[:,1])
+        self.z = np.ascontiguousarray(sites[:,2])
+        self.atomic_number = np.ascontiguousarray(sites[:,3])
+        self.mass = np.ascontiguousarray(sites[:,4])
+        self.cell = cell
+        # depth -> sorted indices, see surface
+        self.surfaces = {}
+
+        # The grid, atoms are sorted by the cell they are in, cell (i, j)
+        # is key i * ny + j, and its atoms are order[starts[key]:starts[key+1]]
+        self.x0 = np.min(self.x) if len(self) > 0 else 0
+        self.y0 = np.min(self.y) if len(self) > 0 else 0
+        self.nx = int((np.max(self.x) - self.x0) // cell) + 1 if len(self) > 0 else 1
+        self.ny = int((np.max(self.y) - self.y0) // cell) + 1 if len(self) > 0 else 1
+        keys = self.cells(self.x, self.y)
+        self.order = np.argsort(keys, kind='stable')
+        self.starts = np.searchsorted(keys[self.order], np.arange(self.nx * self.ny + 1))
+
+    def __len__(self):
+        return len(self.x)
+
+    # Grid keys of the points x, y
+    def cells(self, x, y):
+        i = np.clip(((x - self.x0) // self.cell).astype(np.int64), 0, self.nx - 1)
+        j = np.clip(((y - self.y0) // self.cell).astype(np.int64), 0, self.ny - 1)
+        return i * self.ny + j
+
+    # Indices of the atoms with x_min <= x <= x_max and y_min <= y <= y_max,
+    # and z >= z_min if given, in file order.
+    def region(self, x_min, x_max, y_min, y_max, z_min=None):
+        i0 = max(int((x_min - self.x0) // self.cell), 0)
+        i1 = min(int((x_max - self.x0) // self.cell), self.nx - 1)
+        j0 = max(int((y_min - self.y0) // self.cell), 0)
+        j1 = min(int((y_max - self.y0) // self.cell), self.ny - 1)
+        if i0 > i1 or j0 > j1:
+            return np.zeros(0, dtype=np.int64)
+        # Each row of cells in the range is one run of the sorted atoms
+        runs = [self.order[self.starts[i * self.ny + j0]:self.starts[i * self.ny + j1 + 1]]\
+                for i in range(i0, i1 + 1)]
+        found = np.sort(np.concatenate(runs))
+        x, y = self.x[found], self.y[found]
+        mask = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        if z_min is not None:
+            mask &= self.z[found] >= z_min
+        return found[mask]
+
+    # Indices of the atoms within margin of the path px, py, pz in x and y,
+    # and from the surface down to margin below its lowest point.
+    def near(self, px, py, pz, margin=5):
+        return self.region(np.min(px) - margin, np.max(px) + margin,\
+                           np.min(py) - margin, np.max(py) + margin,\
+                           np.min(pz) - margin)
+
+    # Indices of the atoms no deeper than depth below z = 0, see BDIST,
+    # sorted by z, deepest first. These are kept for each depth.
+    def surface(self, depth):
+        found = self.surfaces.get(depth)
+        if found is None:
+            found = np.nonzero(self.z >= -depth)[0]
+            found = found[np.argsort(self.z[found], kind='stable')]
+            self.surfaces[depth] = found
+        return found
+
+    # The atoms at indices as a list of [x, y, z, atomic_number, mass]
+    def rows(self, indices=None):
+        if indices is None:
+            return self.sites.tolist()
+        return self.sites[indices].tolist()
@@ -1,19 +1,27 @@
 #!/usr/bin/env python3
 
 import os                          # Path related things
+import sys                         # Finding misc
 import numpy as np                 # used to make the frange
 import argparse                    # Parsing arguments
 from functools import cmp_to_key   # Used to sort files by phi
-#if you utilize the following two lines you will be able to run 
-#the figures in here. This requires changing the backend of the fig.show()
-#for more backend choices please see https://matplotlib.org/tutorials/introductory/usage.html#what-is-a-backend
-import matplotlib                  # Plotting
-#Qt5Agg is the backend
-matplotlib.use('Qt5Agg')
-import matplotlib.pyplot as plt    # Plotting
+# misc is in the directory above this one
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import misc.timing as timing       # Stage timings
 import safari_input                # parsing the input files
 import detect_processor as detect  # Main detector code
 
+# matplotlib is only imported by the modes that actually show figures.
+def pyplot():
+    #if you utilize the following two lines you will be able to run 
+    #the figures in here. This requires changing the backend of the fig.show()
+    #for more backend choices please see https://matplotlib.org/tutorials/introductory/usage.html#what-is-a-backend
+    import matplotlib                  # Plotting
+    #Qt5Agg is the backend
+    matplotlib.use('Qt5Agg')
+    import matplotlib.pyplot as plt    # Plotting
+    return plt
+
 def frange(start, end, step):
     return np.arange(start, end, step)
 
@@ -32,7 +40,7 @@ def compare_file_name(file1, file2):
         o2 = 2e5
     return o1-o2
 
-def process_from_file(filename, size):
+def process_from_file(filename, size, write_npz=False):
     axis_orig = []
     areas = []
     the_file = open(filename, 'r')
@@ -51,20 +59,22 @@ def process_from_file(filename, size):
     for i in range(len(areas)):
         print('{}, {}'.format(axis_orig[i], areas[i]))
 
-    process(1000, axis_orig, areas, size, filename.replace('.txt', '_proc.txt'))
+    process(1000, axis_orig, areas, size, filename.replace('.txt', '_proc.txt'), write_npz)
 
-def process(num, axis_orig, areas, size, filename):
+def process(num, axis_orig, areas, size, filename, write_npz=False):
     amax = np.max(axis_orig)
     amin = np.min(axis_orig)
     step = (amax - amin) / num
     axis = np.array([(amin + x*step) for x in range(num)])
-    points = detect.integrate(num, 1.0/size, axis_orig, areas, axis)    
+    points, scale = detect.integrate(num, 1.0/size, axis_orig, areas, axis)
     output = open(filename, 'w')
     output.write('{}\t{}\n'.format('Phi', 'Intensity'))
-    for i in range(len(points)):
-        output.write('{}\t{}\n'.format(str(axis[i]),str(points[i])))
+    detect.writeColumns(output, (axis, points))
+    output.close()
+    if write_npz:
+        np.savez(filename.replace('.txt', '.npz'), phi=axis, intensity=points)
 
-def azimuthal_scan(dir, theta, size=512, res=3, emin=750, emax=1000, norm=True):
+def azimuthal_scan(dir, theta, size=512, res=3, emin=750, emax=1000, norm=True, write_npz=False):
 
     if dir != '.':
         dir = os.path.join('.',dir)
@@ -110,14 +120,12 @@ def azimuthal_scan(dir, theta, size=512, res=3, emin=750, emax=1000, norm=True):
         i = 0
         for filename in datafiles:
             file = os.path.join(dir, '{}.data'.format(filename))
-            safio = safari_input.SafariInput(file.replace('.data', '.input'))
+            safio = safari_input.loadInput(file.replace('.data', '.input'))
             print('loading: '+filename)
-            data = detect.load(file.replace('.data',''))
-            data = detect.load(file.replace('.data',''))
-            print('data loaded')
 
             # Setup the spectrum object for this file
             spectrum = detect.Spectrum()
+            spectrum.progress = detect.ProgressLine()
             spectrum.plots = False
             spectrum.name = ""
             spectrum.pics = False
@@ -133,10 +141,10 @@ def azimuthal_scan(dir, theta, size=512, res=3, emin=750, emax=1000, norm=True):
                 emin = emin_rel * safio.E0
             e_min = min(emin, e_min)
             e_max = max(e_max, safio.E0)
-            spectrum.clean(data, emin=emin)
+            spectrum.clean(emin=emin)
             axis_orig.append(phi)
             plot.append(len(spectrum.detector.detections)*1.0)
-            energy, intenisty, scale = spectrum.detector.spectrumE(safio.ESIZE,size,False)
+            energy, intenisty, scale = spectrum.detector.computeSpectrumE(safio.ESIZE,size,False)
             print("Scale of {}".format(scale))
             if norm:
                 scale = 1.0
@@ -148,15 +156,17 @@ def azimuthal_scan(dir, theta, size=512, res=3, emin=750, emax=1000, norm=True):
         for i in range(len(plot)):
             output.write('{}\t{}\n'.format(str(axis_orig[i]),str(plot[i])))
         output.close()
-        data = []
-        data.append(img)
-        data.append([e_min, e_max, p_max, p_min])
-        data = np.array(data, dtype='object', copy=False)
+        if write_npz:
+            np.savez(os.path.join(dir, file_name + '.npz'), phi=axis_orig, counts=plot,\
+                     img=img, bounds=[e_min, e_max, p_max, p_min])
+        data = np.empty(2, dtype='object')
+        data[0] = img
+        data[1] = [e_min, e_max, p_max, p_min]
         np.save(os.path.join(dir, file_name), data)
 
     img = img / np.max(img)
 
-    fig, ax = plt.subplots()
+    fig, ax = pyplot().subplots()
     im = ax.imshow(img, interpolation="bicubic", extent=(e_min, e_max, p_max, p_min))
     ax.invert_yaxis()
     del_p = (p_max - p_min) # len(datafiles) *
@@ -171,7 +181,7 @@ def azimuthal_scan(dir, theta, size=512, res=3, emin=750, emax=1000, norm=True):
     input('Press Enter to exit')
     return img
 
-def azimuthal_spectrum(dir, theta, size=3, emin=0, emin_rel=0):
+def azimuthal_spectrum(dir, theta, size=3, emin=0, emin_rel=0, write_npz=False):
     if dir != '.':
         dir = os.path.join('.',dir)
     
@@ -191,13 +201,12 @@ def azimuthal_spectrum(dir, theta, size=3, emin=0, emin_rel=0):
 
     for filename in datafiles:
         file = os.path.join(dir, '{}.data'.format(filename))
-        safio = safari_input.SafariInput(file.replace('.data', '.input'))
+        safio = safari_input.loadInput(file.replace('.data', '.input'))
         print('loading: '+filename)
-        data = detect.load(file.replace('.data',''))
-        print('data loaded')
 
         # Setup the spectrum object for this file
         spectrum = detect.Spectrum()
+        spectrum.progress = detect.ProgressLine()
         spectrum.plots = False
         spectrum.name = ""
         spectrum.pics = False
@@ -210,39 +219,46 @@ def azimuthal_spectrum(dir, theta, size=3, emin=0, emin_rel=0):
         phimin = min(phi, phimin)
         if emin_rel!=0:
             emin = emin_rel * safio.E0
-        spectrum.clean(data, emin=emin)
+        spectrum.clean(emin=emin)
         axis_orig.append(phi)
         plot.append(len(spectrum.detector.detections)*1.0)
         areas.append(0)
 
-    output = open(os.path.join(dir, "azimuthal_spectrum_{}_{}_{}_raw.txt".format(theta, size, emin)), 'w')
+    file_name = os.path.join(dir, "azimuthal_spectrum_{}_{}_{}_raw".format(theta, size, emin))
+    output = open(file_name + '.txt', 'w')
     output.write('{}\t{}\n'.format('Phi', 'Counts'))
     for i in range(len(plot)):
         output.write('{}\t{}\n'.format(str(axis_orig[i]),str(plot[i])))
     
     output.close()
+    if write_npz:
+        np.savez(file_name + '.npz', phi=axis_orig, counts=plot)
     input('Press Enter to exit')
 
-def e_theta_loop(dir, theta1, theta2, theta_step):
+def e_theta_loop(dir, theta1, theta2, theta_step, write_npz=False):
     if dir != '.':
         dir = os.path.join('.',dir)
 
     for filename in os.listdir(dir):
         if filename.endswith('.data'):
             file = os.path.join(dir, filename)
-            safio = safari_input.SafariInput(file.replace('.data', '.input'))
-            fig, ax = plt.subplots()
+            safio = safari_input.loadInput(file.replace('.data', '.input'))
+            fig, ax = pyplot().subplots()
             num = 0
             for theta in frange(theta1, theta2, theta_step):
                 print('Theta: '+str(theta))
                 spectrum = detect.Spectrum()
+                spectrum.progress = detect.ProgressLine()
                 spectrum.plots = False
                 spectrum.name = filename.replace('.data','')
+                spectrum.write_npz = write_npz
                 spectrum.safio = safio
                 spectrum.safio.DTECTPAR[0] = theta
                 spectrum.detector = None
+                # Each theta only needs to check the rows near the detector
+                spectrum.use_index = True
                 spectrum.clean()
-                energy, intensity = spectrum.detector.spectrum(res=spectrum.safio.ESIZE)
+                energy, intensity, scale = spectrum.detector.spectrum(res=spectrum.safio.ESIZE)
                 intensity = intensity + num
                 ax.plot(energy, intensity, label=str(theta))
                 num = num + 1
@@ -262,8 +278,13 @@ parser.add_argument("-t", "--theta", help="Theta angle for detector")
 parser.add_argument("-e", "--emin", help="Minimum energy to consider")
 parser.add_argument("-m", "--mode", help="run mode (a,p,t)")
 parser.add_argument("-r", "--emin_rel", help="Relative Minimum energy to consider")
+parser.add_argument("-n", "--npz", help="Also save outputs as .npz", action='store_true')
+parser.add_argument("-j", "--timings", help="Save the time taken by each stage to this .json file")
 args = parser.parse_args()
 
+if args.timings:
+    timing.enabled = True
+
 size = float(input('Detector Size: ')) if not args.size else float(args.size)
 
 mode = 'a'
@@ -275,10 +296,13 @@ if mode == 'a':
     emin = float(input('Minimum Energy: ')) if not args.emin else float(args.emin)
     emin_rel = 0 if not args.emin_rel else float(args.emin_rel)
     dir = input('Input Directory: ') if not args.directory else args.directory
-    # azimuthal_spectrum(dir, theta, size, emin, emin_rel)
-    azimuthal_scan(dir, theta, 512, size, emin, emin_rel)
+    # azimuthal_spectrum(dir, theta, size, emin, emin_rel, write_npz=args.npz)
+    azimuthal_scan(dir, theta, 512, size, emin, emin_rel, write_npz=args.npz)
 
 if mode == 'p':
     filename = args.filename
-    process_from_file(filename, size)
+    process_from_file(filename, size, args.npz)
 
+if args.timings:
+    timing.dump(args.timings)
+    print(timing.report_text())
@@ -15,6 +15,9 @@ import matplotlib                       # Plotting
 #Qt5Agg is the backend
 matplotlib.use('Qt5Agg')
 import matplotlib.pyplot as plt         # Plotting
+import sys                              # Finding misc
+# misc is in the directory above this one, detect_processor needs it
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 import safari_input                     # Loading input files
 import detect_processor as detect       # Main detect code
 import traceback                        # Error handling
@@ -3,6 +3,16 @@ import argparse     # parses command line arguments
 import platform     # Linux vs Windows check
 import os           # os.remove is used for .vmd file
 import time         # sleeps before removing file
+import sys          # Finding data_files
+
+# The repo root, so data_files can be imported when run from in here
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import data_files.single_shot as single_shot
+
+# Runs a single shot, with Sea-Safari then XYZ, and then shows it in VMD.
+# The single shot queue runs the first part with --no_view, so the queue
+# is only held up by the runs, then opens VMD with --view once it is done.
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-i", "--input", help="SAFIO input file")
@@ -12,83 +22,93 @@ parser.add_argument("-y", "--y_coord", help="y - impact coordinate")
 parser.add_argument("-r", "--restricted", help="whether the xyz is only nearish particles", action='store_true')
 parser.add_argument("-c", "--colour", help="Colour parameter for xyz")
 parser.add_argument("-s", "--seed", help="Ion index/thermal seed for replicating the thermalization of the surface")
+parser.add_argument("-k", "--cached", help="Reuse the outputs of an earlier run of this shot, if it finished", action='store_true')
+parser.add_argument("--no_view", help="Only run Sea-Safari and XYZ, without opening VMD", action='store_true')
+parser.add_argument("--view", help="Only open VMD, for the outputs of an earlier run", action='store_true')
 args = parser.parse_args()
 
-# Run a single shot safari for this run,
-# assuming the input file 
-# was already configured properly.
-command = './Sea-Safari -i {} -o {} -s -x {} -y {} --seed {}'
-
-if args.restricted:
-    command = './Sea-Safari -i {} -o {} -s -x {} -y {} --seed {} -r'
-
-run_input = args.input
-run_output = args.output
-
-# In this case, drive letters need removing, and replacing `<X>:` with `/mnt/<x>`
-if platform.system() == 'Windows':
-    drive = run_input[0]
-    run_input = run_input.replace(drive+':', '/mnt/{}'.format(drive.lower()))
-    drive = run_output[0]
-    run_output = run_output.replace(drive+':', '/mnt/{}'.format(drive.lower()))
-
-#Format the command
-command = command.format(run_input, run_output, args.x_coord, args.y_coord, args.seed)
-
-if platform.system() == 'Windows':
-    command = 'wsl '+command
-
-subprocess.run(command, shell=True)
-
-xyz_in = run_output + '.xyz'
-fileOut = xyz_in
-
-command = ''
-
-#format input argument for XYZ processor
-if args.colour:
-    fileOut = fileOut.replace('.xyz', '_{}.xyz'.format(args.colour))
-    command = './XYZ -i {} -o {} -c {}'
-    command = command.format(xyz_in, fileOut, args.colour)
-else:
-    command = './XYZ -i {} -o {}'
-    command = command.format(xyz_in, fileOut)
-
-#Run XYZ processor and wait for it to finish.
-if platform.system() == 'Windows':
-    command = 'wsl '+command
-
-print(command)
-
-subprocess.run(command, shell=True)
-
-# MAKE THE FILENAME INCLUDE DIRECTORY
-xyz_in = args.output + '.xyz'
-vmd_file = args.output + '.vmd'
-fileOut = xyz_in
-
-#Replace \ with / in filenames
-fileOut = fileOut.replace('\\','/')
-
-if args.colour:
-    command = "topo readvarxyz {}\n".format(fileOut)
-else:
-    command = "mol new {}\n".format(fileOut)
-
-commands = []
-
-commands.append("color Display Background white\n")
-commands.append("display depthcue off\n") # This fixes washed out colours on white background
-commands.append("mol default style {VDW 1.0 10.0}\n")
-commands.append(command)
-commands.append("display rendermode GLSL\n")
-commands.append("display update\n")
-commands.append("display update ui\n")
-try:
-    with open(vmd_file, "w") as file:
-        file.writelines(commands)
-    subprocess.run(["vmd", "-e", vmd_file])
-finally:
-    time.sleep(5)
-    os.remove(vmd_file)
-
+# Runs Sea-Safari and XYZ, exits with the exit code of whichever failed
+def run():
+    # Run a single shot safari for this run, assuming the input file was
+    # already configured properly. This is the same command as the batches
+    # use, see single_shot.safariCommand
+    command = single_shot.safariCommand(args.input, args.output, args.x_coord, args.y_coord,\
+                                        args.seed, args.restricted)
+
+    # Steps which finished before, see single_shot.markComplete
+    if args.cached and single_shot.isComplete(args.output):
+        print("Using the earlier run of {}".format(args.output))
+        done = single_shot.completedSteps(args.output)
+    else:
+        done = set()
+        if os.path.isfile(args.output + '.done'):
+            os.remove(args.output + '.done')
+        code = subprocess.run(command, shell=True).returncode
+        if code != 0 or not os.path.isfile(args.output + '.traj'):
+            print("Sea-Safari failed for {}".format(args.output))
+            sys.exit(code if code != 0 else 1)
+        single_shot.markComplete(args.output)
+
+    xyz_in = args.output + '.xyz'
+    fileOut = xyz_in
+
+    #format input argument for XYZ processor
+    if args.colour:
+        fileOut = fileOut.replace('.xyz', '_{}.xyz'.format(args.colour))
+        command = './XYZ -i {} -o {} -c {}'
+    else:
+        command = './XYZ -i {} -o {}'
+
+    # In this case, the paths need to be the ones in WSL
+    if platform.system() == 'Windows':
+        command = 'wsl ' + command.format(single_shot.wslPath(xyz_in), single_shot.wslPath(fileOut), args.colour)
+    else:
+        command = command.format(xyz_in, fileOut, args.colour)
+
+    #Run XYZ processor and wait for it to finish.
+    xyz_step = single_shot.xyzStep(args.colour)
+    if xyz_step not in done:
+        print(command)
+        code = subprocess.run(command, shell=True).returncode
+        if code != 0:
+            print("XYZ failed for {}".format(args.output))
+            sys.exit(code)
+        single_shot.markComplete(args.output, xyz_step)
+
+# Opens the outputs in VMD, this waits for VMD to be closed
+def view():
+    # MAKE THE FILENAME INCLUDE DIRECTORY
+    xyz_in = args.output + '.xyz'
+    # One for each colour, as more than one of these can be open at once
+    vmd_file = args.output + ('_{}'.format(args.colour) if args.colour else '') + '.vmd'
+    fileOut = xyz_in
+
+    #Replace \ with / in filenames
+    fileOut = fileOut.replace('\\','/')
+
+    if args.colour:
+        command = "topo readvarxyz {}\n".format(fileOut)
+    else:
+        command = "mol new {}\n".format(fileOut)
+
+    commands = []
+
+    commands.append("color Display Background white\n")
+    commands.append("display depthcue off\n") # This fixes washed out colours on white background
+    commands.append("mol default style {VDW 1.0 10.0}\n")
+    commands.append(command)
+    commands.append("display rendermode GLSL\n")
+    commands.append("display update\n")
+    commands.append("display update ui\n")
+    try:
+        with open(vmd_file, "w") as file:
+            file.writelines(commands)
+        subprocess.run(["vmd", "-e", vmd_file])
+    finally:
+        time.sleep(5)
+        os.remove(vmd_file)
+
+if not args.view:
+    run()
+if not args.no_view:
+    view()
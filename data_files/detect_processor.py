@@ -2,20 +2,116 @@ import math                                          # Used for sin/cos/etc
 import numpy as np                                   # General array stuff.
 import platform                                      # Linux vs Windows Checks
 import os                                            # Path related stuff
-import shutil                                        # Used to copy files.
-import matplotlib                                    # Main plotting
-import matplotlib.pyplot as plt                      # More plotting stuff
-from matplotlib.patches import Circle                # Cirlces on impact plot
-from matplotlib.collections import PatchCollection   # Also for the circles
-import subprocess                                    # For calling XYZ processor
+import subprocess                                    # Opening VMD for single shots
+import threading                                     # Guarding the single shot runs
 import time
 
+import misc.timing as timing                         # Stage timings
+import data_files.crystal as crystal                 # Loading the .crys files
+import misc.processes as processes                   # Queue for single shot runs
+import data_files.single_shot as single_shot          # Single shot inputs
+
 # Used for shift-click functionality
 shift_is_held = False
 
 #Used to toggle tooltips on and off
 tooltips = True
 
+# The long running functions (loading, clean, integrate) call checkpoint()
+# every so often. If cancel_check is set, it is called there, and it can
+# raise to stop the work, eg when it is superseded, see misc/jobs.py
+cancel_check = None
+
+def checkpoint():
+    if cancel_check is not None:
+        cancel_check()
+
+# Single shot runs go through a ProcessQueue, so only a few run at once,
+# this is the one used by detectors without their own ss_queue. There is no
+# GUI to poll it, so finished runs are handled on the watcher threads.
+single_shots = None
+
+def singleShotQueue():
+    global single_shots
+    if single_shots is None:
+        single_shots = processes.ProcessQueue()
+        single_shots.wake = single_shots.poll
+    return single_shots
+
+# The single shots going for each output file, as [Process, [(colour, cmd)]],
+# the first of these is the one running, the rest wait for it, see
+# Detector.run_single_shot
+single_shot_runs = {}
+single_shot_lock = threading.Lock()
+
+# Long running functions also take a progress callback, which is called as
+# progress(stage, done, total, unit), eg ('Loading', bytes read, file size,
+# 'B'), ('Cleaning', rows done, rows, 'rows'), or ('Integrating', points
+# done, points, 'points'). total is 0 if it is not known.
+
+# Keeps track of the throughput for progress calls, and the time left
+class ProgressRate:
+
+    def __init__(self):
+        self.stage = None
+        self.start = 0
+        self.rate = 0
+        self.eta = 0
+
+    # Updates with a progress call, returns (rate, eta) in unit/s and s
+    def update(self, stage, done, total):
+        now = time.time()
+        if stage != self.stage or done == 0:
+            self.stage = stage
+            self.start = now
+        dt = now - self.start
+        self.rate = done / dt if dt > 0 else 0
+        self.eta = (total - done) / self.rate if self.rate > 0 and total > 0 else 0
+        return self.rate, self.eta
+
+    # Text describing the progress, eg 'Loading: 12.0 of 48.0 MB, 30.0 MB/s, 1s left'
+    def describe(self, stage, done, total, unit):
+        scale = 1
+        if unit == 'B':
+            scale = 1e6
+            unit = 'MB'
+        text = "{}: {:.4g}".format(stage, done/scale)
+        if total > 0:
+            text = text + " of {:.4g}".format(total/scale)
+        text = text + " {}".format(unit)
+        if self.rate > 0:
+            text = text + ", {:.4g} {}/s".format(self.rate/scale, unit)
+        if self.eta > 0:
+            text = text + ", {:.0f}s left".format(self.eta)
+        return text
+
+# Progress callback for the command line, this keeps a single line updated
+# with the progress, at most a few times a second.
+class ProgressLine:
+
+    def __init__(self, interval=0.25):
+        self.rate = ProgressRate()
+        self.interval = interval
+        self.last = 0
+        self.width = 0
+
+    def __call__(self, stage, done, total, unit):
+        self.rate.update(stage, done, total)
+        now = time.time()
+        finished = total > 0 and done >= total
+        if now - self.last < self.interval and not finished:
+            return
+        self.last = now
+        text = self.rate.describe(stage, done, total, unit)
+        print('\r' + text.ljust(self.width), end='\n' if finished else '', flush=True)
+        self.width = 0 if finished else len(text)
+
+# matplotlib is only imported once something actually gets plotted, this
+# way the compute functions can run in batch workers without a GUI backend.
+def pyplot():
+    import matplotlib.pyplot as plt
+    return plt
+
 def round_n(x, n):
     if n < 1:
         raise ValueError("number of significant digits must be >= 1")
@@ -24,19 +120,9 @@ def round_n(x, n):
     as_string = format % x
     return float(as_string)
 
+# The crystal for name, see data_files/crystal.py, this is cached there
 def loadCrystal(name):
-
-    name = name.replace('.dbug','').replace('.input','')
-
-    f = open(name+'.crys', 'r')
-    data = []
-    for line in f:
-        arr = line.split()
-        # x, y, z
-        # Z, mass
-        data.append([float(arr[0]),float(arr[1]),float(arr[2]),\
-                     float(arr[3]),float(arr[4])])
-    return data
+    return crystal.loadCrystal(name)
 
 def loadFromText(file):
     f = open(file, 'r', errors='ignore')
@@ -84,6 +170,133 @@ def getDataFile(file):
 def load(file):
     return loadFromText(getDataFile(file))
 
+# Writes the given columns to out as tab separated lines. This formats
+# the whole table at once, rather than line by line. The default format
+# gives the same text as str() of each value.
+def writeColumns(out, columns, fmt='%s'):
+    table = np.column_stack(columns)
+    if len(table) == 0:
+        return
+    line = '\t'.join([fmt] * table.shape[1]) + '\n'
+    out.write((line * len(table)) % tuple(table.ravel().tolist()))
+
+# The binary sidecar for a .data file, this caches the parsed arrays
+def getCacheFile(filename):
+    return filename + '.npz'
+
+# The last few datasets loaded, filename -> (mtime, size, Detections), the
+# most recently used last. Only MAX_DATASETS are kept, so scanning through
+# lots of files doesn't keep all of them in memory.
+_datasets = {}
+MAX_DATASETS = 2
+
+# Parses the .data file into arrays of all of the trajectories, including the
+# failed ones. Columns with the same rules as loadFromText, rows are only kept
+# if they have at least 10 entries, and the first 7 parse as numbers.
+# progress is called with the bytes read so far.
+@timing.timed('parse')
+def parseDataFile(filename, progress=None):
+    size = os.path.getsize(filename)
+    # Fast path, this only works if every line is complete, so check the last one.
+    last = b''
+    with open(filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 4096))
+        lines = f.read().splitlines()
+        if len(lines) > 0:
+            last = lines[-1]
+    if len(last.split()) >= 10:
+        try:
+            # This is done in blocks of lines, so that progress can be reported
+            blocks = []
+            with open(filename, 'r', errors='ignore') as f:
+                read = len(f.readline())
+                while True:
+                    lines = f.readlines(1 << 24)
+                    if len(lines) == 0:
+                        break
+                    checkpoint()
+                    blocks.append(np.loadtxt(lines, usecols=range(7), ndmin=2))
+                    read = read + sum(map(len, lines))
+                    if progress is not None:
+                        progress('Loading', read, size, 'B')
+            if len(blocks) == 0:
+                return np.zeros((0, 7))
+            return np.concatenate(blocks)
+        except ValueError:
+            pass
+    # Otherwise do it line by line, skipping the errored ones.
+    data = []
+    with open(filename, 'r', errors='ignore') as f:
+        n = 0
+        read = 0
+        for line in f:
+            n = n + 1
+            read = read + len(line)
+            if n == 1:
+                continue
+            if n % 65536 == 0:
+                checkpoint()
+                if progress is not None:
+                    progress('Loading', read, size, 'B')
+            arr = line.split()
+            if len(arr) < 10:
+                continue
+            try:
+                data.append([float(arr[0]), float(arr[1]),float(arr[2]),\
+                             float(arr[3]),float(arr[4]),float(arr[5]),\
+                             float(arr[6])])
+            except:
+                continue
+    if progress is not None:
+        progress('Loading', size, size, 'B')
+    return np.array(data).reshape(-1, 7)
+
+# Loads every trajectory in the .data file for file, along with their
+# outgoing directions. The parsed arrays are cached in a binary sidecar,
+# and in memory, so this is only slow the first time for each file.
+# progress is passed on to parseDataFile, if the file needs parsing.
+@timing.timed('open')
+def loadDataset(file, progress=None):
+    filename = getDataFile(file)
+    stat = os.stat(filename)
+    source = np.array([stat.st_mtime, stat.st_size])
+
+    if filename in _datasets:
+        mtime, size, data = _datasets.pop(filename)
+        if mtime == stat.st_mtime and size == stat.st_size:
+            _datasets[filename] = (mtime, size, data)
+            return data
+
+    data = None
+    cache_file = getCacheFile(filename)
+    if os.path.isfile(cache_file):
+        try:
+            # Each array read from the NpzFile is its own copy, so they stay
+            # valid after it is closed
+            with np.load(cache_file) as cache:
+                if np.array_equal(cache['source'], source):
+                    data = Detections(cache['values'], cache['index'], dirs=cache['dirs'])
+        except Exception as err:
+            print("Error reading cache {}, {}".format(cache_file, err))
+
+    if data is None:
+        arr = parseDataFile(filename, progress)
+        data = Detections(arr[...,0:6], arr[...,6])
+        data.dirs = units(arr[...,4], arr[...,5])
+        try:
+            tmp_file = cache_file + '.tmp.npz'
+            np.savez(tmp_file, values=data.values, index=data.index,\
+                     dirs=data.dirs, source=source)
+            os.replace(tmp_file, cache_file)
+        except OSError as err:
+            print("Error writing cache {}, {}".format(cache_file, err))
+
+    _datasets[filename] = (stat.st_mtime, stat.st_size, data)
+    while len(_datasets) > MAX_DATASETS:
+        del _datasets[next(iter(_datasets))]
+    return data
+
 def kinematicFactor(theta_final, theta_inc, massProject, massTarget):
     mu = massProject/massTarget
     theta_tsa = 180 - theta_inc - theta_final
@@ -102,13 +315,14 @@ def unit(theta, phi):
     s = math.sqrt(x*x + y*y + z*z)
     return np.array([x/s, y/s, z/s])
 
-def sort_z(val):
-    return val[2]
+# Array version of unit, gives an (N, 3) float32 array of directions
+def units(theta, phi):
+    th = np.radians(np.asarray(theta, dtype=float))
+    ph = np.radians(np.asarray(phi, dtype=float))
+    sinth = np.sin(th)
+    dirs = np.column_stack((sinth * np.cos(ph), sinth * np.sin(ph), np.cos(th)))
+    return dirs.astype(np.float32)
 
-def sort_basis(basis):
-    basis.sort(key=sort_z)
-    return basis
-    
 # x is an array containing the values to do the gaussian for.
 def gauss(x, winv):
     return np.exp(-x*x*2.*winv*winv)*winv*0.7978845608
@@ -127,7 +341,7 @@ def interp(y_b, y_a, x_b, x_a, x):
     dy = dy_dx * (x - x_b)
     return y_b + dy
 
-def integrate(numpoints, winv, points, areas, axis):
+def integrate(numpoints, winv, points, areas, axis, progress=None):
     # Initializing the array to 0 breaks for some reason.
     intensity = np.array([1e-60 for x in range(numpoints)])
     
@@ -135,6 +349,9 @@ def integrate(numpoints, winv, points, areas, axis):
     
     # We vectorize the maths here, so it only needs 1 loop.
     for i in range(numpoints):
+        checkpoint()
+        if progress is not None and i % 64 == 0:
+            progress('Integrating', i, numpoints, 'points')
         # eArr - energy[i] is the coordinate for the gaussian
         # Intensity of gaussian at this point
         if zero:
@@ -146,15 +363,286 @@ def integrate(numpoints, winv, points, areas, axis):
         if intensity[i] <= 1e-60:
             intensity[i] = 0
             
+    if progress is not None:
+        progress('Integrating', numpoints, numpoints, 'points')
     m = np.max(intensity)
     if m != 0:
         intensity /= m
     return intensity, m
 
+# Bins the points (a, b) into a size by size image, with a along the rows.
+# The size is halved until the brightest pixel has at least 100 counts.
+# Returns the image, the number of points inside the bounds, and the size.
+def binImage(a, b, a_min, a_max, b_min, b_max, size=1024):
+    del_a = a_max - a_min
+    del_b = b_max - b_min
+    a = np.asarray(a, dtype=float) - a_min
+    b = np.asarray(b, dtype=float) - b_min
+    inside = (a >= 0) & (a < del_a) & (b >= 0) & (b < del_b)
+    a = a[inside]
+    b = b[inside]
+    while True:
+        i_a = np.minimum(np.floor(a / (del_a/size)).astype(int), size - 1)
+        i_b = np.minimum(np.floor(b / (del_b/size)).astype(int), size - 1)
+        img = np.bincount(i_a * size + i_b, minlength=size*size)
+        img = img.reshape((size, size)).astype(float)
+        if size <= 2 or np.max(img) >= 100:
+            return img, len(a), size
+        size = int(size / 2)
+
+# Index of the point in x, y nearest to (px, py), or -1 if there are none.
+# Ties go to the first one, like a loop keeping the closest so far.
+def nearestPoint(x, y, px, py):
+    if len(x) == 0:
+        return -1
+    return int(np.argmin((x - px)**2 + (y - py)**2))
+
+# This keeps the un-normalised sum from integrate, so that new points only
+# need their own gaussians added, rather than re-integrating everything.
+class SpectrumAccumulator:
+
+    def __init__(self, axis, winv, chunk=2048):
+        self.axis = np.array(axis, dtype=float)
+        self.winv = winv
+        # Number of points to convert to gaussians at once, this bounds
+        # the temporary (len(axis), chunk) array used for the sums
+        self.chunk = chunk
+        # Sum of the gaussians at each point of axis
+        self.raw = np.zeros(len(self.axis))
+        # Histogram of the points themselves, binned on axis
+        self.counts = np.zeros(len(self.axis))
+        self.total = 0
+
+    # progress is called with the number of points added so far
+    def add(self, batch, areas=None, progress=None):
+        batch = np.asarray(batch, dtype=float)
+        if len(batch) == 0:
+            return
+        if areas is None:
+            areas = np.ones(len(batch))
+        areas = np.asarray(areas, dtype=float)
+
+        for start in range(0, len(batch), self.chunk):
+            checkpoint()
+            points = batch[start:start+self.chunk]
+            weights = areas[start:start+self.chunk]
+            # Each row is one axis point, each column is one of the new points
+            self.raw += gauss(self.axis[:, None] - points[None, :], self.winv).dot(weights)
+            if progress is not None:
+                progress('Integrating', start + len(points), len(batch), 'points')
+
+        if len(self.axis) > 1:
+            step = self.axis[1] - self.axis[0]
+            bins = np.floor((batch - self.axis[0]) / step)
+            inside = (bins >= 0) & (bins < len(self.axis))
+            self.counts += np.bincount(bins[inside].astype(int), weights=areas[inside],\
+                                       minlength=len(self.axis))
+        self.total = self.total + len(batch)
+
+    # Returns the same as integrate would for all of the points added so far
+    def intensity(self):
+        intensity = self.raw.copy()
+        # Cull out values that dont play nicely in excel
+        intensity[intensity <= 1e-60] = 0
+        m = np.max(intensity)
+        if m != 0:
+            intensity /= m
+        return intensity, m
+
+# Compact storage for detections. The old layout was an (N, 8) float64 array of
+#   x, y, z_min, E, Theta, Phi, index, weight
+# Here the first 6 are stored as float32, the index as int32, and the weight
+# is only stored if they are not all 1.0. Indexing as detections[..., n] and
+# detections[i] still gives the old columns and rows.
+class Detections:
+
+    def __init__(self, values=None, index=None, weight=None, dirs=None):
+        if values is None:
+            values = np.zeros((0, 6))
+        # x, y, z_min, E, Theta, Phi
+        self.values = np.asarray(values, dtype=np.float32).reshape(-1, 6)
+        if index is None:
+            index = np.zeros(len(self.values))
+        self.index = np.asarray(index, dtype=np.int32)
+        # None means that every weight is 1.0
+        self.weight = None
+        if weight is not None:
+            self.weight = np.asarray(weight, dtype=np.float32)
+        # Optional (N, 3) unit vectors for the outgoing directions
+        self.dirs = dirs
+
+    # Makes a Detections from rows in the old (N, 8) layout
+    @staticmethod
+    def fromRows(rows):
+        rows = np.asarray(rows, dtype=float).reshape(-1, 8)
+        weight = rows[...,7]
+        if np.all(weight == 1.0):
+            weight = None
+        return Detections(rows[...,0:6], rows[...,6], weight)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, key):
+        # detections[..., n] gives column n of the old layout
+        if isinstance(key, tuple) and len(key) == 2 and key[0] is Ellipsis:
+            return self.column(key[1])
+        # detections[i] gives row i of the old layout
+        if isinstance(key, (int, np.integer)):
+            return self.row(key)
+        # Anything else is a selection (slice, mask or indices)
+        return self.select(key)
+
+    @property
+    def x(self):
+        return self.values[...,0]
+
+    @property
+    def y(self):
+        return self.values[...,1]
+
+    @property
+    def z(self):
+        return self.values[...,2]
+
+    @property
+    def energy(self):
+        return self.values[...,3]
+
+    @property
+    def theta(self):
+        return self.values[...,4]
+
+    @property
+    def phi(self):
+        return self.values[...,5]
+
+    @property
+    def weights(self):
+        if self.weight is None:
+            return np.ones(len(self.values), dtype=np.float32)
+        return self.weight
+
+    def column(self, n):
+        if n == 6:
+            return self.index
+        if n == 7:
+            return self.weights
+        return self.values[...,n]
+
+    def row(self, i):
+        weight = 1.0 if self.weight is None else self.weight[i]
+        return np.array([*self.values[i], self.index[i], weight], dtype=float)
+
+    # Returns the old (N, 8) float64 layout
+    def rows(self):
+        return np.column_stack((self.values, self.index, self.weights)).astype(float)
+
+    def select(self, key):
+        weight = None if self.weight is None else self.weight[key]
+        dirs = None if self.dirs is None else self.dirs[key]
+        return Detections(self.values[key], self.index[key], weight, dirs)
+
+    def concatenate(self, other):
+        weight = None
+        if self.weight is not None or other.weight is not None:
+            weight = np.concatenate((self.weights, other.weights))
+        dirs = None
+        if self.dirs is not None and other.dirs is not None:
+            dirs = np.concatenate((self.dirs, other.dirs))
+        return Detections(np.concatenate((self.values, other.values)),\
+                          np.concatenate((self.index, other.index)), weight, dirs)
+
+    # Directions of the detections, calculated if they were not loaded
+    def directions(self):
+        if self.dirs is None:
+            self.dirs = units(self.theta, self.phi)
+        return self.dirs
+
+    # Indices of the detections with impact points inside the rectangle
+    def inRectangle(self, x_min, x_max, y_min, y_max):
+        x, y = self.x, self.y
+        return np.nonzero((x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max))[0]
+
+    # Indices of the detections with impact points inside the polygon, a
+    # list of (x, y) vertices, such as from a lasso selection
+    def inPolygon(self, vertices):
+        from matplotlib.path import Path
+        if len(vertices) < 3:
+            return np.zeros(0, dtype=np.int64)
+        return np.nonzero(Path(vertices).contains_points(np.column_stack((self.x, self.y))))[0]
+
+    # Indices of the detections with emin <= energy <= emax
+    def inEnergyBand(self, emin, emax):
+        return np.nonzero((self.energy >= emin) & (self.energy <= emax))[0]
+
+    # (x, y, ion_index) of the detections at indices, for single shots
+    def impactPoints(self, indices):
+        return [(float(self.x[i]), float(self.y[i]), int(self.index[i])) for i in indices]
+
+    # Returns an AngularIndex of these, made the first time it is needed
+    def angularIndex(self, bin_size=1.0):
+        if not hasattr(self, 'indices'):
+            self.indices = {}
+        if bin_size not in self.indices:
+            self.indices[bin_size] = AngularIndex(self, bin_size)
+        return self.indices[bin_size]
+
+# Groups the rows of a Detections by (theta, phi) bin, so that a detector only
+# needs to check the rows in the bins it partly overlaps, and can take the rows
+# in bins entirely inside it without checking them at all.
+class AngularIndex:
+
+    def __init__(self, data, bin_size=1.0):
+        # Round to a size that fits evenly in 180, so that phi = 0 is a bin edge
+        self.n_theta = max(1, int(round(180 / bin_size)))
+        self.bin_size = 180 / self.n_theta
+        self.n_phi = 2 * self.n_theta
+
+        # Failed trajectories are never in a detector, so are not included
+        rows = np.nonzero(data.energy >= 0)[0]
+        t_bin, p_bin = self.bins(data.theta[rows], data.phi[rows])
+        bins = t_bin * self.n_phi + p_bin
+        order = np.argsort(bins, kind='stable')
+        # Row numbers sorted by bin, and where each bin starts in rows
+        self.rows = rows[order]
+        self.offsets = np.searchsorted(bins[order], np.arange(self.n_theta * self.n_phi + 1))
+        # Only the non-empty bins need checking against detectors
+        self.filled = np.nonzero(np.diff(self.offsets))[0]
+
+        # Ranges of the filled bins, phi is from -180 to 180
+        self.t_lo = (self.filled // self.n_phi) * self.bin_size
+        self.p_lo = (self.filled % self.n_phi) * self.bin_size - 180
+        self.t_hi = self.t_lo + self.bin_size
+        self.p_hi = self.p_lo + self.bin_size
+
+    def bins(self, theta, phi):
+        t_bin = np.floor(np.asarray(theta, dtype=float) / self.bin_size)
+        p_bin = np.floor(((np.asarray(phi, dtype=float) + 180) % 360) / self.bin_size)
+        t_bin = np.clip(t_bin, 0, self.n_theta - 1).astype(int)
+        p_bin = np.clip(p_bin, 0, self.n_phi - 1).astype(int)
+        return t_bin, p_bin
+
+    # Rows in the given bins, bins are positions in self.filled
+    def rowsIn(self, bins):
+        bins = self.filled[bins]
+        starts = self.offsets[bins]
+        counts = self.offsets[bins+1] - starts
+        # Positions in self.rows, as runs of counts starting at starts
+        firsts = np.cumsum(counts) - counts
+        positions = np.arange(np.sum(counts)) + np.repeat(starts - firsts, counts)
+        return self.rows[positions]
+
+    # Returns (inside, boundary) row numbers for the detector, the inside rows are
+    # in the detector, and the boundary ones need checking with detector.inDetector
+    def candidates(self, detector):
+        inside, boundary = detector.classifyBins(self)
+        return self.rowsIn(inside), self.rowsIn(boundary)
+
 class Detector:
 
     def __init__(self, *args, **kwargs):
-        self.detections = np.zeros((0,8))
+        self.detections = Detections()
         self.outputprefix = 'spectrum'
         self.tmax = 180
         self.tmin = -180
@@ -170,11 +658,27 @@ class Detector:
 
         self.tmp = []
 
+        # If set, the spectra are also saved as .npz next to the .txt files
+        self.write_npz = False
+
+        # Running intensity for spectrumE, and the settings it was made for
+        self.accumulator = None
+        self.accumulator_key = None
+        # Progress callback for the spectra, see ProgressRate
+        self.progress = None
+
         self.ss_cmd = "python3 detect_impact.py"
+        # Called with the misc.processes.Process of each single shot started
         self.ss_callback = None
+        # Called with the Process when it finishes, from ss_queue.poll()
+        self.ss_done = None
+        # ProcessQueue for the single shots, or None for singleShotQueue()
+        self.ss_queue = None
 
     def clear(self):
-        self.detections = np.zeros((0,8))
+        self.detections = Detections()
+        self.accumulator = None
+        self.accumulator_key = None
         
     def addDetection(self, line):
         if line[3] < 0:
@@ -186,16 +690,59 @@ class Detector:
             self.emin  = e
         if e > self.emax:
             self.emax  = e
-            
-    def spectrumT(self, res, numpoints=512):
+
+    # Appends a batch of detections, in the same format as self.detections,
+    # this also updates the spectrumE accumulator if there is one. If the
+    # batch lowers emin, the energy axis changes, so the accumulator is
+    # dropped instead, and computeSpectrumE makes a new one.
+    def addDetections(self, batch):
+        if not isinstance(batch, Detections):
+            batch = Detections.fromRows(batch)
+        #These shouldn't be in detector
+        batch = batch.select(batch.energy >= 0)
+        if len(batch) == 0:
+            return
+        self.emin = min(self.emin, float(np.min(batch.energy)))
+        self.emax = max(self.emax, float(np.max(batch.energy)))
+        self.detections = self.detections.concatenate(batch)
+        if self.accumulator is not None:
+            res, numpoints, emin, E0 = self.accumulator_key
+            if emin != self.emin or E0 != self.safio.E0:
+                self.accumulator = None
+                self.accumulator_key = None
+            else:
+                self.accumulator.add(batch.energy.astype(float)/self.safio.E0, batch.weights)
+
+    # Sorts the filled bins of an AngularIndex into those entirely inside the
+    # detector, and those which need checking row by row, as positions in
+    # index.filled. By default every bin needs checking.
+    def classifyBins(self, index):
+        return np.zeros(0, dtype=int), np.arange(len(index.filled))
+
+    # Returns a boolean mask of which of data (a Detections) are in the detector.
+    # Subclasses replace this with an array version of isInDetector.
+    def inDetector(self, data):
+        mask = np.zeros(len(data), dtype=bool)
+        for i in range(len(data)):
+            if i % 65536 == 0:
+                checkpoint()
+                if self.progress is not None:
+                    self.progress('Cleaning', i, len(data), 'rows')
+            mask[i] = self.isInDetector(data.theta[i], data.phi[i], data.energy[i])
+        return mask
+
+    # Computes the theta spectrum, and writes it to file, this does not
+    # need matplotlib. Returns angles, intensity, scale and the file name.
+    @timing.timed('integrate')
+    def computeSpectrumT(self, res, numpoints=512):
         step = (self.tmax - self.tmin) / numpoints
         winv = 1/res
         angles = np.array([(self.tmin + x*step) for x in range(numpoints)])
         
-        tArr = self.detections[...,4]
-        aArr = self.detections[...,7]
+        tArr = self.detections.theta.astype(float)
+        aArr = self.detections.weights
 
-        intensity, scale = integrate(numpoints, winv, tArr, aArr, angles)
+        intensity, scale = integrate(numpoints, winv, tArr, aArr, angles, self.progress)
 
         file_name = self.outputprefix\
                   + 'Theta-'\
@@ -205,27 +752,40 @@ class Detector:
         out = open(file_name+'.txt', 'w')
         out.write(str(len(aArr))+'\n')
         #writes the angle 
-        for i in range(numpoints):
-            out.write(str(angles[i])+'\t'+str(intensity[i])+'\n')
+        writeColumns(out, (angles, intensity))
         out.close()
-        
+        if self.write_npz:
+            np.savez(file_name+'.npz', angle=angles, intensity=intensity,\
+                     counts=len(aArr), scale=scale)
+        return angles, intensity, scale, file_name
+
+    def spectrumT(self, res, numpoints=512):
+        angles, intensity, scale, file_name = self.computeSpectrumT(res, numpoints)
         if self.plots or self.pics:
-            fig, ax = plt.subplots()
-            ax.plot(angles, intensity)
-            ax.set_title("Intensity vs Theta, Detections: "+str(len(aArr)))
-            ax.set_xlabel('Angle (Degrees)')
-            ax.set_ylabel('Intensity')
-            ax.tick_params(direction="in", which='both')
-            if self.plots:
-                fig.show()
-            else:
-                self.fig, self.ax = fig, ax
+            self.plotSpectrumT(angles, intensity, file_name)
+        return angles, intensity
+
+    def plotSpectrumT(self, angles, intensity, file_name):
+        plt = pyplot()
+        fig, ax = plt.subplots()
+        ax.plot(angles, intensity)
+        ax.set_title("Intensity vs Theta, Detections: "+str(len(self.detections)))
+        ax.set_xlabel('Angle (Degrees)')
+        ax.set_ylabel('Intensity')
+        ax.tick_params(direction="in", which='both')
+        if self.plots:
+            fig.show()
+        else:
+            self.fig, self.ax = fig, ax
         #The following saves the plot as a png file
-            if self.pics:
+        if self.pics:
+            with timing.stage('savefig'):
                 fig.savefig(file_name+'.png')
-        return angles, intensity
         
-    def spectrumE(self, res, numpoints=512, write_file=True, override_fig=None):
+    # Computes the energy spectrum, and writes it to file if write_file,
+    # this does not need matplotlib. Returns energy, intensity, scale
+    @timing.timed('integrate')
+    def computeSpectrumE(self, res, numpoints=512, write_file=True):
     
         res = res / self.safio.E0
         step = (self.safio.E0 - self.emin)/(numpoints * self.safio.E0)
@@ -237,11 +797,17 @@ class Detector:
         aArr = []
 
         if len(self.detections) > 0:
-            eArr = self.detections[...,3]/self.safio.E0
-            aArr = self.detections[...,7]
+            eArr = self.detections.energy.astype(float)/self.safio.E0
+            aArr = self.detections.weights
         
-        #Convert the points into gaussians
-        intensity, scale = integrate(numpoints, winv, eArr, aArr, energy)
+        #Convert the points into gaussians, only the ones added since the
+        #last call need doing if the axis is the same as last time.
+        key = (res, numpoints, self.emin, self.safio.E0)
+        if self.accumulator is None or self.accumulator_key != key:
+            self.accumulator = SpectrumAccumulator(energy, winv)
+            self.accumulator_key = key
+            self.accumulator.add(eArr, aArr, self.progress)
+        intensity, scale = self.accumulator.intensity()
         
         #Calculate the kinematic factor
         k = kinematicFactor(self.tmax, self.safio.THETA0,\
@@ -256,15 +822,31 @@ class Detector:
             out = open(file_name+'.txt', 'w')
             out.write('energy\tintensity\tcounts\tk-factor\tscale\n')
             #This writes out the energy into a text file
-            for i in range(numpoints):
-                if i == 0:
-                    out.write("{}\t{}\t{}\t{}\t{}\n".format(energy[i],\
-                        intensity[i], len(aArr), k, scale))
-                else:
-                    out.write("{}\t{}\n".format(energy[i], intensity[i]))
+            if numpoints > 0:
+                out.write("{}\t{}\t{}\t{}\t{}\n".format(energy[0],\
+                    intensity[0], len(aArr), k, scale))
+            writeColumns(out, (energy[1:], intensity[1:]))
             out.close()
-        
+            if self.write_npz:
+                np.savez(file_name+'.npz', energy=energy, intensity=intensity,\
+                         counts=len(aArr), k=k, scale=scale)
+        self.k = k
+        return energy, intensity, scale
+
+    def spectrumE(self, res, numpoints=512, write_file=True, override_fig=None):
+        energy, intensity, scale = self.computeSpectrumE(res, numpoints, write_file)
+        # Only make a figure if something is going to use it.
+        if override_fig is not None or self.plots or self.pics:
+            self.plotSpectrumE(energy, intensity, override_fig)
+        return energy, intensity, scale
+
+    # Makes the figure for the spectrum from computeSpectrumE, the plotting
+    # itself is left to self.prep_fig, so that it can be run on the GUI thread
+    def plotSpectrumE(self, energy, intensity, override_fig=None):
+        k = self.k
+        counts = len(self.detections)
         if override_fig is None:
+            plt = pyplot()
             fig, ax = plt.subplots(figsize=(8.0, 6.0))
         else:
             fig, ax = override_fig
@@ -280,7 +862,7 @@ class Detector:
             ax2 = ax.twiny()
             ax2.set_xlim(0,self.safio.E0)
             
-            identification = "{}; Counts: {}".format(self.outputprefix, len(eArr))
+            identification = "{}; Counts: {}".format(self.outputprefix, counts)
             fig.text(0.0, 0.975, identification, fontsize=9)
             
             ax.set_xlabel('Energy (E/E0)')
@@ -311,81 +893,111 @@ class Detector:
         self.prep_fig = prep_fig
 
         if self.plots or self.pics:
-            prep_fig()
+            with timing.stage('prep_fig'):
+                prep_fig()
             if self.plots:
                 fig.show()
                 
             #The following saves the plot as a png file
             if self.pics:
-                fig.savefig(self.fig_name)
-        return energy, intensity, scale
-
-    def run_single_shot(self, close, index, args):
+                with timing.stage('savefig'):
+                    fig.savefig(self.fig_name)
+
+    # Runs a single shot for the impact point close, with the seed index,
+    # then opens it in VMD, coloured by colour if given
+    def run_single_shot(self, close, index, colour=None):
+        args = self.ss_cmd + ' -i {} -o {} -x {} -y {} -s {} -r'
+        if colour is not None:
+            args = args + ' -c ' + colour
         #things default nicely to py on windows, the linux machine like python3
         if platform.system() != 'Linux':
             args = args.replace('python3', 'py')
         
-        new_input = self.safio.fileIn.replace(self.safio.file_type, '_ss.input')
-
-        if self.safio.load_crystal:
-            old_crys = new_input.replace('_ss.input', '.crys_in')
-            new_crys = old_crys.replace('.crys_in', '_ss.crys_in')
-            if not os.path.isfile(old_crys):
-                old_crys = old_crys.replace('.crys_in', '.crys')
-            try:
-                shutil.copy(old_crys, new_crys)
-            except:
-                print("Error copying the crystal file over!")
-                print(old_crys)
-                print(new_crys)
-        
-        self.safio.fileIn = new_input
-        self.safio.setGridScat(True)
-        self.safio.NUMCHA = 1
-        self.safio.XSTART = close[0]
-        self.safio.YSTART = close[1]
-        self.safio.Ion_Index = index
-        self.safio.genInputFile(fileIn=self.safio.fileIn)
-        imp_x = round(close[0],3)
-        imp_y = round(close[1],3)
-
-        input_file = self.safio.fileIn.replace('.input', '')
-        output_file = self.safio.fileIn.replace('.input', '') + \
-                        '{}_{}'.format(imp_x, imp_y)
-
+        # The safio is copied for this, so the settings for the plots are kept,
+        # and the run gets its own directory, so others can run at once. This
+        # is the same directory for the same shot, so with -k the outputs of
+        # an earlier run are reused, and only VMD is opened again.
+        template = single_shot.prepareInput(self.safio)
+        input_file, output_file = single_shot.jobDirectory(template, close[0], close[1], index, restricted=True)
+        cmd = args.format(input_file, output_file, close[0], close[1], index)
+
+        with single_shot_lock:
+            running = single_shot_runs.get(output_file)
+            # If this shot is still going, another colour is made after it, so
+            # it reuses its outputs rather than running Sea-Safari again at
+            # the same time in the same directory.
+            if running is not None:
+                if colour in [c for c, _ in running[1]]:
+                    print("Single shot {} is already running".format(output_file))
+                else:
+                    print("Single shot {} is still running, {} will follow it".format(output_file, colour))
+                    running[1].append((colour, cmd))
+                return running[0]
+            if single_shot.isComplete(output_file):
+                print("Reusing the earlier single shot {}".format(output_file))
+            running = [None, [(colour, cmd)]]
+            single_shot_runs[output_file] = running
+        return self.submit_single_shot(output_file, running)
+
+    # Queues up the first of the colours in running, see single_shot_runs.
+    # Only Sea-Safari and XYZ go through the queue, VMD is opened after, so
+    # an open viewer doesn't hold up the other shots.
+    def submit_single_shot(self, output_file, running):
+        queue = self.ss_queue if self.ss_queue is not None else singleShotQueue()
+        colour, cmd = running[1][0]
+        process = queue.submit(cmd + ' -k --no_view', name=output_file,\
+                               on_done=lambda process: self.single_shot_finished(process, cmd))
+        running[0] = process
         if self.ss_callback is not None:
-            self.ss_callback(output_file+'.vmd')
-
-        cmd = [args.format(input_file, output_file, close[0], close[1], index)]
-        if platform.system() != 'Linux':
-            cmd = cmd[0] #Not sure why this was needed on windows...
-        subprocess.Popen(cmd, shell=True)
+            self.ss_callback(process)
+        return process
+
+    # Called with the Process of a single shot when it finishes, this opens
+    # VMD for it if it worked, then starts the next colour waiting for it.
+    # VMD runs on its own, so cancelling the queued shots doesn't close it.
+    def single_shot_finished(self, process, cmd):
+        if process.ok():
+            subprocess.Popen(cmd + ' --view', shell=True)
+        if self.ss_done is not None:
+            self.ss_done(process)
+        with single_shot_lock:
+            running = single_shot_runs[process.name]
+            del running[1][0]
+            if len(running[1]) == 0 or not process.ok():
+                del single_shot_runs[process.name]
+                if len(running[1]) > 0:
+                    print("Not making the other colours of {}, as it did not finish".format(process.name))
+                return
+        self.submit_single_shot(process.name, running)
         
     def impactParam(self, basis=None, dx=0, dy=0, override_fig=None):
+        from matplotlib.collections import EllipseCollection
+        plt = pyplot()
         if override_fig is None:
             fig, ax = plt.subplots(figsize=(12.0, 9.0))
         else:
             fig, ax = override_fig
         
         self.fig, self.ax = fig, ax
-        patches = []
-        colours = []
         
         z_threshold = -self.safio.BDIST*1e3
         
         if basis is not None:
-            
-            basis = sort_basis(basis)
-            
-            for site in basis:
-                if site[2] < z_threshold:
-                    continue
-                colours.append(site[2])
-                circle = Circle((site[0], site[1]), 1)
-                patches.append(circle)
 
-            p = PatchCollection(patches, cmap=plt.get_cmap('BuGn'))
-            p.set_array(np.array(colours))
+            if not isinstance(basis, crystal.Crystal):
+                basis = crystal.Crystal(np.array(basis, dtype=float).reshape(-1, 5))
+            # Sites down to the threshold, deepest first so the higher ones
+            # are drawn over them, then only the ones in view
+            sites = basis.surface(-z_threshold)
+            site_x, site_y = basis.x[sites], basis.y[sites]
+            view = (site_x >= self.safio.XSTART - 1) & (site_x <= self.safio.XSTOP + 1) &\
+                   (site_y >= self.safio.YSTART - 1) & (site_y <= self.safio.YSTOP + 1)
+            sites = sites[view]
+
+            # Circles of radius 1 Å, all in one collection
+            p = EllipseCollection(2, 2, 0, units='xy', offsets=np.column_stack((basis.x[sites], basis.y[sites])),\
+                                  offset_transform=ax.transData, cmap=plt.get_cmap('BuGn'))
+            p.set_array(basis.z[sites])
             
             #Draw the basis
             ax.add_collection(p)
@@ -395,9 +1007,9 @@ class Detector:
         y = []
         c = []
         if len(self.detections) > 0:
-            x = self.detections[..., 0]
-            y = self.detections[..., 1]
-            c = self.detections[..., 3]
+            x = self.detections.x
+            y = self.detections.y
+            c = self.detections.energy
         
         # Do main drawing on this thread
         scat = ax.scatter(x, y, c=c, cmap=plt.get_cmap('plasma'))
@@ -458,42 +1070,32 @@ class Detector:
                     return
 
                 close = [1e20, 1e20]
-                distsq = close[0]**2 + close[1]**2
-                index = -1
                 ion_index = -1
-
-                for i in range(len(x)):
-                    dxsq = (x[i]-event.xdata)**2
-                    dysq = (y[i]-event.ydata)**2
-                    if distsq > dxsq + dysq:
-                        distsq = dxsq + dysq
-                        close[0] = x[i]
-                        close[1] = y[i]
-                        index = i
-                        ion_index = self.detections[..., 6][i]
+                index = nearestPoint(x, y, event.xdata, event.ydata)
+                if index >= 0:
+                    close[0] = float(x[index])
+                    close[1] = float(y[index])
+                    ion_index = self.detections.index[index]
                 ion_index = int(ion_index)
                 if event.dblclick and event.button == 1 and not shift_is_held:
                     print("Setting up a safari run for a single shot")
                     # Setup a single run safari for this.
-                    self.run_single_shot(close, ion_index,\
-                                    self.ss_cmd + ' -i {} -o {} -x {} -y {} -s {} -r')
+                    self.run_single_shot(close, ion_index)
                 if event.dblclick and event.button == 3:
                     # Setup a single run safari using nearness colored data
                     print("Setting up a safari run for a nearness colored dataset")
                     # Setup a single run safari for this.
-                    self.run_single_shot(close, ion_index,\
-                                    self.ss_cmd + ' -i {} -o {} -x {} -y {} -s {} -r -c nearby')
+                    self.run_single_shot(close, ion_index, 'nearby')
                 if event.button == 1 and shift_is_held:
                     # Setup a single run safari using velocity colored data
                     print("Setting up a safari run for a velocity colored dataset")
                     # Setup a single run safari for this.
-                    self.run_single_shot(close, ion_index,\
-                                    self.ss_cmd + ' -i {} -o {} -x {} -y {} -s {} -r -c velocity')
+                    self.run_single_shot(close, ion_index, 'velocity')
                 
                 close[0] = round(close[0], 5)
                 close[1] = round(close[1], 5)
-                energy = round(self.detections[index][3], 2)
-                angle = round(self.detections[index][4], 1)
+                energy = round(float(self.detections.energy[index]), 2)
+                angle = round(float(self.detections.theta[index]), 1)
                 select_text = '{}, {}eV ({}), {}°, {}'.format(close, energy, round(energy/self.safio.E0,3), angle, ion_index)
                 self.text_selected.set_text(select_text)
                 px = close[0]
@@ -533,7 +1135,8 @@ class Detector:
         
         self.prep_fig = prep_fig
         if self.plots or self.pics:
-            prep_fig()
+            with timing.stage('prep_fig'):
+                prep_fig()
             if self.plots:
                 fig.show()
 
@@ -544,7 +1147,8 @@ class Detector:
                     + str(self.emax) + '_'\
                     + str(self.tmin) + '-'\
                     + str(self.tmax)
-                fig.savefig(file_name+'.png')
+                with timing.stage('savefig'):
+                    fig.savefig(file_name+'.png')
         
 class StripeDetector(Detector):
     
@@ -571,37 +1175,97 @@ class StripeDetector(Detector):
             return True
         return False
 
+    def inDetector(self, data):
+        theta = data.theta
+        phi = (data.phi.astype(float) + 360) % 360
+        mask = (data.energy >= 0) & (theta > self.tmin) & (theta < self.tmax)
+        inPhi = np.abs(phi - self.phi) < self.width
+        inPhi |= np.abs(((360-phi)%360) - self.phi) < self.width
+        return mask & inPhi
+
+    def classifyBins(self, index):
+        eps = 1e-6
+        half = index.bin_size / 2
+        # Away from the wrap points, both of the phi distances change by at
+        # most half a bin from the centre of the bin. They jump at phi = 0,
+        # which is inside the bin [0, bin_size), and rows at -0.0 or 360 can
+        # wrap to it from the bin below, so the bins either side of 0, and
+        # of +-180, are never taken as all in or all out of the stripe, and
+        # their rows are checked one by one.
+        phi = ((index.p_lo + half) + 360) % 360
+        d1 = np.abs(phi - self.phi)
+        d2 = np.abs(((360-phi)%360) - self.phi)
+        edge = np.rint(index.p_lo / index.bin_size).astype(int) % index.n_theta
+        wraps = (edge == 0) | (edge == index.n_theta - 1)
+        all_phi = ((d1 + half + eps < self.width) | (d2 + half + eps < self.width)) & ~wraps
+        no_phi = (d1 - half - eps >= self.width) & (d2 - half - eps >= self.width) & ~wraps
+        all_theta = (index.t_lo - eps > self.tmin) & (index.t_hi + eps < self.tmax)
+        no_theta = (index.t_hi + eps <= self.tmin) | (index.t_lo - eps >= self.tmax)
+        inside = all_phi & all_theta
+        outside = no_phi | no_theta
+        return np.nonzero(inside)[0], np.nonzero(~inside & ~outside)[0]
+
+# A detector of angular size size, centred on theta and phi. By default it
+# accepts anything within size/2 of the centre (a cone), if rectangular is
+# set, it instead accepts anything within size/2 in both theta and phi.
 class SpotDetector(Detector):
 
-    def __init__(self, theta, phi, size):
+    def __init__(self, theta, phi, size, rectangular=False):
         super().__init__()
         self.theta = theta
         self.tmin = theta - size/2
         self.tmax = theta + size/2
         self.phi = phi
         self.size = size
+        self.rectangular = rectangular
         self.dir = unit(theta, phi)
-        self.quadDots = []
-        self.quadDots.append(self.dir.dot(unit(self.tmin, phi)))
-        self.quadDots.append(self.dir.dot(unit(self.tmax, phi)))
-        self.quadDots.append(self.dir.dot(unit(theta, phi - size/2)))
-        self.quadDots.append(self.dir.dot(unit(theta, phi + size/2)))
+        # Anything with a dot product with dir above this is inside the cone.
+        # This is the same as the lowest of the old quadDots, which were the
+        # dots for the 4 edges at tmin, tmax, phi - size/2 and phi + size/2
+        self.threshold = math.cos(math.radians(size/2))
 
         self.centre = theta
         self.width = size
 
+    # Difference in phi, wrapped to be between -180 and 180
+    def dPhi(self, phi):
+        return (phi - self.phi + 180) % 360 - 180
+
     def isInDetector(self, theta, phi, e):
         #These are failed trajectories, shouldn't be here!
         if e < 0:
             return False
-        dir = unit(theta, phi)
-        dotdir = dir.dot(self.dir)
-        for dot in self.quadDots:
-        # This would mean it is more aligned
-        # to the centre than the corner is.
-            if dotdir >= dot:
-                return True
-        return False
+        if self.rectangular:
+            return abs(theta - self.theta) <= self.size/2\
+               and abs(self.dPhi(phi)) <= self.size/2
+        return unit(theta, phi).dot(self.dir) >= self.threshold
+
+    def inDetector(self, data):
+        if self.rectangular:
+            inside = (np.abs(data.theta - self.theta) <= self.size/2)\
+                   & (np.abs(self.dPhi(data.phi.astype(float))) <= self.size/2)
+        else:
+            inside = data.directions().dot(self.dir) >= self.threshold
+        return (data.energy >= 0) & inside
+
+    def classifyBins(self, index):
+        eps = 1e-6
+        half = index.bin_size / 2
+        if self.rectangular:
+            dt = np.abs(index.t_lo + half - self.theta)
+            dp = np.abs(self.dPhi(index.p_lo + half))
+            inside = (dt + half + eps <= self.size/2) & (dp + half + eps <= self.size/2)
+            outside = (dt - half - eps > self.size/2) | (dp - half - eps > self.size/2)
+        else:
+            # Angle between the detector and the bin centres
+            centres = units(index.t_lo + half, index.p_lo + half).astype(float)
+            angle = np.degrees(np.arccos(np.clip(centres.dot(self.dir), -1, 1)))
+            # No point in a bin is further than this from its centre, half a bin
+            # along theta, then at most half a bin of arc along phi.
+            radius = index.bin_size + eps
+            inside = angle + radius <= self.size/2
+            outside = angle - radius > self.size/2
+        return np.nonzero(inside)[0], np.nonzero(~inside & ~outside)[0]
 
     def spectrum(self, res, numpoints=512):
         return self.spectrumE(res=res, numpoints=numpoints)
@@ -615,11 +1279,19 @@ class Spectrum:
         self.name = None
         self.plots = True
         self.pics = True
+        # Passed on to the detector by clean, see Detector.write_npz
+        self.write_npz = False
         self.stuck = []
         self.buried = []
         self.other_failed = []
         self.crystal = []
         self.last_set = None
+        # If set, clean uses an AngularIndex of the dataset, so only rows
+        # near the detector are checked. This helps when sweeping detectors.
+        self.use_index = False
+        self.index_bin = 1.0
+        # Progress callback for clean, and the detector, see ProgressRate
+        self.progress = None
 
     def clear(self):
         self.detector = None
@@ -631,6 +1303,7 @@ class Spectrum:
         self.crystal = []
         self.other_failed = []
 
+    @timing.timed('clean')
     def clean(self, detectorType=-1, emin=-1e6, emax=1e6,\
                                      phimin=-1e6, phimax=1e6, \
                                      thmin=-1e6, thmax=1e6):
@@ -639,7 +1312,8 @@ class Spectrum:
 
         if self.last_set == argset:
             return
-        self.last_set = argset
+        # Only set once finished, in case this is stopped by a checkpoint
+        self.last_set = None
 
         if self.detector is None:
             self.detectorType = self.safio.NDTECT
@@ -649,8 +1323,10 @@ class Spectrum:
                                              self.safio.PHI0,\
                                              self.detectorParams[2])
         self.detector.safio = self.safio
+        self.detector.progress = self.progress
         self.detector.plots = self.plots
         self.detector.pics = self.pics
+        self.detector.write_npz = self.write_npz
         self.detector.outputprefix = self.name+'_spectrum_'
 
         self.detector.emin = emin
@@ -669,116 +1345,70 @@ class Spectrum:
         start = time.time()
         print("Collecting points")
         filename = getDataFile(self.safio.filename)
-        f = open(filename, 'r', errors='ignore')
         print("Loading from: "+filename)
-        n = 0
-        tested = 0
-        hit = 0
-        for line in f:
-            if n == 0:
-                n = 1
-                continue
-            arr = line.split()
-            # Errored line?
-            if len(arr)<10:
-                n = n + 1
-                print("Error on line {}".format(n))
-                continue
-            try:
-                # x, y, z_min
-                # E, Theta, Phi
-                # index, weight
-                traj = [float(arr[0]), float(arr[1]),float(arr[2]),\
-                        float(arr[3]),float(arr[4]),float(arr[5]),\
-                        float(arr[6]),1.0]
-                tested = tested + 1
-            except:
-                print("Error on line {}".format(n))
-                # errors = errors + 1
-                n = n + 1
-                continue
-
-            n = n + 1
+        data = loadDataset(filename, self.progress)
+        tested = len(data)
+        checkpoint()
+        if self.progress is not None:
+            self.progress('Cleaning', 0, tested, 'rows')
+
+        e = data.energy
+        t = data.theta
+        p = data.phi
+        # Stuck
+        self.stuck = data.select(e == -100)
+        self.buried = data.select(e == -200)
+        self.other_failed = data.select((e < 0) & (e != -100) & (e != -200))
+
+        if self.use_index:
+            inside, boundary = data.angularIndex(self.index_bin).candidates(self.detector)
+            boundary = boundary[self.detector.inDetector(data.select(boundary))]
+            rows = np.sort(np.concatenate((inside, boundary)))
+        else:
+            rows = np.nonzero(self.detector.inDetector(data))[0]
+        checkpoint()
+        e = e[rows]
+        t = t[rows]
+        p = p[rows]
+        mask = (e >= 0) & (e >= emin) & (e <= emax)\
+             & (t <= thmax) & (t >= thmin)\
+             & (p <= phimax) & (p >= phimin)
+        rows = rows[mask]
+        hit = len(rows)
+        if self.progress is not None:
+            self.progress('Cleaning', tested, tested, 'rows')
 
-            e = traj[3]
-            t = traj[4]
-            p = traj[5]
-            # Stuck
-            if e == -100:
-                self.stuck.append(traj)
-                continue
-            if e == -200:
-                self.buried.append(traj)
-                continue
-            if e < 0:
-                self.other_failed.append(traj)
-                continue
-            if e < emin or e > emax\
-            or t > thmax or t < thmin\
-            or p > phimax or p < phimin:
-                continue
-            if self.detector.isInDetector(t, p, e):
-                self.detector.addDetection(traj)
-                hit = hit + 1
         print("Collected points, sorting now. {} out of {} were in detector".format(hit, tested))
-        self.detector.detections = np.array(self.detector.tmp)
+        self.detector.detections = data.select(rows)
         self.detector.tmp = []
+        self.last_set = argset
         end = time.time()
         print("Time to process data: {:.3f}s".format(end - start))
 
+    # Image of the detections, energy vs theta, returns img, counts, size
+    def thetaEImage(self, size=1024):
+        print("bounds: {} {} {} {}".format(self.e_min, self.e_max, self.t_min, self.t_max))
+        detections = self.detector.detections
+        return binImage(detections.energy, detections.theta, self.e_min,\
+                        self.e_max, self.t_min, self.t_max, size)
+
+    # Image of the detections, theta vs phi, returns img, counts, size
+    def phiThetaImage(self, size=1024):
+        print("bounds: {} {} {} {}".format(self.t_min, self.t_max, self.p_min, self.p_max))
+        detections = self.detector.detections
+        return binImage(detections.theta, detections.phi, self.t_min,\
+                        self.t_max, self.p_min, self.p_max, size)
+
     def plotThetaE(self):
-        
-        size = 1024
-        img = np.zeros((size,size))
+        import matplotlib.image
+        plt = pyplot()
+        img, x, size = self.thetaEImage()
         e_max = self.e_max
         e_min = self.e_min
         t_min = self.t_min
         t_max = self.t_max
-
         del_e = e_max-e_min
         del_t = t_max-t_min
-
-        de = del_e/size
-        dt = del_t/size
-
-        print("bounds: {} {} {} {}".format(e_min, e_max, t_min, t_max))
-        x = 0
-        for i in range(len(self.detector.detections)):
-            line = self.detector.detections[i]
-            e = line[3]
-            t = line[4]
-            val = 0
-            i_e = 0
-            i_t = 0
-            t = t - t_min
-            e = e - e_min
-            if e >= 0 and e < del_e and t >= 0 and t < del_t:
-                i_e = math.floor(e/de)
-                i_t = math.floor(t/dt)
-                img[i_e][i_t] = img[i_e][i_t] + 1
-                x = x + 1
-
-        max_intensity = np.max(img)
-        while max_intensity < 100 and size > 2:
-            size = int(size / 2)
-            img = np.zeros((size,size))
-            de = del_e/size
-            dt = del_t/size
-            print("bounds: {} {} {} {}".format(e_min, e_max, t_min, t_max))
-            for i in range(len(self.detector.detections)):
-                line = self.detector.detections[i]
-                e = line[3]
-                t = line[4]
-                val = 0
-                i_e = 0
-                i_t = 0
-                t = t - t_min
-                e = e - e_min
-                if e >= 0 and e < del_e and t >= 0 and t < del_t:
-                    i_e = math.floor(e/de)
-                    i_t = math.floor(t/dt)
-                    img[i_e][i_t] = img[i_e][i_t] + 1
-            max_intensity = np.max(img)
         
         fig, ax = plt.subplots()
         self.fig, self.ax = fig, ax
@@ -800,61 +1430,16 @@ class Spectrum:
             fig.show()
 
     def plotPhiTheta(self):
-
-        size = 1024
-
-        img = np.zeros((size,size))
-
+        import matplotlib.image
+        plt = pyplot()
+        img, x, size = self.phiThetaImage()
         p_max = self.p_max
         p_min = self.p_min
         t_min = self.t_min
         t_max = self.t_max
-
         del_p = p_max-p_min
         del_t = t_max-t_min
         
-        dp = del_p/size
-        dt = del_t/size
-
-        print("bounds: {} {} {} {}".format(t_min, t_max, p_min, p_max))
-        x = 0
-        for i in range(len(self.detector.detections)):
-            line = self.detector.detections[i]
-            p = line[5]
-            t = line[4]
-            val = 0
-            i_p = 0
-            i_t = 0
-            t = t - t_min
-            p = p - p_min
-            if p >= 0 and p < del_p and t >= 0 and t < del_t:
-                i_p = math.floor(p/dp)
-                i_t = math.floor(t/dt)
-                img[i_t][i_p] = img[i_t][i_p] + 1
-                x = x + 1
-
-        max_intensity = np.max(img)
-        while max_intensity < 100 and size > 2:
-            size = int(size / 2)
-            img = np.zeros((size,size))
-            dp = del_p/size
-            dt = del_t/size
-            print("bounds: {} {} {} {}".format(t_min, t_max, p_min, p_max))
-            for i in range(len(self.detector.detections)):
-                line = self.detector.detections[i]
-                p = line[5]
-                t = line[4]
-                val = 0
-                i_p = 0
-                i_t = 0
-                t = t - t_min
-                p = p - p_min
-                if p >= 0 and p < del_p and t >= 0 and t < del_t:
-                    i_p = math.floor(p/dp)
-                    i_t = math.floor(t/dt)
-                    img[i_t][i_p] = img[i_t][i_p] + 1
-            max_intensity = np.max(img)
-        
         fig, ax = plt.subplots()
         self.fig, self.ax = fig, ax
         im = ax.imshow(img, interpolation="bicubic", extent=(p_max, p_min, t_min, t_max))
@@ -1,29 +1,44 @@
+import copy       # Copies of the cached inputs
 import os         # Used to check if a path exists
 import shutil     # Used to copy files.
 import time       # Used to generate a timestamp.
 
+# Characters a number can start with, anything else is only a number if
+# it is one of _FLOAT_WORDS
+_NUMBER_START = frozenset('0123456789+-.')
+_FLOAT_WORDS = frozenset(['nan', 'inf', 'infinity'])
+
 # A bunch of functions for fortran IO
+#
+# This checks what the value looks like before converting it, as most are
+# plain ints, floats or names, rather than trying int() then float() for
+# each one, which is slow when they fail.
 def parseVar(input):
     string = str(input)
     if string.endswith('d0') or string.endswith('D0'):
         var = string.replace('D0','').replace('d0','')
         return float(var)
+    if string == '':
+        return string
+    first = string[0]
+    if first in _NUMBER_START:
+        digits = string[1:] if first == '-' or first == '+' else string
+        if digits.isdecimal():
+            return int(string)
+        try:
+            return float(string)
+        except ValueError:
+            return string
     if string == 't' or string == 'T':
         return True
     if string == 'f' or string == 'F':
         return False
-    if isInt(string):
-        return int(string)
-    if isFloat(string):
+    if string.lower() in _FLOAT_WORDS:
         return float(string)
     return string
 
 def parseLine(input):
-    vars = input.split()
-    ret = []
-    for var in vars:
-        ret.append(parseVar(var))
-    return ret
+    return [parseVar(var) for var in input.split()]
 
 def toStr(input):
     if isinstance(input, bool):
@@ -58,6 +73,23 @@ def isFloat(s):
     except ValueError:
         return False
 
+# path -> (mtime, size, SafariInput)
+_inputs = {}
+
+# A SafariInput for fileIn, the file is only parsed again if it changes,
+# for scanning directories of runs. Each call returns a new copy, so it can
+# be changed without affecting the others.
+def loadInput(fileIn):
+    try:
+        stat = os.stat(fileIn)
+    except OSError:
+        return SafariInput(fileIn)
+    cached = _inputs.get(fileIn)
+    if cached is None or cached[0] != stat.st_mtime or cached[1] != stat.st_size:
+        cached = (stat.st_mtime, stat.st_size, SafariInput(fileIn))
+        _inputs[fileIn] = cached
+    return copy.deepcopy(cached[2])
+
 class SafariInput:
 
     def __init__(self, fileIn, save_mod=False):
@@ -172,12 +204,16 @@ class SafariInput:
             self.save()
         return
     
-    def genInputFile(self, fileIn=None):
+    # Saves to fileIn, by default a new timestamped file, and points the
+    # safari.input in directory at it, by default the current one, which is
+    # what Sea-Safari runs when it is not given an input.
+    def genInputFile(self, fileIn=None, directory=None):
         if fileIn is None:
             fileIn = self.fileIn
             fileIn = time.strftime("%Y%m%d_%H%M%S") +'.input'
         self.save(fileIn)
-        saf_file = open('safari.input', 'w')
+        default_file = 'safari.input' if directory is None else os.path.join(directory, 'safari.input')
+        saf_file = open(default_file, 'w')
         saf_file.write(fileIn.replace(self.file_type, ''))
         saf_file.close()
         
@@ -467,12 +503,14 @@ class SafariInput:
         self.NWRITX = depth
         self.NWRITY = 666
 
-    def save(self, file=None):
+    # Saves to file, by default the .input for fileIn. When saving to another
+    # file, the crystal is copied along with it, unless not copy_crystal.
+    def save(self, file=None, copy_crystal=True):
         if file is None:
             output = open(self.fileIn.replace(self.file_type, '.input'), 'w')
         else:
             output = open(file, 'w')
-            if self.load_crystal:
+            if self.load_crystal and copy_crystal:
                 # We need to copy the crystal file over as well.
                 crys_file_in = self.fileIn.replace(self.file_type, '.crys_in')
                 crys_file_out = file.replace(self.file_type, '.crys_in')
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+import argparse     # Parsing command line arguments
+import copy         # Copies of the SafariInput to change
+import hashlib      # Keys for the results
+import os           # Path related stuff
+import platform     # Linux vs Windows check
+import shutil       # Copying the crystal files
+import sys          # Finding misc
+import tempfile     # Directories for each job
+
+# The repo root, so misc can be imported when run from in here
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import misc.processes as processes
+import data_files.safari_input as safari_input
+
+# Single shot runs of Sea-Safari, either one at a time from the impact
+# plot, or a Batch of them for a set of impact points, eg:
+#
+#     python data_files/single_shot.py -i run.input -p points.txt -w 4
+#
+# where each line of points.txt is `x y ion_index`, such as the ones
+# selected on the impact plot. The .traj files made are listed in
+# <name>_batch.txt, which traj_files/traj_ensemble.py can load with -l.
+#
+# Sea-Safari is run from the current directory, as for detect_impact.py.
+#
+# Each shot runs in its own directory, in <name>_ss_runs next to the input,
+# with its own input, crystal and outputs, so any number of them can run at
+# once without overwriting each other's files. The input is written once
+# to the runs directory, and the crystal linked there, then each job gets
+# hardlinks of these, so making one costs very little even for big
+# crystals. Where hardlinks are not possible, the files are copied.
+#
+# The directory is named by the impact point, the seed (ion index), and a
+# hash of the parts of the input which change the trajectory and of the
+# crystal, with _r on the end for restricted shots, and each step of a shot which finishes
+# is recorded in a .done file next to its outputs, see markComplete. So
+# running the same shot again just reuses them, see isComplete, and
+# detect_impact.py -k only runs the steps which are missing, such as the
+# .xyz for another colour mode, before opening VMD.
+
+# Runs Sea-Safari for a single shot at x, y, with the seed of the ion index
+SAFARI_CMD = './Sea-Safari -i {} -o {} -s -x {} -y {} --seed {}'
+
+# Paths for running in WSL on windows, `<X>:` is replaced with `/mnt/<x>`
+def wslPath(path):
+    if len(path) > 1 and path[1] == ':':
+        return '/mnt/{}'.format(path[0].lower()) + path[2:].replace('\\', '/')
+    return path.replace('\\', '/')
+
+# The command to run a single shot, restricted only saves the atoms near
+# the trajectory in the .xyz
+def safariCommand(input_file, output_file, x, y, seed, restricted=False):
+    command = SAFARI_CMD
+    if restricted:
+        command = command + ' -r'
+    if platform.system() == 'Windows':
+        return 'wsl ' + command.format(wslPath(input_file), wslPath(output_file), x, y, seed)
+    return command.format(input_file, output_file, x, y, seed)
+
+# The directory the single shots of safio run in
+def runsDirectory(safio):
+    return safio.fileIn.replace(safio.file_type, '') + '_ss_runs'
+
+# Makes dst a hardlink of src, or a copy if it can't be linked. This
+# replaces dst rather than writing over it, so other links to the old dst
+# are left as they were.
+def linkFile(src, dst):
+    tmp = dst + '.tmp'
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        # copy2 keeps the mtime, which is part of the hash, see inputHash
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+# Writes the single shot version of the input of safio to its runs
+# directory, as <name>_ss.input, along with a link to its crystal if it
+# loads one. The impact point and seed are given to Sea-Safari on the
+# command line, so this is the same for every shot, and safio itself is
+# not changed. Returns the new input without the .input, for jobDirectory.
+def prepareInput(safio):
+    directory = runsDirectory(safio)
+    os.makedirs(directory, exist_ok=True)
+    name = os.path.basename(safio.fileIn.replace(safio.file_type, ''))
+    template = os.path.join(directory, name + '_ss')
+
+    if safio.load_crystal:
+        old_crys = safio.fileIn.replace(safio.file_type, '.crys_in')
+        if not os.path.isfile(old_crys):
+            old_crys = old_crys.replace('.crys_in', '.crys')
+        try:
+            linkFile(old_crys, template + '.crys_in')
+        except OSError:
+            print("Error copying the crystal file over!")
+            print(old_crys)
+            print(template + '.crys_in')
+
+    safio = copy.copy(safio)
+    safio.fileIn = template + '.input'
+    safio.setGridScat(True)
+    safio.NUMCHA = 1
+    # Jobs already made keep their links to the old one
+    safio.save(template + '.input.tmp', copy_crystal=False)
+    os.replace(template + '.input.tmp', template + '.input')
+    return template
+
+# Output name for the shot at x, y from input_file. Shots in a batch also
+# include the index, as they can share x, y.
+def outputName(input_file, x, y, index=None):
+    name = input_file + '{}_{}'.format(round(x, 3), round(y, 3))
+    if index is not None:
+        name = name + '_{}'.format(index)
+    return name
+
+# Parts of the input which change the trajectory of a single shot, the
+# beam, integration, potentials, thermal and crystal parameters. The
+# detector, grid and output settings don't, nor does Ion_Index, as the
+# seed is given on the command line and is in the directory name.
+TRAJECTORY_FIELDS = ['E0', 'THETA0', 'PHI0', 'MASS', 'SYMION', 'EMIN',
+                     'DELLOW', 'DELT0', 'DEMAX', 'DEMIN', 'ABSERR', 'NPART',
+                     'RECOIL', 'Z1', 'MAX_STEPS', 'RRMIN', 'RRSTEP', 'ZMIN',
+                     'ZSTEP', 'RAX', 'RAY', 'NPAR', 'IPOT', 'POTPAR', 'NIMPAR',
+                     'IIMPOT', 'PIMPAR', 'NBZ', 'TOL', 'ZMAX', 'NZ', 'NBG',
+                     'GTOL', 'GMAX', 'NG', 'TEMP', 'SEED', 'IMAGE', 'SENRGY',
+                     'BDIST', 'AX', 'AY', 'AZ', 'NBASIS', 'BASIS', 'NTYPES',
+                     'ATOMS', 'SPRINGS', 'CORR', 'ATOMK', 'RNEIGH', 'face',
+                     'load_crystal', 'loaded_face', 'F_a', 'F_b']
+
+# Hash of the trajectory fields of the input of template, and the size and
+# mtime of its crystal
+def inputHash(template):
+    safio = safari_input.loadInput(template + '.input')
+    h = hashlib.sha1()
+    for field in TRAJECTORY_FIELDS:
+        h.update('{}={!r}\n'.format(field, getattr(safio, field, None)).encode())
+    crys_file = template + '.crys_in'
+    if os.path.isfile(crys_file):
+        stat = os.stat(crys_file)
+        h.update('{} {}'.format(stat.st_size, stat.st_mtime).encode())
+    return h.hexdigest()[0:12]
+
+# Makes the directory for the shot at x, y with seed index, with links to
+# the input and crystal of template, as from prepareInput. If cached, this
+# is the same directory each time for the same shot and input, otherwise
+# it is a new one. Restricted shots only save some of the .xyz, so they get
+# their own directory. Returns the input, without the .input, and output
+# names to give Sea-Safari, both in the directory.
+def jobDirectory(template, x, y, index, cached=True, restricted=False):
+    label = '{}_{}_{}'.format(round(x, 3), round(y, 3), index)
+    if cached:
+        name = label + '_' + inputHash(template)
+        if restricted:
+            name = name + '_r'
+        directory = os.path.join(os.path.dirname(template), name)
+        os.makedirs(directory, exist_ok=True)
+    else:
+        directory = tempfile.mkdtemp(prefix=label + '_', dir=os.path.dirname(template))
+    input_file = os.path.join(directory, os.path.basename(template))
+    for ext in ['.input', '.crys_in']:
+        if os.path.isfile(template + ext):
+            linkFile(template + ext, input_file + ext)
+    return input_file, outputName(input_file, x, y, index)
+
+# Name of the step of processing the .xyz with XYZ, for colour
+def xyzStep(colour=None):
+    return 'xyz {}'.format(colour if colour else 'plain')
+
+# Records that step has finished for the shot with output_file, 'safari'
+# for Sea-Safari, or see xyzStep
+def markComplete(output_file, step='safari'):
+    with open(output_file + '.done', 'a') as f:
+        f.write(step + '\n')
+
+# The steps which have finished for the shot with output_file
+def completedSteps(output_file):
+    if not os.path.isfile(output_file + '.done'):
+        return set()
+    with open(output_file + '.done', 'r') as f:
+        return set(line.strip() for line in f)
+
+# True if Sea-Safari has finished for the shot with output_file, so its
+# .traj and .xyz can be used
+def isComplete(output_file):
+    return 'safari' in completedSteps(output_file) and os.path.isfile(output_file + '.traj')
+
+# Reads a points file, each line is x y ion_index, # starts a comment
+def loadPoints(filename):
+    points = []
+    with open(filename, 'r') as f:
+        for line in f:
+            args = line.split('#')[0].split()
+            if len(args) < 3:
+                continue
+            points.append((float(args[0]), float(args[1]), int(float(args[2]))))
+    return points
+
+# At most max_points of points, evenly spread through them
+def thinPoints(points, max_points):
+    if max_points is None or len(points) <= max_points:
+        return list(points)
+    step = len(points) / max_points
+    return [points[int(i * step)] for i in range(max_points)]
+
+class Batch:
+
+    # Runs single shots for points, a list of (x, y, ion_index), for the
+    # input of safio. These go through queue, a ProcessQueue, or a new one
+    # running workers at once if not given.
+    def __init__(self, safio, points, queue=None, workers=None, restricted=False):
+        self.safio = safio
+        self.points = list(points)
+        self.queue = queue if queue is not None else processes.ProcessQueue(workers)
+        self.restricted = restricted
+        self.input_file = None
+        self.processes = []
+        # .traj files of the shots which worked, or were already done, and
+        # the Processes which didn't
+        self.traj_files = []
+        self.cached = 0
+        self.failed = []
+        # If set, these are called with this Batch as each shot finishes,
+        # and then once they all have, from queue.poll()
+        self.on_progress = None
+        self.on_done = None
+
+    # Writes the input, and queues up the shots, each in its own directory,
+    # shots which have been run before are just collected.
+    def start(self):
+        self.input_file = prepareInput(self.safio)
+        for x, y, index in self.points:
+            input_file, output_file = jobDirectory(self.input_file, x, y, index, restricted=self.restricted)
+            if isComplete(output_file):
+                self.traj_files.append(output_file + '.traj')
+                self.cached = self.cached + 1
+                continue
+            command = safariCommand(input_file, output_file, x, y, index, self.restricted)
+            self.processes.append(self.queue.submit(command, name=output_file, on_done=self.finished))
+        # If they were all done before, there is nothing to wait for
+        if len(self.processes) == 0 and self.on_done is not None:
+            self.on_done(self)
+
+    def finished(self, process):
+        traj_file = process.name + '.traj'
+        if process.ok() and os.path.isfile(traj_file):
+            markComplete(process.name)
+            self.traj_files.append(traj_file)
+        else:
+            self.failed.append(process)
+        if self.on_progress is not None:
+            self.on_progress(self)
+        if self.done() and self.on_done is not None:
+            self.on_done(self)
+
+    # Number of shots finished so far, and the total
+    def count(self):
+        return len(self.traj_files) + len(self.failed), len(self.processes) + self.cached
+
+    def done(self):
+        finished, total = self.count()
+        return finished == total
+
+    def cancel(self):
+        for process in self.processes:
+            self.queue.cancel(process)
+
+    # Waits for them all, for use without a GUI
+    def wait(self):
+        self.queue.wait()
+
+    # Writes the .traj files made to filename, one per line, by default
+    # <name>_batch.txt. Returns the filename.
+    def save_list(self, filename=None):
+        if filename is None:
+            filename = self.safio.fileIn.replace(self.safio.file_type, '_batch.txt')
+        with open(filename, 'w') as f:
+            for traj_file in sorted(self.traj_files):
+                f.write(traj_file + '\n')
+        return filename
+
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help="SAFARI .input file")
+    parser.add_argument("-p", "--points", help="File of points, each line is x y ion_index")
+    parser.add_argument("-w", "--workers", type=int, help="Number of single shots to run at once")
+    parser.add_argument("-n", "--max_points", type=int, help="Only run this many of the points, spread through them")
+    parser.add_argument("-r", "--restricted", help="Only save the nearby atoms in the .xyz", action='store_true')
+    parser.add_argument("-o", "--output", help="List of the .traj files made, default <name>_batch.txt")
+    parser.add_argument("-e", "--ensemble", help="Also save the ensemble statistics to this .npz")
+    args = parser.parse_args()
+
+    safio = safari_input.SafariInput(args.input)
+    batch = Batch(safio, thinPoints(loadPoints(args.points), args.max_points),\
+                  workers=args.workers, restricted=args.restricted)
+    def progress(batch):
+        finished, total = batch.count()
+        print("{} of {} done, {} failed".format(finished, total, len(batch.failed)))
+    batch.on_progress = progress
+    batch.start()
+    batch.wait()
+    for process in batch.failed:
+        print("Failed: {}, exit code {}".format(process.name, process.returncode))
+        print(process.stderr[-2000:])
+    print("Saved list to {}".format(batch.save_list(args.output)))
+
+    if args.ensemble and len(batch.traj_files) > 0:
+        import traj_files.traj_ensemble as traj_ensemble
+        ensemble = traj_ensemble.Ensemble()
+        ensemble.load(batch.traj_files, args.workers)
+        if len(ensemble.trajs) == 0:
+            print("None of the trajectories could be loaded, not saving {}".format(args.ensemble))
+        else:
+            ensemble.resample()
+            ensemble.save(args.ensemble)
+    if len(batch.failed) > 0:
+        sys.exit(1)
@@ -1,37 +1,31 @@
 import tkinter as tk
 from tkinter import filedialog
+from tkinter import ttk
 
 import os
 from pathlib import Path
 import platform     # Linux vs Windows check
 
-import numpy as np
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, NavigationToolbar2Tk)
-from matplotlib import style
-from matplotlib.figure import Figure
-
-import data_files.detect_processor as dtect_proc
-from data_files.detect_processor import SpotDetector
-from data_files.detect_processor import Spectrum
-import data_files.detect_processor as detect
-import data_files.safari_input as safari_input
-import data_files.esa_data as esa_data
-
-import spec_files.load_spec as load_spec
-import spec_files.fit_esa as esa
-from spec_files.load_spec import Spec
-
-import traj_files.plot_traj as plot_traj
-
-import misc.crystalview as crystalview
-
 from misc.module import Menu
 from misc.module import Module
-
-import threading
+from misc.imports import LazyModule
+import misc.imports as imports
+import misc.timing as timing
+from misc.jobs import JobExecutor
+import misc.jobs as jobs
+from misc.processes import ProcessQueue
+
+# These are slow to import (numpy, scipy, matplotlib), so they are only
+# imported once a menu option first uses them.
+detect = LazyModule('data_files.detect_processor')
+safari_input = LazyModule('data_files.safari_input')
+esa_data = LazyModule('data_files.esa_data')
+load_spec = LazyModule('spec_files.load_spec')
+esa = LazyModule('spec_files.fit_esa')
+plot_traj = LazyModule('traj_files.plot_traj')
+crystalview = LazyModule('misc.crystalview')
+single_shot = LazyModule('data_files.single_shot')
+traj_ensemble = LazyModule('traj_files.traj_ensemble')
 
 global root_path
 
@@ -43,8 +37,6 @@ if platform.system() == 'Windows':
     font_16 = ('Times New Roman', 16)
     font_18 = ('Times New Roman', 18)
     font_20 = ('Times New Roman', 20)
-
-    plt.rcParams.update({'font.family': 'Times New Roman'})
 else:
     font_12 = ('DejaVu Sans', 12)
     font_14 = ('DejaVu Sans', 14)
@@ -52,10 +44,108 @@ else:
     font_18 = ('DejaVu Sans', 18)
     font_20 = ('DejaVu Sans', 20)
 
-    plt.rcParams.update({'font.family': 'DejaVu Sans'})
-
-plt.rcParams.update({'font.size': 18})
-
+plt = None
+FigureCanvasTkAgg = None
+NavigationToolbar2Tk = None
+
+# Imports matplotlib with the TkAgg backend the first time it is needed,
+# this should be called from the main thread. Returns pyplot
+def load_plotting():
+    global plt, FigureCanvasTkAgg, NavigationToolbar2Tk
+    if plt is not None:
+        return plt
+    matplotlib = imports.load('matplotlib')
+    matplotlib.use('TkAgg')
+    pyplot = imports.load('matplotlib.pyplot')
+    backend = imports.load('matplotlib.backends.backend_tkagg')
+    FigureCanvasTkAgg = backend.FigureCanvasTkAgg
+    NavigationToolbar2Tk = backend.NavigationToolbar2Tk
+
+    if platform.system() == 'Windows':
+        pyplot.rcParams.update({'font.family': 'Times New Roman'})
+    else:
+        pyplot.rcParams.update({'font.family': 'DejaVu Sans'})
+    pyplot.rcParams.update({'font.size': 18})
+    plt = pyplot
+    return plt
+
+# Compute stages for the plots, these are run by DetectModule.jobs in worker
+# processes, so they only take and return picklable things, the figures are
+# then made from the results on the main thread.
+
+# Lets the loops in detect_processor stop when the job is superseded
+def job_setup():
+    imports.load('data_files.detect_processor').cancel_check = jobs.checkpoint
+
+# Cleans the dataset with limits (emin, emax, phimin, phimax, thmin, thmax)
+def clean_job(dataset, limits):
+    job_setup()
+    _emin, _emax, _phimin, _phimax, _thmin, _thmax = limits
+    dataset.progress = jobs.progress
+    dataset.clean(emin=_emin,emax=_emax,\
+                  phimin=_phimin,phimax=_phimax,\
+                  thmin=_thmin,thmax=_thmax)
+    return dataset
+
+# Cleans the dataset, then makes the energy spectrum for its detector
+def spectrum_job(dataset, limits, res):
+    dataset = clean_job(dataset, limits)
+    energy, intensity, scale = dataset.detector.computeSpectrumE(res=res)
+    return dataset, energy, intensity
+
+# Loads and processes the .spec file, and fits the columns if fit
+def spec_job(spec_file, d_phi, min_e, fit, e_res, write_npz=False):
+    job_setup()
+    spec = load_spec.Spec(spec_file, progress=jobs.progress)
+    spec.write_npz = write_npz
+
+    spec.peak_finder = esa.peak_finder
+    spec.min_e = min_e
+
+    spec.big_font = False
+    spec.process_data(d_phi=d_phi)
+
+    if fit:
+        e_max = spec.e_range[1]
+        e_min = spec.e_range[0]
+        axis = esa.make_axis(e_min, e_max, spec.energy, spec.img.shape[0]) * spec.energy
+
+        # Set the width for integration function
+        spec.e_res = e_res
+        # Sets width for integrating internally during fitting
+        spec.winv = 5
+        # Sets the gaussian integration function
+        spec.integrate = detect.integrate
+
+        # Attempt to fit the columns of the image, these are plotted later
+        spec.try_fit(esa.fit_esa, axis, None)
+    return spec
+
+# Loads the .traj file, and the crystal around it from safio_file if given
+def traj_job(traj_file, safio_file=None):
+    traj = plot_traj.Traj()
+    traj.load(traj_file)
+    crystal = None
+    if safio_file is not None:
+        crystal = crystalview.load(safio_file, traj.extent())
+    return traj, crystal
+
+# Loads the crystal for safio_file, see crystalview.load
+def crystal_job(safio_file, path=None):
+    return crystalview.load(safio_file, path)
+
+# Loads the .traj files of a batch of single shots, saves the statistics
+# of them to stats_file, and returns them, see traj_ensemble.Ensemble.
+# Returns None if none of them could be loaded.
+def ensemble_job(traj_files, stats_file):
+    ensemble = traj_ensemble.Ensemble()
+    # Already in a worker, so this loads them in here
+    ensemble.load(traj_files, workers=1)
+    if len(ensemble.trajs) == 0:
+        return None
+    ensemble.resample()
+    ensemble.save(stats_file)
+    return ensemble.statistics()
 
 class Limits:
     def __init__(self):
@@ -114,26 +204,30 @@ class DetectSettings:
             'theta':'Theta: ',
             'phi':"Phi: ",
             'asize':"Angular Size: ",
-            'esize':"Energy Res: "
+            'esize':"Energy Res: ",
+            'write_npz':"Save .npz: "
         }
         # Units to go with the value, use `` if no units
         self._units_ = {
             'theta':'Degrees',
             'phi':"Degrees",
             'asize':"Degrees",
-            'esize':"eV"
+            'esize':"eV",
+            'write_npz':''
         }
         self.theta = 45
         self.phi = 0
         self.asize = 1
         self.esize = 1
+        self.write_npz = False
 
         # A help string to show in the help menu
         self.help_text = '   General settings for detector position and resolution:\n\n'+\
                          '   Theta: elevation angle for the detector, measured from normal (Degrees)\n'+\
                          '   Phi: azimuthal angle for detector (Degrees)\n'+\
                          '   Angular Size: spatial size of detector (Degrees)\n'+\
-                         '   Energy Res: gaussian bin width for detector (eV)\n\n'+\
+                         '   Energy Res: gaussian bin width for detector (eV)\n'+\
+                         '   Save .npz: If checked, spectra and fits are also saved as .npz\n\n'+\
                          '   Clicking Update will apply the changes and attempt to re-plot if applicable\n'+\
                          '   Clicking Cancel will close the window without applying changes'
 
@@ -197,6 +291,59 @@ class TrajSettings:
         # the settings have been changed via a gui interaction
         self._callback = None
 
+class SingleShotSettings:
+    def __init__(self):
+        # Names of the values, for showing in the options box
+        self._names_ = {
+            'max_running':'Max Running: ',
+            'max_batch':'Max Batch: ',
+        }
+        # Units to go with the value, use `` if no units
+        self._units_ = {
+            'max_running':'',
+            'max_batch':''
+        }
+        self.max_running = 2
+        self.max_batch = 100
+
+        # A help string to show in the help menu
+        self.help_text = '   Single Shot Settings:\n\n'+\
+                         '   Max Running: Most single shot runs going at once, any more\n'+\
+                         '   wait until one of these finishes\n'+\
+                         '   Max Batch: Most single shots run for a selection, if more\n'+\
+                         '   points are selected, this many are spread through them'
+
+        # This is the label to click to ge the above help text,
+        # this is also used for the label in the settings dropdown
+        self._label = 'Single Shot Settings'
+
+        # If this is set to a function, it will be called whenever
+        # the settings have been changed via a gui interaction
+        self._callback = None
+
+class BatchBand:
+    def __init__(self):
+        # Names of the values, for showing in the options box
+        self._names_ = {
+            'e_min':'Min Energy: ',
+            'e_max':'Max Energy: ',
+        }
+        # Units to go with the value, use `` if no units
+        self._units_ = {
+            'e_min':'eV',
+            'e_max':'eV'
+        }
+        self.e_min = 0
+        self.e_max = 0
+
+        # This is the label to click to ge the above help text,
+        # this is also used for the label in the settings dropdown
+        self._label = 'Batch Energy Band'
+
+        # If this is set to a function, it will be called whenever
+        # the settings have been changed via a gui interaction
+        self._callback = None
+
 class DetectModule(Module):
 
     def __init__(self, root):
@@ -209,42 +356,65 @@ class DetectModule(Module):
         self.toolbar = None
 
         self.dataset = None
-        self.detector = SpotDetector(45,0,1)
+        # Made when a file is selected
+        self.detector = None
 
         self.dsettings = DetectSettings()
         self.limits = Limits()
         self.comp_setitngs = CompSettings()
         self.traj_settings = TrajSettings()
+        self.ss_settings = SingleShotSettings()
 
         self.dsettings._callback = self.options_callback
         self.limits._callback = self.options_callback
+        self.ss_settings._callback = self.ss_options_callback
 
         self.safio_file = None
         self.traj_file = None
+        # (key, Traj) of the last .traj loaded, see with_traj
+        self.traj = None
 
         self.compare_esa_file = None
 
         self.comparison_file = None
 
-        self.fig, self.prep_fig = None, None
-        self.waiting = False
-
-        self.single_shots = {}
+        # Runs the compute part of the plots in other processes
+        self.jobs = JobExecutor()
+        # Plot request waiting to be submitted, see submit_plot
+        self.pending_plot = None
+        # Requests made within this many ms of each other are coalesced
+        self.coalesce_ms = 50
+        # Bar showing the progress of the plot job, see show_progress
+        self.progress_frame = None
+
+        # Runs the single shots, see misc/processes.py
+        self.shots = ProcessQueue(self.ss_settings.max_running)
+        # The recent single shots, newest last
+        self.shot_history = []
+        # Energy band for batches, and the selector for the region of the
+        # impact plot for them, see batch_select
+        self.batch_band = BatchBand()
+        self.selector = None
 
     def on_start(self):
         # This is called when the module is first added, after making the settings,
         # menus, etc.
-        self.get_tk().after(500, self.check_figs)
-        self.get_tk().after(500, self.check_single_shot)
+        # Finished jobs post this event, rather than us polling for them
+        self.get_tk().bind('<<JobDone>>', self.on_jobs_done)
+        self.jobs.wake = self.wake
+        self.shots.wake = self.wake
 
     def on_stop(self):
         # This is called when the program is exited
         print("Closing")
+        self.jobs.shutdown()
+        # Single shots still running are left to finish
+        self.shots.wake = None
 
     def get_settings(self):
         # Return an array or collection of settings here
         # Module can have more than 1 set of settings.
-        return [self.dsettings, self.limits, self.comp_setitngs, self.traj_settings]
+        return [self.dsettings, self.limits, self.comp_setitngs, self.traj_settings, self.ss_settings]
 
     def get_menus(self):
 
@@ -362,12 +532,57 @@ class DetectModule(Module):
         # Specify a label for the menu
         _plot_menu._label = "Plot"
 
-        # Returns an array of menus (only 1 in this case)
-        return [_file_menu, _plot_menu]
+        # "Single Shot" menu
+        _ss_menu = Menu()
+
+        _ss_menu._options["ss_status"] = lambda: self.single_shot_status()
+        _ss_menu._options["ss_cancel"] = lambda: self.cancel_single_shots()
+
+        _ss_menu._options["ss_rectangle"] = lambda: self.batch_select('rectangle')
+        _ss_menu._options["ss_lasso"] = lambda: self.batch_select('lasso')
+        _ss_menu._options["ss_band"] = lambda: self.batch_energy_band()
+
+        _ss_menu._opts_order.append("ss_rectangle")
+        _ss_menu._opts_order.append("ss_lasso")
+        _ss_menu._opts_order.append("ss_band")
+        _ss_menu._opts_order.append("sep")
+        _ss_menu._opts_order.append("ss_status")
+        _ss_menu._opts_order.append("ss_cancel")
+
+        batch_info = '   Batch Single Shots:\n\n'+\
+                     '   Runs single shots for each of the detections selected on the Impact Plot,\n'+\
+                     '   either by dragging a rectangle or a lasso around them, or within an energy band.\n\n'+\
+                     '   The .traj files made are listed in <name>_batch.txt, and the energy loss\n'+\
+                     '   statistics of them are saved to <name>_batch.npz and plotted when done.'
+        _ss_menu._helps["ss_rectangle"] = batch_info
+        _ss_menu._helps["ss_lasso"] = batch_info
+        _ss_menu._helps["ss_band"] = batch_info
+        _ss_menu._labels["ss_rectangle"] = "Batch (Rectangle)"
+        _ss_menu._labels["ss_lasso"] = "Batch (Lasso)"
+        _ss_menu._labels["ss_band"] = "Batch (Energy Band)"
+
+        _ss_menu._helps["ss_status"] = '   Shows the single shot runs, with their process id, exit code,\n'+\
+                                       '   run time and output.\n\n'+\
+                                       '   Single Shot runs can be generated via the Impact Plots'
+        _ss_menu._helps["ss_cancel"] = '   Stops the running single shots, and any waiting to run'
+
+        _ss_menu._labels["ss_status"] = "Single Shot Status"
+        _ss_menu._labels["ss_cancel"] = "Cancel Single Shots"
+
+        _ss_menu._label = "Single Shot"
+
+        # Returns an array of menus
+        return [_file_menu, _plot_menu, _ss_menu]
+
+    # Callback for changes to ss_settings
+    def ss_options_callback(self, window):
+        self.shots.set_max_running(self.ss_settings.max_running)
+        if window is not None:
+            window.destroy()
 
     # Callback for updating the detector/dataset based on changes to dsettings and limits
     def options_callback(self, window):
-        self.detector = SpotDetector(self.dsettings.theta,self.dsettings.phi,self.dsettings.asize)
+        self.detector = detect.SpotDetector(self.dsettings.theta,self.dsettings.phi,self.dsettings.asize)
         self.detector.ss_cmd = "python3 data_files/detect_impact.py"
         self.detector.safio = self.dataset.safio
         self.detector.safio.ESIZE = self.dsettings.esize
@@ -377,8 +592,11 @@ class DetectModule(Module):
         self.dataset.safio = self.detector.safio
         self.dataset.crystal = detect.loadCrystal(self.safio_file)
         self.dataset.detector = self.detector
+        self.dataset.write_npz = self.dsettings.write_npz
         if window is not None:
             window.destroy()
+        # Any running plot is for the old settings
+        self.cancel_plot()
         if self.last_run is not None:
             self.last_run()
             self.last_run = None
@@ -413,7 +631,7 @@ class DetectModule(Module):
         safio = safari_input.SafariInput(self.safio_file)
 
         detectorParams = safio.DTECTPAR
-        self.detector = SpotDetector(45,safio.PHI0,1)
+        self.detector = detect.SpotDetector(45,safio.PHI0,1)
         self.detector.ss_cmd = "python3 data_files/detect_impact.py"
 
         if self.limits.last_phi != safio.PHI0:
@@ -431,7 +649,7 @@ class DetectModule(Module):
         self.dsettings.asize = 1
         self.dsettings.esize = safio.ESIZE
 
-        self.dataset = Spectrum()
+        self.dataset = detect.Spectrum()
         self.dataset.crystal = detect.loadCrystal(self.safio_file)
         self.dataset.name = self.safio_file.replace('.input', '').replace('dbug', '')
         self.dataset.safio = safio
@@ -440,7 +658,12 @@ class DetectModule(Module):
 
         self.dataset.plots = False
         self.dataset.pics = False
+        self.dataset.write_npz = self.dsettings.write_npz
+        # Detector settings are often swept, so index the data by angle
+        self.dataset.use_index = True
 
+        # Any running plot is for the old file
+        self.cancel_plot()
         if self.last_run is not None:
             self.last_run()
 
@@ -464,12 +687,9 @@ class DetectModule(Module):
                 self.traj_energy_plot()
         return self.traj_file
 
-    # Displays the matplotlib figure fig in the main window
-    def show_fig(self, fig):
-
+    # Removes the current figure, if there is one
+    def clear_canvas(self):
         if self.canvas is not None:
-            # If we already have a canvas and toolbar, remove them
-
             # message is not even set on some Linux systems, causing
             # errors when trying to call destroy() below
             self.canvas.get_tk_widget().message = None
@@ -477,6 +697,14 @@ class DetectModule(Module):
 
             self.canvas.get_tk_widget().destroy()
             self.toolbar.destroy()
+            self.canvas = None
+            self.toolbar = None
+
+    # Displays the matplotlib figure fig in the main window
+    def show_fig(self, fig):
+
+        # If we already have a canvas and toolbar, remove them
+        self.clear_canvas()
 
         # create the Tkinter canvas containing the Matplotlib figure
         self.canvas = FigureCanvasTkAgg(fig, master = self.get_tk())
@@ -490,79 +718,272 @@ class DetectModule(Module):
         # place the canvas on the Tkinter window
         self.canvas.get_tk_widget().pack(side="top",fill='both',expand=True)
 
-    # This monitors for new figures to plot, so all plotting, etc happens on main thread
-    def check_figs(self):
-        if self.fig is not None:
-            if self.prep_fig is not None:
-                self.prep_fig()
-            self.show_fig(self.fig)
-            if self.fig_name is not None:
-                self.fig.savefig(self.fig_name)
-                self.fig_name = None
-            self.fig = None
-            self.prep_fig = None
-            self.waiting = False
-        if self.waiting:
-            if self.canvas is not None:
-                # We need to cleanup the canvas and toolbar
-                self.canvas.get_tk_widget().message = None
-                self.toolbar.message = None
-
-                self.canvas.get_tk_widget().destroy()
-                self.toolbar.destroy()
-            # Next we should probably make some thing that lets us know that it is waiting?
-            
-        self.get_tk().after(100, self.check_figs)
-
-    # Initializes the dataset based on limits defined by limits
-    def init_data(self):
-        _emin = self.limits.e_min
-        _emax = self.limits.e_max
-        _phimin = self.limits.p_min
-        _phimax = self.limits.p_max
-        _thmin = self.limits.t_min
-        _thmax = self.limits.t_max
+    # Called from the job pool threads when a job finishes, this wakes up the
+    # Tk loop, which then hands over the results in on_jobs_done
+    def wake(self):
+        try:
+            self.get_tk().event_generate('<<JobDone>>', when='tail')
+        except (tk.TclError, RuntimeError):
+            # The window has been closed
+            pass
+
+    # Runs the callbacks of the finished jobs, on the main thread, so all
+    # plotting, etc happens there.
+    def on_jobs_done(self, event=None):
+        self.jobs.poll()
+        self.shots.poll()
+
+    # The limits defined by limits, as passed to clean_job
+    def data_limits(self):
+        return (self.limits.e_min, self.limits.e_max,\
+                self.limits.p_min, self.limits.p_max,\
+                self.limits.t_min, self.limits.t_max)
+
+    # Copy of the dataset to send to a job, this has a new detector with the
+    # same settings, so that figures and callbacks are not sent along.
+    def job_dataset(self):
+        dataset = detect.Spectrum()
+        dataset.name = self.dataset.name
+        dataset.safio = self.dataset.safio
+        dataset.use_index = self.dataset.use_index
+        dataset.index_bin = self.dataset.index_bin
+        dataset.plots = False
+        dataset.pics = False
+        dataset.write_npz = self.dsettings.write_npz
+        old = self.detector
+        dataset.detector = detect.SpotDetector(old.theta, old.phi, old.size, old.rectangular)
+        dataset.detector.ss_cmd = old.ss_cmd
+        return dataset
+
+    # Takes over the dataset returned by a job
+    def set_dataset(self, dataset):
+        dataset.crystal = self.dataset.crystal
+        self.dataset = dataset
+        self.detector = dataset.detector
+        self.detector.plots = False
+        self.detector.pics = False
 
-        self.title_loading()
+    # Starts fn(*args) as the job for the plot, on_done is then called with the
+    # result on the main thread. This replaces any plot job still running.
+    # Bursts of requests, such as changing the limits twice quickly, are
+    # coalesced, so only the last one within coalesce_ms actually runs.
+    def submit_plot(self, on_done, fn, *args):
+        # The old figure is out of date now
+        self.clear_canvas()
+        # Stop anything already running, it is out of date now.
+        self.jobs.cancel('plot')
+        scheduled = self.pending_plot is not None
+        self.pending_plot = (on_done, fn, args)
+        if not scheduled:
+            self.get_tk().after(self.coalesce_ms, self.start_plot)
+
+    # Submits the latest plot request from submit_plot
+    def start_plot(self):
+        if self.pending_plot is None:
+            return
+        on_done, fn, args = self.pending_plot
+        self.pending_plot = None
+
+        def on_error(error):
+            print("Error making plot: {}".format(error))
+            self.hide_progress()
+            self.title_text('Error, see console')
+
+        self.jobs.submit('plot', fn, *args, on_done=on_done, on_error=on_error,\
+                         on_progress=self.show_progress)
+
+    # Drops any plot which has been requested, or is running
+    def cancel_plot(self):
+        self.pending_plot = None
+        self.jobs.cancel('plot')
+        self.hide_progress()
+
+    # Shows the progress of the plot job in a bar at the bottom of the window,
+    # along with the throughput and the time left for the current stage.
+    def show_progress(self, stage, done, total, unit):
+        if self.progress_frame is None:
+            self.progress_frame = tk.Frame(self.get_tk())
+            self.progress_bar = ttk.Progressbar(self.progress_frame, length=200, maximum=1000)
+            self.progress_bar.pack(side=tk.LEFT, padx=5, pady=2)
+            self.progress_label = tk.Label(self.progress_frame, anchor='w', font=font_12)
+            self.progress_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
+            self.progress_frame.pack(side=tk.BOTTOM, fill=tk.X)
+            self.progress_rate = detect.ProgressRate()
+        self.progress_rate.update(stage, done, total)
+        if total > 0:
+            self.progress_bar.configure(mode='determinate', value=1000 * min(done / total, 1))
+        else:
+            self.progress_bar.configure(mode='indeterminate')
+            self.progress_bar.step(10)
+        self.progress_label.configure(text=self.progress_rate.describe(stage, done, total, unit))
+
+    def hide_progress(self):
+        if self.progress_frame is not None:
+            self.progress_frame.destroy()
+            self.progress_frame = None
+
+    # Finishes the figure with prep_fig, then shows it, and saves it to
+    # fig_name, this is called by the job callbacks on the main thread.
+    def set_fig(self, fig, prep_fig=None, fig_name=None):
+        self.hide_progress()
+        if prep_fig is not None:
+            with timing.stage('prep_fig'):
+                prep_fig()
+        with timing.stage('draw'):
+            self.show_fig(fig)
+        if fig_name is not None:
+            with timing.stage('savefig'):
+                fig.savefig(fig_name)
+
+    # Shows how many single shots are still going in the title
+    def title_single_shots(self):
+        busy = self.shots.busy()
+        if busy > 0:
+            self.title_text("Running {} Single Shot{}".format(busy, '' if busy == 1 else 's'))
+        else:
+            self.title_selected()
 
-        self.dataset.clean(emin=_emin,emax=_emax,\
-                    phimin=_phimin,phimax=_phimax,\
-                    thmin=_thmin,thmax=_thmax)
+    # Called with the Process when a single shot starts
+    def register_single_shot(self, process):
+        self.shot_history.append(process)
+        # Only keep the recent ones, along with their output
+        self.shot_history = self.shot_history[-50:]
+        self.title_single_shots()
+
+    # Called with the Process when a single shot finishes
+    def single_shot_done(self, process):
+        self.title_single_shots()
+        if process.cancelled:
+            print("Cancelled single shot {}".format(process.name))
+        elif not process.ok():
+            print("Single shot {} failed with exit code {}".format(process.name, process.returncode))
+            print(process.stderr[-2000:])
+            if self.shots.busy() == 0:
+                self.title_text("Single Shot Failed")
+        elif os.path.isfile(process.name + '.traj'):
+            # So the trajectory plots show this shot
+            self.traj_file = process.name + '.traj'
+
+    def cancel_single_shots(self):
+        self.stop_selector()
+        self.shots.cancel_all()
+
+    # Returns True if the impact plot is showing, so points can be selected
+    def impact_showing(self):
+        if self.last_run != self.impact_plot or self.detector is None or getattr(self.detector, 'ax', None) is None:
+            self.title_text('Make an Impact Plot first')
+            return False
+        return True
+
+    # Lets a region of the impact plot be selected, with mode 'rectangle'
+    # or 'lasso', then runs single shots for the detections inside it
+    def batch_select(self, mode):
+        if not self.impact_showing():
+            return
+        from matplotlib.widgets import RectangleSelector, LassoSelector
+        self.stop_selector()
+        detector = self.detector
+
+        def on_rectangle(press, release):
+            x_min, x_max = sorted([press.xdata, release.xdata])
+            y_min, y_max = sorted([press.ydata, release.ydata])
+            self.stop_selector()
+            self.run_batch(detector, detector.detections.inRectangle(x_min, x_max, y_min, y_max))
+
+        def on_lasso(vertices):
+            self.stop_selector()
+            self.run_batch(detector, detector.detections.inPolygon(vertices))
+
+        if mode == 'rectangle':
+            self.selector = RectangleSelector(detector.ax, on_rectangle, button=[1])
+        else:
+            self.selector = LassoSelector(detector.ax, on_lasso, button=[1])
+        self.title_text('Drag around the points for the single shots')
 
-        self.title_selected()
-        
-        self.dataset.plots = False
-        self.dataset.pics = False
-        self.detector.plots = False
-        self.detector.pics = False
+    def stop_selector(self):
+        if self.selector is not None:
+            self.selector.set_active(False)
+            self.selector = None
 
-    # This monitors for if a single shot run is in progress, and if so, it will give an indication that it is still running
-    def check_single_shot(self):
-
-        if len(self.single_shots) > 0:
-            to_clean = []
-            for vmd_file, state in self.single_shots.items():
-                # State 0: waiting for things to run
-                if state == 0:
-                    self.title_text("Running Single Shot!")
-                    if os.path.isfile(vmd_file):
-                        self.single_shots[vmd_file] = 1
-                # State 1: vmd opened
-                elif state == 1:
-                    self.title_text("Finished Single Shot!")
-                    if not os.path.isfile(vmd_file):
-                        self.single_shots[vmd_file] = 2
-                # State 2: completely finished
-                else:
-                    self.title_selected()
-                    to_clean.append(vmd_file)
-            for key in to_clean:
-                self.single_shots.pop(key)
-        self.get_tk().after(500, self.check_single_shot)
-
-    # This records that the run has started, so it can be watched for updating application title
-    def register_single_shot(self, vmd_file):
-        self.single_shots[vmd_file] = 0
+    # Asks for an energy band, then runs single shots for the detections in it
+    def batch_energy_band(self):
+        if not self.impact_showing():
+            return
+        if self.batch_band.e_min == self.batch_band.e_max:
+            self.batch_band.e_min = self.limits.e_min
+            self.batch_band.e_max = self.limits.e_max
+        detector = self.detector
+
+        def callback(window):
+            if window is not None:
+                window.destroy()
+            band = self.batch_band
+            self.run_batch(detector, detector.detections.inEnergyBand(band.e_min, band.e_max))
+        self._root.edit_options(self.batch_band, self.batch_band._label, callback)
+
+    # Runs single shots for the detections of detector at indices
+    def run_batch(self, detector, indices):
+        points = detector.detections.impactPoints(indices)
+        points = single_shot.thinPoints(points, self.ss_settings.max_batch)
+        if len(points) == 0:
+            self.title_text('No detections selected')
+            return
+        batch = single_shot.Batch(detector.safio, points, queue=self.shots)
+        batch.on_progress = self.batch_progress
+        batch.on_done = self.batch_done
+        batch.start()
+        for process in batch.processes:
+            self.register_single_shot(process)
+        self.batch_progress(batch)
+
+    def batch_progress(self, batch):
+        finished, total = batch.count()
+        self.title_text("Batch: {} of {} Single Shots done, {} failed".format(finished, total, len(batch.failed)))
+
+    # Saves the list of .traj files, then plots the energy loss of them
+    def batch_done(self, batch):
+        for process in batch.failed:
+            if not process.cancelled:
+                print("Single shot {} failed with exit code {}".format(process.name, process.returncode))
+        if len(batch.traj_files) == 0:
+            self.title_text("Batch finished, no trajectories made")
+            return
+        list_file = batch.save_list()
+        print("Saved list of trajectories to {}".format(list_file))
+        stats_file = list_file.replace('.txt', '.npz')
+
+        def on_done(stats):
+            if stats is None:
+                self.hide_progress()
+                self.title_text("Batch finished, none of the trajectories could be loaded")
+                return
+            plt = load_plotting()
+            fig, ax = plt.subplots(figsize=(12.0, 9.0))
+            traj_ensemble.plotEnergyLoss(ax, stats)
+            self.last_run = None
+            self.set_fig(fig, None, stats_file.replace('.npz', '.png'))
+            self.title_text("Batch of {} Trajectories".format(len(batch.traj_files)))
+
+        self.title_text('Loading Trajectories')
+        self.submit_plot(on_done, ensemble_job, batch.traj_files, stats_file)
+
+    # Shows the recent single shots, and their output, in a new window
+    def single_shot_status(self):
+        window = tk.Toplevel(self.get_tk())
+        window.wm_title("Single Shots")
+        text = tk.Text(window, width=100, height=30, font=('Courier', 10))
+        text.pack(side="top", fill='both', expand=True)
+        lines = []
+        for process in reversed(self.shot_history):
+            lines.append("{}\n  {}, pid {}, exit code {}, {:.1f}s".format(process.name, process.state,\
+                         process.pid, process.returncode, process.runtime()))
+            if process.state == 'done':
+                lines.append("  stdout: " + process.stdout[-500:].strip().replace('\n', '\n    '))
+                lines.append("  stderr: " + process.stderr[-500:].strip().replace('\n', '\n    '))
+        if len(lines) == 0:
+            lines.append("No single shots run yet")
+        text.insert(tk.END, '\n'.join(lines))
+        text.config(state=tk.DISABLED)
 
     # Produces an energy vs theta plot, this requires the .spec file to exist.
     def e_vs_t_plot(self, fit=False):
@@ -583,42 +1004,16 @@ class DetectModule(Module):
                 self.e_vs_t_plot(fit=True)
             self.last_run = replot
 
-        self.fig = None
-        self.waiting = True
-        fig, ax = plt.subplots(figsize=(12.0, 9.0))
-        
-        # Wraps this for a separate thread, allowing off-thread processing, but still running all of the matplotlib stuff on the main thread
-        def do_work():
-            self.title_loading()
-            spec_file = self.safio_file.replace('.input','').replace('.dbug','')+'.spec'
-            spec = Spec(spec_file)
-
-            spec.peak_finder = esa.peak_finder
-            spec.min_e = self.limits.e_min
+        spec_file = self.safio_file.replace('.input','').replace('.dbug','')+'.spec'
 
+        # Plotting is done here, on the main thread, once the spec is processed
+        def on_done(spec):
+            fig, ax = load_plotting().subplots(figsize=(12.0, 9.0))
             spec.fig, spec.ax = fig, ax
-            spec.big_font = False
-            spec.process_data(d_phi=self.limits.p_max-self.limits.p_min)
             spec.make_e_t_plot(do_plot=False, do_fits=fit)
 
             if fit:
-                self.title_text('Fitting, Please Wait')
-                e_max = spec.e_range[1]
-                e_min = spec.e_range[0]
-                t_min = spec.t_range[0]
-                t_max = spec.t_range[1]
-                axis = esa.make_axis(e_min, e_max, spec.energy, spec.img.shape[0]) * spec.energy
-
-                # Set the width for integration function
-                spec.e_res = self.dsettings.esize
-                # Sets width for integrating internally during fitting
-                spec.winv = 5
-                # Sets the gaussian integration function
-                spec.integrate = dtect_proc.integrate
-
-                # Attempt to fit the columns of the image
-                spec.try_fit(esa.fit_esa, axis, ax)
-
+                spec.plot_fits(ax)
                 if self.comparison_file is not None:
                     theta, energy, err = esa.load_data(self.comparison_file)
                     ax.scatter(theta,energy,c='r',s=4,label="Data")
@@ -626,15 +1021,13 @@ class DetectModule(Module):
                         ax.errorbar(theta,energy,yerr=err, c='r',fmt='none',capsize=2)
                     ax.legend()
 
-            # Here we update these to indicate that we have finished processing
-            self.prep_fig = spec.prep_fig
-            self.fig_name = spec_file.replace('.spec', '_fit_spec.png')
-            self.fig = fig
+            self.set_fig(fig, spec.prep_fig, spec_file.replace('.spec', '_fit_spec.png'))
             # Reset title to selected now that we are done
             self.title_selected()
-        # Schedule this on a worker thread
-        thread = threading.Thread(target=do_work)
-        thread.start()
+
+        self.title_text('Fitting, Please Wait' if fit else 'Loading, Please Wait')
+        self.submit_plot(on_done, spec_job, spec_file, self.limits.p_max-self.limits.p_min,\
+                         self.limits.e_min, fit, self.dsettings.esize, self.dsettings.write_npz)
 
     # Produces an intensity vs energy plot
     def i_vs_e_plot(self):
@@ -650,31 +1043,26 @@ class DetectModule(Module):
 
         self.last_run = self.i_vs_e_plot
 
-        self.fig = None
-        self.waiting = True
-        plots = plt.subplots(figsize=(8.0, 6.0))
-
-        # Wraps this for a separate thread, allowing off-thread processing, but still running all of the matplotlib stuff on the main thread
-        def do_work():
-            self.title_loading()
-            self.init_data()
-            self.title_text('Processing, Please Wait')
-            energy, intensity, scale = self.detector.spectrumE(res=self.detector.safio.ESIZE, override_fig=plots)
-            # Here we update these to indicate that we have finished processing
-            self.prep_fig = self.detector.prep_fig
+        # Plotting is done here, on the main thread, once the spectrum is made
+        def on_done(result):
+            dataset, energy, intensity = result
+            self.set_dataset(dataset)
+            plots = load_plotting().subplots(figsize=(8.0, 6.0))
+            self.detector.plotSpectrumE(energy, intensity, override_fig=plots)
+            prep_fig = self.detector.prep_fig
 
             if self.compare_esa_file is not None:
                 def new_prep():
                     self.detector.prep_fig()
                     self.add_esa_spec(plots)
-                self.prep_fig = new_prep
+                prep_fig = new_prep
 
-            self.fig_name = self.detector.fig_name
-            self.fig = self.detector.fig
+            self.set_fig(self.detector.fig, prep_fig, self.detector.fig_name)
             self.title_selected()
-        # Schedule this on a worker thread
-        thread = threading.Thread(target=do_work)
-        thread.start()
+
+        self.title_text('Processing, Please Wait')
+        self.submit_plot(on_done, spectrum_job, self.job_dataset(),\
+                         self.data_limits(), self.detector.safio.ESIZE)
 
     # Produces an impact plot
     def impact_plot(self):
@@ -690,27 +1078,20 @@ class DetectModule(Module):
         
         self.last_run = self.impact_plot
 
-        self.fig = None
-        self.waiting = True
-        self.detector.ss_callback = self.register_single_shot
-        plots = plt.subplots(figsize=(12.0, 9.0))
-
-        # Wraps this for a separate thread, allowing off-thread processing, but still running all of the matplotlib stuff on the main thread
-        def do_work():
-            self.title_loading()
-            self.init_data()
-            self.title_text('Processing, Please Wait')
+        # Plotting is done here, on the main thread, once the data is cleaned
+        def on_done(dataset):
+            self.set_dataset(dataset)
+            self.detector.ss_callback = self.register_single_shot
+            self.detector.ss_done = self.single_shot_done
+            self.detector.ss_queue = self.shots
+            plots = load_plotting().subplots(figsize=(12.0, 9.0))
             self.detector.impactParam(basis=self.dataset.crystal, override_fig=plots)
-            fig, ax = self.detector.fig, self.detector.ax
-            # Here we update these to indicate that we have finished processing
-            self.prep_fig = self.detector.prep_fig
-            self.fig_name = self.detector.fig_name
-            self.fig = self.detector.fig
+            self.set_fig(self.detector.fig, self.detector.prep_fig, self.detector.fig_name)
             # Switch to finished title
             self.title_selected()
-        # Schedule this on a worker thread
-        thread = threading.Thread(target=do_work)
-        thread.start()
+
+        self.title_text('Processing, Please Wait')
+        self.submit_plot(on_done, clean_job, self.job_dataset(), self.data_limits())
 
     # Produces a plot of energy as a function of time for the projectile during a single shot run
     def traj_energy_plot(self):
@@ -719,22 +1100,16 @@ class DetectModule(Module):
             return
 
         self.last_run = self.traj_energy_plot
+        traj_file = self.traj_file
 
-        self.fig = None
-        self.waiting = True
-        fig, ax = plt.subplots(figsize=(12.0, 9.0))
-
-        def do_work():
-            self.title_text('Loading Traj')
-            traj = plot_traj.Traj()
-            traj.load(self.traj_file)
+        def on_done(result):
+            traj, crystal = result
+            fig, ax = load_plotting().subplots(figsize=(12.0, 9.0))
             traj.plot_energies(ax)
-            self.fig = fig
-            self.fig_name = self.traj_file.replace('.traj', '_traj_energy.png')
+            self.set_fig(fig, None, traj_file.replace('.traj', '_traj_energy.png'))
             self.title_text('Trajectory Energies')
-        # Schedule this on a worker thread
-        thread = threading.Thread(target=do_work)
-        thread.start()
+
+        self.with_traj(on_done, traj_file)
 
     # Produces a plot of power as a function of time for the projectile during a single shot run
     def traj_power_plot(self):
@@ -743,21 +1118,16 @@ class DetectModule(Module):
             self.select_traj_file()
             return
 
-        self.fig = None
-        self.waiting = True
-        fig, ax = plt.subplots(figsize=(12.0, 9.0))
+        traj_file = self.traj_file
 
-        def do_work():
-            self.title_text('Loading Traj')
-            traj = plot_traj.Traj()
-            traj.load(self.traj_file)
+        def on_done(result):
+            traj, crystal = result
+            fig, ax = load_plotting().subplots(figsize=(12.0, 9.0))
             traj.plot_power(ax)
-            self.fig = fig
-            self.fig_name = self.traj_file.replace('.traj', '_traj_power.png')
+            self.set_fig(fig, None, traj_file.replace('.traj', '_traj_power.png'))
             self.title_text('Trajectory Power')
-        # Schedule this on a worker thread
-        thread = threading.Thread(target=do_work)
-        thread.start()
+
+        self.with_traj(on_done, traj_file)
 
     # Produces a 3d trajectory plot for the particle
     def traj_plot(self):
@@ -767,31 +1137,62 @@ class DetectModule(Module):
                 return
 
         self.last_run = self.traj_plot
+        traj_file = self.traj_file
+
+        safio_file = None
+        if self.traj_settings.show_lattice and self.safio_file is not None:
+            safio_file = self.safio_file
+
+        def on_done(result):
+            traj, crystal = result
+            plt = load_plotting()
+            fig = plt.figure()
+            ax = plt.axes(projection='3d')
+            ax.set_xlabel('X (Å)')
+            ax.set_ylabel('Y (Å)')
+            ax.set_zlabel('Z (Å)')
+
+            if crystal is not None:
+                X, Y, Z, S, bounds, mask = crystal
+                if len(X) > 0:
+                    crystalview.plot_crystal(X, Y, Z, S, ax)
 
-        self.fig = None
-        self.waiting = True
-        fig = plt.figure()
-        ax = plt.axes(projection='3d')
-        ax.set_xlabel('X (Å)')
-        ax.set_ylabel('Y (Å)')
-        ax.set_zlabel('Z (Å)')
+            traj.plot_traj_3d(fig, ax)
+            self.set_fig(fig, None, traj_file.replace('.traj', '_traj.png'))
+            self.title_text('Trajectory Plot')
 
-        def do_work():
-            self.title_text('Loading Traj')
-            traj = plot_traj.Traj()
-            traj.load(self.traj_file)
+        self.with_traj(on_done, traj_file, safio_file)
 
-            if self.traj_settings.show_lattice and self.safio_file is not None:
-                crystalview.plot(self.safio_file, ax, do_lims=False, do_bounds=False)
+    # Identifies the version of traj_file, so a loaded Traj is only reused
+    # if the file has not changed since.
+    def traj_key(self, traj_file):
+        try:
+            stat = os.stat(traj_file)
+        except OSError:
+            return None
+        return (traj_file, stat.st_mtime, stat.st_size)
 
-            traj.plot_traj_3d(fig, ax)
-            self.fig = fig
-            self.fig_name = self.traj_file.replace('.traj', '_traj.png')
-            self.title_text('Trajectory Plot')
+    # Calls on_done((traj, crystal)) for the trajectory plots. The last Traj
+    # loaded is kept, so switching between the plots does not reload it,
+    # then only the crystal around it for safio_file is loaded, if given.
+    def with_traj(self, on_done, traj_file, safio_file=None):
+        key = self.traj_key(traj_file)
 
-        # Schedule this on a worker thread
-        thread = threading.Thread(target=do_work)
-        thread.start()
+        def loaded(result):
+            self.traj = (key, result[0])
+            on_done(result)
+
+        if key is None or self.traj is None or self.traj[0] != key:
+            self.title_text('Loading Traj')
+            self.submit_plot(loaded, traj_job, traj_file, safio_file)
+        elif safio_file is not None:
+            traj = self.traj[1]
+            self.title_text('Loading Traj')
+            self.submit_plot(lambda crystal: on_done((traj, crystal)), crystal_job, safio_file, traj.extent())
+        else:
+            # Drop any other plot still on the way, then plot this now
+            self.cancel_plot()
+            on_done((self.traj[1], None))
 
     # Produces a 3d plot of the crystal used for scattering, also includes indications of the overlay of the 
     # active area of the surface, as well as the possible surface mask
@@ -807,28 +1208,22 @@ class DetectModule(Module):
 
         self.last_run = self.crystal_plot
 
-        self.fig = None
-        self.waiting = True
-
-        fig = plt.figure()
-        ax = plt.axes(projection='3d')
-        ax.set_xlabel('X (Å)')
-        ax.set_ylabel('Y (Å)')
-        ax.set_zlabel('Z (Å)')
-
-        # Wraps this for a separate thread, allowing off-thread processing, but still running all of the matplotlib stuff on the main thread
-        def do_work():
-            self.title_loading()
-            self.title_text('Processing, Please Wait')
-            crystalview.plot(self.safio_file, ax)
-            # Here we update these to indicate that we have finished processing
-            self.prep_fig = None
-            self.fig_name = None
-            self.fig = fig
+        def on_done(crystal):
+            plt = load_plotting()
+            fig = plt.figure()
+            ax = plt.axes(projection='3d')
+            ax.set_xlabel('X (Å)')
+            ax.set_ylabel('Y (Å)')
+            ax.set_zlabel('Z (Å)')
+
+            X, Y, Z, S, bounds, mask = crystal
+            crystalview.plot_crystal(X, Y, Z, S, ax)
+            crystalview.add_active_area(ax, bounds, mask)
+            self.set_fig(fig)
             self.title_selected()
-        # Schedule this on a worker thread
-        thread = threading.Thread(target=do_work)
-        thread.start()
+
+        self.title_loading()
+        self.submit_plot(on_done, crystal_job, self.safio_file)
 
     # Adds the loaded .esa file to the given plots, used for comparing Intensity vs. Energy plots
     def add_esa_spec(self, plots):
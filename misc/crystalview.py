@@ -8,18 +8,20 @@ import os           # os.remove is used for .vmd file
 import time         # sleeps before removing file
 
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
 
 import sys
 sys.path.insert(1, './data_files')
+# The repo root, for data_files.crystal
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
 import safari_input
+import data_files.crystal as crystal
 
-def load(file_in):
+# Loads the crystal for file_in, only the atoms within the size of the
+# active area around it, or if path is given, the atoms near the points
+# px, py, pz of path, see Crystal.near
+def load(file_in, path=None):
 
-    lines = []
-    
     safio = safari_input.SafariInput(file_in)
     bounds = [[safio.XSTART, safio.XSTOP],[safio.YSTART, safio.YSTOP]]
     mask = [safio.x_points, safio.y_points]
@@ -33,40 +35,15 @@ def load(file_in):
     dx = max_x - min_x
     dy = max_y - min_y
 
-    X = []
-    Y = []
-    Z = []
-    S = []
-
-    if file_in.endswith('.input'):
-        file_in = file_in.replace('.input', '.crys')
-    elif file_in.endswith('.dbug'):
-        file_in = file_in.replace('.dbug', '.crys')
-
-    file = open(file_in, 'r')
-    for line in file:
-        args = line.split()
-        if len(args)==5:
-            lines.append(args)
-
-            x = float(args[0])
-            y = float(args[1])
-            z = float(args[2])
-
-            if x < min_x - dx or x > max_x + dx:
-                continue
-            if y < min_y - dy or y > max_y + dy:
-                continue
-
-            X.append(x)
-            Y.append(y)
-            Z.append(z)
-            S.append(args[3])
-
-    file.close()
-    X = np.array(X)
-    Y = np.array(Y)
-    Z = np.array(Z)
+    crys = crystal.loadCrystal(file_in)
+    if path is not None:
+        found = crys.near(*path)
+    else:
+        found = crys.region(min_x - dx, max_x + dx, min_y - dy, max_y + dy)
+    X = crys.x[found]
+    Y = crys.y[found]
+    Z = crys.z[found]
+    S = crys.atomic_number[found]
     return X, Y, Z, S, bounds, mask
 
 def plot_crystal(x, y, z, S, ax, do_lims=True):
@@ -137,6 +114,9 @@ def plot(filename, ax, do_lims=True, do_bounds=True):
     return
 
 if __name__ == "__main__" :
+    # Only here, as load is also used in the job workers, without a GUI
+    import matplotlib.pyplot as plt
+
     filename = './var/204.dbug'
 
     fig = plt.figure()
@@ -0,0 +1,46 @@
+import importlib    # Actually imports the modules
+import sys          # Checking for already loaded modules
+import time         # Timing the imports
+
+# The GUI only needs tkinter to show the window, things like matplotlib,
+# scipy and the analysis modules are slow to import, so they are loaded
+# through here the first time that something needs them.
+
+# If True, each import done through here is printed as it happens
+report = False
+
+# Module name -> seconds it took to import, only for the ones loaded here
+import_times = {}
+
+# Imports the module by name, recording how long it took
+def load(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    import_times[name] = time.perf_counter() - start
+    if report:
+        print("Imported {} in {:.3f}s".format(name, import_times[name]))
+    return module
+
+# Prints the times for everything imported so far, slowest first
+def print_report():
+    total = 0
+    for name, dt in sorted(import_times.items(), key=lambda x: -x[1]):
+        print("{:>8.3f}s  {}".format(dt, name))
+        total = total + dt
+    print("{:>8.3f}s  total".format(total))
+
+# Stand-in for a module, which is only imported when an attribute of it
+# is first used, so `detect = LazyModule('data_files.detect_processor')`
+# can then be used just like `import data_files.detect_processor as detect`
+class LazyModule:
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = load(self._name)
+        return getattr(self._module, attr)
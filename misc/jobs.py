@@ -0,0 +1,256 @@
+import concurrent.futures  # Process pool
+import multiprocessing     # Start method for the pool
+import os                  # cpu_count
+import queue               # Finished jobs, from the pool threads
+import threading           # Listens for progress from the workers
+import time                # Limiting progress updates
+import traceback           # Printing errors from the jobs
+
+import misc.timing as timing
+
+# Runs the slow compute stages of the plots in worker processes, so that
+# they don't hold the GIL of the GUI. Only the functions and their
+# arguments/results are sent between processes, so these must be picklable
+# (top level functions, numpy arrays, etc), figures stay on the main thread.
+#
+# Each job has a key, and each job submitted for a key gets the next
+# generation number for it. By default, submitting a new job supersedes the
+# old ones for the key: the oldest generation still wanted is shared with
+# the workers, so a running job sees it has been superseded at its next
+# checkpoint(), and stops by raising Cancelled. Results of superseded jobs
+# are dropped rather than handed back.
+#
+# When a job finishes, the pool posts it to a thread-safe queue, and calls
+# wake() if it is set, which should get the main (Tk) thread to call poll().
+# poll() then runs the callbacks, on the thread that called it.
+#
+# Ordering: for each key, results are handed back in the order the jobs
+# were submitted, a job which finishes early is held until all of the
+# earlier jobs for its key have been handed back (or dropped). Jobs for
+# different keys are independent of each other.
+#
+# Jobs can report progress by calling progress(stage, done, total, unit),
+# or by passing it as the progress callback to detect_processor, etc. This
+# is sent back, and passed to the on_progress of the job in poll().
+#
+# If timing is enabled when a job is submitted, the stage timings from the
+# worker are sent back with the result, and added to the ones here.
+
+# Maximum number of different keys an executor can have
+MAX_KEYS = 32
+
+# Raised by checkpoint() in a job which has been superseded
+class Cancelled(Exception):
+    pass
+
+# In the worker processes, this is the oldest generation still wanted for
+# each key slot, and _running is (slot, generation) of the running job.
+_generations = None
+_running = None
+# Queue for sending progress back, and when it was last sent
+_progress = None
+_last_progress = 0
+
+def _init_worker(generations, progress_queue):
+    global _generations, _progress
+    _generations = generations
+    _progress = progress_queue
+
+def _run(slot, generation, fn, args, timed):
+    global _running, _last_progress
+    _running = (slot, generation)
+    _last_progress = 0
+    timing.enabled = timed
+    timing.reset()
+    try:
+        # It may have been superseded while waiting in the queue
+        checkpoint()
+        return fn(*args), timing.take()
+    finally:
+        _running = None
+
+# Raises Cancelled if the job running in this process has been superseded.
+# Long running code should call this every so often, outside of a job, or
+# in the main process, this does nothing.
+def checkpoint():
+    if _running is not None and _generations[_running[0]] > _running[1]:
+        raise Cancelled()
+
+# Progress callback for the running job, this sends the progress back to
+# the executor, at most 10 times a second, but always when finished.
+def progress(stage, done, total, unit):
+    global _last_progress
+    if _running is None or _progress is None:
+        return
+    now = time.time()
+    if now - _last_progress < 0.1 and not (total > 0 and done >= total):
+        return
+    _last_progress = now
+    _progress.put((_running[0], _running[1], stage, done, total, unit))
+
+class JobExecutor:
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.workers = workers
+        self.pool = None
+        # spawn so that the workers don't inherit the state of the GUI,
+        # this is also what windows has to use anyway.
+        self.context = multiprocessing.get_context('spawn')
+        # Oldest generation still wanted for each key, shared with the workers
+        self.generations = self.context.Array('q', MAX_KEYS)
+        # key -> index in self.generations
+        self.slots = {}
+        # key -> last generation given out
+        self.issued = {}
+        # key -> {generation: (future, on_done, on_error, on_progress)},
+        # in submission order
+        self.current = {}
+        # (key, generation) of jobs the pool has finished, see poll()
+        self.finished = queue.Queue()
+        # Progress from the workers, and a copy of it on this side
+        self.progress_queue = self.context.Queue()
+        self.updates = queue.Queue()
+        self.listener = None
+        # Finished jobs which are waiting for earlier ones of their key
+        self.done = set()
+        # If set, this is called from a pool thread whenever a job finishes
+        self.wake = None
+
+    def get_pool(self):
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.workers,\
+                            mp_context=self.context, initializer=_init_worker,\
+                            initargs=(self.generations, self.progress_queue))
+        if self.listener is None:
+            self.listener = threading.Thread(target=self.listen, daemon=True)
+            self.listener.start()
+        return self.pool
+
+    # Passes progress from the workers on to poll(), until shutdown()
+    def listen(self):
+        while True:
+            update = self.progress_queue.get()
+            if update is None:
+                return
+            self.updates.put(update)
+            if self.wake is not None:
+                self.wake()
+
+    def get_slot(self, key):
+        if key not in self.slots:
+            if len(self.slots) >= MAX_KEYS:
+                raise ValueError("Too many job keys, at most {}".format(MAX_KEYS))
+            self.slots[key] = len(self.slots)
+        return self.slots[key]
+
+    # Runs fn(*args) in a worker process, then on_done(result) in poll().
+    # If fn raises, on_error(exception) is called instead, if given.
+    # on_progress(stage, done, total, unit) is called with the progress.
+    # If supersede, any other jobs for key are cancelled first, otherwise
+    # this is queued up after them. Returns the generation number of the job.
+    def submit(self, key, fn, *args, on_done=None, on_error=None,\
+               on_progress=None, supersede=True):
+        if supersede:
+            self.cancel(key)
+        slot = self.get_slot(key)
+        generation = self.issued.get(key, 0) + 1
+        self.issued[key] = generation
+        job = (slot, generation, fn, args, timing.enabled)
+        try:
+            future = self.get_pool().submit(_run, *job)
+        except concurrent.futures.process.BrokenProcessPool:
+            # A worker died, so start a new pool and try again
+            self.pool = None
+            future = self.get_pool().submit(_run, *job)
+        self.current.setdefault(key, {})[generation] = (future, on_done, on_error, on_progress)
+
+        def finished(future):
+            # This is run on a thread of the pool, so just post it
+            self.finished.put((key, generation))
+            if self.wake is not None:
+                self.wake()
+        future.add_done_callback(finished)
+        return generation
+
+    # Cancels the jobs for key, running ones stop at their next checkpoint
+    def cancel(self, key):
+        if key in self.issued:
+            self.generations[self.get_slot(key)] = self.issued[key] + 1
+        jobs = self.current.pop(key, {})
+        for job in jobs.values():
+            job[0].cancel()
+
+    # Returns True if there is a job for key which has not been handed back
+    def busy(self, key):
+        return len(self.current.get(key, {})) > 0
+
+    # Runs the callbacks for any jobs that have finished since last time,
+    # in the order described at the top of this file.
+    def poll(self):
+        # Latest progress of each job, older ones are out of date anyway
+        latest = {}
+        while True:
+            try:
+                update = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            latest[update[0:2]] = update[2:]
+        keys = dict((slot, key) for key, slot in self.slots.items())
+        for (slot, generation), update in latest.items():
+            job = self.current.get(keys.get(slot), {}).get(generation)
+            if job is not None and job[3] is not None and not job[0].done():
+                job[3](*update)
+
+        while True:
+            try:
+                key, generation = self.finished.get_nowait()
+            except queue.Empty:
+                break
+            # Superseded jobs are no longer in current, so just dropped
+            if generation in self.current.get(key, {}):
+                self.done.add((key, generation))
+
+        for key in list(self.current.keys()):
+            jobs = self.current.get(key)
+            while jobs:
+                generation = next(iter(jobs))
+                if (key, generation) not in self.done:
+                    break
+                self.done.discard((key, generation))
+                future, on_done, on_error, on_progress = jobs.pop(generation)
+                self.hand_back(key, future, on_done, on_error)
+                # The callback may have cancelled, or submitted, jobs for key
+                if self.current.get(key) is not jobs:
+                    break
+            if self.current.get(key) == {}:
+                self.current.pop(key)
+
+    def hand_back(self, key, future, on_done, on_error):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if isinstance(error, Cancelled):
+            return
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+            else:
+                print("Error in job {}".format(key))
+                traceback.print_exception(type(error), error, error.__traceback__)
+            return
+        result, stats = future.result()
+        timing.merge(stats)
+        if on_done is not None:
+            on_done(result)
+
+    def shutdown(self):
+        self.current = {}
+        self.wake = None
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        if self.listener is not None:
+            self.progress_queue.put(None)
+            self.listener = None
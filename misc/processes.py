@@ -0,0 +1,217 @@
+import collections  # Queue of waiting processes
+import os           # cpu_count, and killing process groups
+import queue        # Finished processes, from the watcher threads
+import signal       # Stopping cancelled processes
+import subprocess   # Running the processes
+import threading    # Waiting on the processes
+import time         # How long they took
+
+# Runs external programs, such as the single shot runs of Sea-Safari, with
+# at most max_running of them going at once, the rest wait in order. Each
+# one is a Process, which records its pid, exit code, how long it took, and
+# what it wrote to stdout and stderr.
+#
+# A thread waits on each running process, when it exits the next waiting
+# one is started, and the finished one is posted to a thread-safe queue,
+# then wake() is called if it is set, which should get the main (Tk)
+# thread to call poll(). poll() then calls the on_done of the finished
+# processes, on the thread that called it, similar to misc/jobs.py.
+
+class Process:
+
+    def __init__(self, command, cwd=None, on_done=None, name=None):
+        # Run through the shell if it is a string, otherwise a list of args
+        self.command = command
+        self.cwd = cwd
+        # Called with this Process from poll(), once it has finished
+        self.on_done = on_done
+        # Name for showing, eg the output file
+        self.name = name if name is not None else str(command)
+
+        # One of 'waiting', 'running' or 'done'
+        self.state = 'waiting'
+        self.cancelled = False
+        self.popen = None
+        self.pid = None
+        self.returncode = None
+        self.start_time = None
+        self.end_time = None
+        self.stdout = ''
+        self.stderr = ''
+
+    def start(self):
+        # On linux, a new session, so that cancel stops the whole group,
+        # not just the shell running the command.
+        self.popen = subprocess.Popen(self.command, shell=isinstance(self.command, str), cwd=self.cwd,\
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE,\
+                                      universal_newlines=True, errors='replace',\
+                                      start_new_session=os.name == 'posix')
+        self.pid = self.popen.pid
+        self.start_time = time.time()
+        self.state = 'running'
+
+    # Waits for it to exit, collecting the output
+    def wait(self):
+        self.stdout, self.stderr = self.popen.communicate()
+        self.returncode = self.popen.returncode
+        self.end_time = time.time()
+        self.state = 'done'
+
+    def kill(self):
+        try:
+            if os.name == 'posix':
+                os.killpg(self.pid, signal.SIGTERM)
+            else:
+                self.popen.terminate()
+        except (ProcessLookupError, PermissionError, OSError):
+            # Already gone
+            pass
+
+    # Seconds it has been running for, or ran for if done
+    def runtime(self):
+        if self.start_time is None:
+            return 0
+        end = self.end_time if self.end_time is not None else time.time()
+        return end - self.start_time
+
+    # True if it finished without errors
+    def ok(self):
+        return self.state == 'done' and not self.cancelled and self.returncode == 0
+
+    def __repr__(self):
+        return "Process({}, {}, pid={}, returncode={}, {:.1f}s)".format(self.name, self.state,\
+                    self.pid, self.returncode, self.runtime())
+
+class ProcessQueue:
+
+    def __init__(self, max_running=None):
+        if max_running is None:
+            max_running = max(1, (os.cpu_count() or 2) // 2)
+        self.max_running = max_running
+        # Guards waiting and running, these are changed by the watchers too
+        self.lock = threading.Lock()
+        self.waiting = collections.deque()
+        self.running = []
+        # Processes which have finished, or were cancelled, see poll()
+        self.finished = queue.Queue()
+        # If set, this is called from a watcher thread when one finishes
+        self.wake = None
+
+    # Queues up command to run, then on_done(process) is called in poll()
+    # once it finishes. Returns the Process.
+    def submit(self, command, cwd=None, on_done=None, name=None):
+        process = Process(command, cwd, on_done, name)
+        with self.lock:
+            self.waiting.append(process)
+            failed = self.fill()
+        if failed:
+            self.notify()
+        return process
+
+    # Changes the maximum number running at once, this does not stop any
+    # which are already running.
+    def set_max_running(self, max_running):
+        with self.lock:
+            self.max_running = max(1, int(max_running))
+            failed = self.fill()
+        if failed:
+            self.notify()
+
+    # Starts waiting processes while there is room, call with lock held.
+    # Ones which fail to start are put in finished, returns True if there
+    # were any, then notify() should be called once the lock is released.
+    def fill(self):
+        failed = False
+        while self.waiting and len(self.running) < self.max_running:
+            process = self.waiting.popleft()
+            try:
+                process.start()
+            except OSError as err:
+                process.stderr = str(err)
+                process.returncode = -1
+                process.state = 'done'
+                self.finished.put(process)
+                failed = True
+                continue
+            self.running.append(process)
+            threading.Thread(target=self.watch, args=(process,), daemon=True).start()
+        return failed
+
+    # Run on a thread for each running process. It goes in finished before
+    # it stops being running, so wait() can't see the queue as idle while
+    # it has not yet been handed back by poll().
+    def watch(self, process):
+        process.wait()
+        with self.lock:
+            self.finished.put(process)
+            self.running.remove(process)
+            self.fill()
+        self.notify()
+
+    # Calls wake, if set, once some have been put in finished. This is done
+    # without the lock held, as wake may lead to calls back into the queue.
+    def notify(self):
+        if self.wake is not None:
+            self.wake()
+
+    # Stops the process, or removes it from the queue if it hasn't started,
+    # it is still handed back by poll(), with cancelled set.
+    def cancel(self, process):
+        with self.lock:
+            removed = process in self.waiting
+            if removed:
+                self.waiting.remove(process)
+                process.cancelled = True
+                process.state = 'done'
+                self.finished.put(process)
+            elif process in self.running:
+                process.cancelled = True
+                process.kill()
+        if removed:
+            self.notify()
+
+    def cancel_all(self):
+        with self.lock:
+            processes = list(self.waiting) + list(self.running)
+        for process in processes:
+            self.cancel(process)
+
+    # The waiting or running process named name, or None
+    def find(self, name):
+        with self.lock:
+            for process in list(self.waiting) + self.running:
+                if process.name == name:
+                    return process
+        return None
+
+    # Number of processes waiting or running
+    def busy(self):
+        with self.lock:
+            return len(self.waiting) + len(self.running)
+
+    # Calls on_done for the processes which have finished since last time
+    def poll(self):
+        while True:
+            try:
+                process = self.finished.get_nowait()
+            except queue.Empty:
+                break
+            if process.on_done is not None:
+                process.on_done(process)
+
+    # Waits for everything queued to finish, calling poll() as they do, for
+    # use without a GUI. Returns False if timeout seconds passed first.
+    def wait(self, timeout=None):
+        start = time.time()
+        while True:
+            self.poll()
+            # on_done may have queued up more
+            if self.busy() == 0 and self.finished.empty():
+                return True
+            if timeout is not None and time.time() - start > timeout:
+                return False
+            time.sleep(0.05)
+
+    def shutdown(self):
+        self.wake = None
+        self.cancel_all()
@@ -0,0 +1,114 @@
+import functools    # wraps for the decorator
+import json         # Dumping the timings
+import time         # Wall and CPU clocks
+
+# Records how long the stages of the analysis take, eg opening and parsing
+# files, cleaning, integrating the spectra, fitting and making figures.
+# For each stage this keeps the number of times it ran, and the total wall
+# and CPU time it took. Stages can be nested, each one is counted on its own.
+#
+# Use either as a context manager:
+#
+#     with timing.stage('parse'):
+#         ...
+#
+# or as a decorator, @timing.timed('parse')
+#
+# This is off unless enabled is set, in which case stage() just returns a
+# shared object which does nothing, so it costs about as much as a call.
+
+# Set to True to record the timings
+enabled = False
+
+# stage name -> [count, wall seconds, cpu seconds]
+stats = {}
+
+class _Stage:
+
+    __slots__ = ('name', 'wall', 'cpu')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.wall, time.process_time() - self.cpu)
+        return False
+
+# Stand in for _Stage when disabled
+class _NoStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_no_stage = _NoStage()
+
+# Context manager which times the stage called name
+def stage(name):
+    if not enabled:
+        return _no_stage
+    return _Stage(name)
+
+# Decorator which times each call of the function as the stage called name
+def timed(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with _Stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Adds a run of the stage, this is also used for timings from other processes
+def record(name, wall, cpu, count=1):
+    entry = stats.get(name)
+    if entry is None:
+        stats[name] = [count, wall, cpu]
+    else:
+        entry[0] = entry[0] + count
+        entry[1] = entry[1] + wall
+        entry[2] = entry[2] + cpu
+
+# Adds in the stats from another process, as returned by take()
+def merge(other):
+    for name, (count, wall, cpu) in other.items():
+        record(name, wall, cpu, count)
+
+# Returns the stats so far, and starts again from nothing
+def take():
+    global stats
+    taken = stats
+    stats = {}
+    return taken
+
+def reset():
+    stats.clear()
+
+# The stats as a dict of name -> {count, wall, cpu, mean}, slowest first
+def report():
+    out = {}
+    for name, (count, wall, cpu) in sorted(stats.items(), key=lambda x: -x[1][1]):
+        out[name] = {'count': count, 'wall': wall, 'cpu': cpu, 'mean': wall / count}
+    return out
+
+# The stats as a table, for printing or showing in the GUI
+def report_text():
+    lines = ["{:<20} {:>8} {:>10} {:>10} {:>10}".format('Stage', 'Count', 'Wall (s)', 'CPU (s)', 'Mean (ms)')]
+    for name, values in report().items():
+        lines.append("{:<20} {:>8} {:>10.3f} {:>10.3f} {:>10.2f}".format(name, values['count'],\
+                     values['wall'], values['cpu'], values['mean'] * 1000))
+    return '\n'.join(lines)
+
+# Writes the stats to filename as JSON
+def dump(filename):
+    with open(filename, 'w') as f:
+        json.dump(report(), f, indent=2)
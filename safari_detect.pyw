@@ -1,14 +1,21 @@
 #!/usr/bin/env python3
 
+import time         # Startup timing
+start_time = time.perf_counter()
+
 import tkinter as tk
+from tkinter import filedialog
 
 import platform     # Linux vs Windows check
+import sys          # Command line flags
 
 # We use this for parsing numbers in input fields
 import data_files.safari_input as safari_input
 
 import detect_module
 from misc.module import Menu
+import misc.imports as imports
+import misc.timing as timing
 
 if platform.system() == 'Windows':
     font_12 = ('Times New Roman', 12)
@@ -163,11 +170,17 @@ class DetectGui:
             name = menu._label
             # Here we just add the callback to bring up the help submenus
             _new_menu.add_cascade(label=name, menu=self.make_help_submenu(menu._opts_order, menu, _new_menu))
+        _new_menu.add_command(label='Diagnostics', command= lambda: self.diagnostics())
         _new_menu.add_command(label='About', command= lambda: self.about())
 
         for mod in self._modules:
             mod.on_start()
 
+        if imports.report and root == None:
+            # update() so that this includes actually drawing the window
+            self.root.update()
+            print("Window ready in {:.3f}s".format(time.perf_counter() - start_time))
+
         if root == None:
             self.root.mainloop()
 
@@ -180,6 +193,49 @@ class DetectGui:
         messageVar = tk.Message(t, text = self.copyrightMessage, fg='black', font = font_14, width = 600)
         messageVar.place(relx = 0.5, rely = 1, anchor = tk.S)
 
+    # Shows how long each stage of the analysis has taken, see misc/timing.py
+    def diagnostics(self):
+        t = tk.Toplevel(self.root)
+        t.wm_title("Diagnostics")
+        text = tk.Text(t, font = ('Courier', 12), width = 64, height = 20)
+
+        def refresh():
+            text.config(state='normal')
+            text.delete('1.0', 'end')
+            if timing.enabled:
+                text.insert('end', timing.report_text())
+            else:
+                text.insert('end', 'Timings are not being recorded, enable them below.')
+            if len(imports.import_times) > 0:
+                total = sum(imports.import_times.values())
+                text.insert('end', '\n\nImports: {} modules in {:.3f}s'.format(len(imports.import_times), total))
+            text.config(state='disabled')
+
+        def toggle():
+            timing.enabled = enabled.get() == 1
+            refresh()
+
+        def reset():
+            timing.reset()
+            refresh()
+
+        def save():
+            filename = filedialog.asksaveasfilename(parent=t, defaultextension='.json',\
+                            filetypes=(('JSON', '*.json'), ('all files', '*.*')))
+            if filename:
+                timing.dump(filename)
+
+        enabled = tk.IntVar()
+        enabled.set(1 if timing.enabled else 0)
+        buttons = tk.Frame(t)
+        tk.Checkbutton(buttons, text='Record timings', variable=enabled, command=toggle, font = font_12).pack(side='left')
+        tk.Button(buttons, text='Refresh', command=refresh, font = font_12).pack(side='left')
+        tk.Button(buttons, text='Reset', command=reset, font = font_12).pack(side='left')
+        tk.Button(buttons, text='Save JSON', command=save, font = font_12).pack(side='left')
+        buttons.pack(side='bottom', fill='x', padx=5, pady=5)
+        text.pack(side="top", fill="both", expand=True, padx=5, pady=5)
+        refresh()
+
     # Wrapper for making a submenu, so that the keys and the submenu are in new scope.
     def make_help_submenu(self, keys, menu, helpmenu):
         submenu = tk.Menu(helpmenu, tearoff=0)
@@ -212,6 +268,8 @@ class DetectGui:
         
         for mod in self._modules:
             mod.on_stop()
+        if imports.report and self.first:
+            imports.print_report()
         if(self.first):
             self.root.quit()
         self.root.destroy()
@@ -285,4 +343,11 @@ def start():
         spawn_gui_proc()
 
 if __name__ == '__main__':
+    # --import-times prints the startup time, and how long each of the
+    # modules took to import as they get loaded
+    if '--import-times' in sys.argv:
+        imports.report = True
+    # --timings records how long each stage takes, see Help/Diagnostics
+    if '--timings' in sys.argv:
+        timing.enabled = True
     start()
\ No newline at end of file
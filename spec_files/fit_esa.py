@@ -2,16 +2,19 @@
 
 import argparse                     # Parsing command line arguments
 import numpy as np                  # Array manipulation/maths
-import matplotlib                   # Plotting
 import os                           # Path related stuff
 import scipy.signal as signal       # Peak finding
 
-import matplotlib.pyplot as plt     # Plotting
 import traceback                    # Error handling
 
 from scipy.optimize import curve_fit# Fitting the gaussians
 from scipy.stats import linregress  # for R-value on the plot
 
+# pyplot is only needed when plot is set, the fits themselves don't use it
+def pyplot():
+    import matplotlib.pyplot as plt
+    return plt
+
 # Basic gaussian fitting function
 def gaussian(x, a, sigma, mu):
     dx = x-mu
@@ -117,7 +120,7 @@ def fit_esa(values, axis, actualname=None, plot=True, min_h = 10, min_w = 1, man
         popt, pcov = curve_fit(fit_func, axis, values, p0=params)
     except:
         if plot:
-            fig,ax = plt.subplots()
+            fig,ax = pyplot().subplots()
 
             x_0 = axis
             y_0 = fit_func(x_0, *params)
@@ -156,7 +159,7 @@ def fit_esa(values, axis, actualname=None, plot=True, min_h = 10, min_w = 1, man
         fit_file.close()
 
     if plot:
-        fig,ax = plt.subplots()
+        fig,ax = pyplot().subplots()
         ax.plot(axis, values, label='Data')
         ax.plot(x_0, y_0, label='Initial Guess')
         ax.plot(x_0, y_1, label=fit_label)
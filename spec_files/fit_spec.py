@@ -4,6 +4,11 @@ import matplotlib      # Main plotting
 #Qt5Agg is the backend
 matplotlib.use('Qt5Agg')
 import matplotlib.pyplot as plt 
+import os
+import sys
+# misc is in the directory above this one, load_spec needs it
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import misc.timing as timing
 import load_spec
 from load_spec import Spec
 import fit_esa as esa
@@ -14,8 +19,12 @@ if __name__ == "__main__" :
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--input", help="input file")
     parser.add_argument("-d", "--data", help="data comparison file")
+    parser.add_argument("-j", "--timings", help="Save the time taken by each stage to this .json file")
     args = parser.parse_args()
 
+    if args.timings:
+        timing.enabled = True
+
     spec = Spec(args.input)
     spec.process_data(d_phi=0.5)
 
@@ -49,7 +58,8 @@ if __name__ == "__main__" :
     H = []
     for i in range(img.shape[1]):
         slyce = img[:,i]
-        params = esa.fit_esa(slyce, axis,actualname=" fit", plot=False,min_h = max(np.max(slyce)/10,30),min_w=1)
+        with timing.stage('fit'):
+            params = esa.fit_esa(slyce, axis,actualname=" fit", plot=False,min_h = max(np.max(slyce)/10,30),min_w=1)
         # +0.5 to shift the point to the middle of the bin
         T = load_spec.interp(i+0.5, img.shape[1], t_min, t_max)
         if params is not None and len(params) > 2:
@@ -92,6 +102,11 @@ if __name__ == "__main__" :
     ax2.set_ylabel('Outgoing Theta (Degrees)')
     # fig2.show()
 
-    fig.savefig(args.input.replace('.spec', '_fits.png'))
+    with timing.stage('savefig'):
+        fig.savefig(args.input.replace('.spec', '_fits.png'))
+
+    if args.timings:
+        timing.dump(args.timings)
+        print(timing.report_text())
     
     input("Enter to exit")
\ No newline at end of file
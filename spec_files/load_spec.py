@@ -1,14 +1,22 @@
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt 
-import scipy.signal as signal       # Peak finding
+
+import misc.timing as timing        # Stage timings
+
+# matplotlib is only imported once something actually gets plotted, so
+# loading and fitting can run in workers without a GUI backend.
+def pyplot():
+    import matplotlib.pyplot as plt
+    return plt
 
 def interp(n, l, start, end):
     return start + n * (end - start) / l
 
 class Spec:
 
-    def __init__(self, file):
+    # progress is called as progress(stage, done, total, unit) while loading,
+    # processing and fitting, like in detect_processor.
+    def __init__(self, file, progress=None):
+        self.progress = progress
         self.detections = []
         self.energy = 0
         self.theta = 0
@@ -25,6 +33,8 @@ class Spec:
         self.prep_fig = None
 
         self.fits = {}
+        # Points and error bars found by try_fit, (theta, energy, width)
+        self.fit_points = ([], [], [])
 
         self.load(file)
 
@@ -36,6 +46,8 @@ class Spec:
         self.theta_phi = None
         self.big_font = True
         self.figsize = (12.0, 9.0)
+        # If set, try_fit also saves the fits as a .npz
+        self.write_npz = False
 
     def parse_header(self, header):
         rows = header.split('\n')
@@ -59,6 +71,7 @@ class Spec:
             elif line.startswith('Total Counts:'):
                 self.counts = float(vars[2])
 
+    @timing.timed('process_spec')
     def process_data(self, d_phi=1, do_phi=True):
         l_E = len(self.detections) - 1
         l_T = len(self.detections[1])
@@ -69,6 +82,8 @@ class Spec:
             self.theta_phi = np.zeros((l_T, l_P))
 
         for n_E in range(l_E):
+            if self.progress is not None:
+                self.progress('Processing', n_E, l_E, 'rows')
             table = self.detections[n_E]
             for n_T in range(l_T):
                 row = table[n_T]
@@ -78,8 +93,11 @@ class Spec:
                         self.theta_phi[n_T][n_P] = self.theta_phi[n_T][n_P] + row[n_P]
                     if P > self.phi - d_phi/2 and P < self.phi + d_phi/2:
                         self.img[n_E][n_T] = self.img[n_E][n_T] + row[n_P]
+        if self.progress is not None:
+            self.progress('Processing', l_E, l_E, 'rows')
 
     def make_e_t_plot(self, data=None, do_plot=True, do_norm = True,do_log = True, do_fits=False):
+        plt = pyplot()
         e_max = self.e_range[1]
         e_min = self.e_range[0]
         t_min = self.t_range[0]
@@ -97,7 +115,7 @@ class Spec:
 
         if do_plot:
             file_name = self.file.replace('.spec', '_raw_img.png')
-            matplotlib.image.imsave(file_name, img)
+            plt.imsave(file_name, img)
 
         self.log_img = np.log(img + 1)
         if do_log:
@@ -186,7 +204,7 @@ class Spec:
             prep_fig()
             fig.show()
             file_name = self.file.replace('.spec', '_displayed_img.png')
-            matplotlib.image.imsave(file_name, img)
+            plt.imsave(file_name, img)
 
     def parse_data(self, data):
         rows = data.split('\n')
@@ -212,10 +230,13 @@ class Spec:
                     table.append(np.array(data_row))
         del self.detections[0]
 
+    @timing.timed('open_spec')
     def load(self, file):
         spec_file = open(file, 'r')
         entire_file = spec_file.read()
         spec_file.close()
+        if self.progress is not None:
+            self.progress('Loading', len(entire_file), len(entire_file), 'B')
         components = entire_file.split('--------------------------------------------------------')
         header = components[1]
         data = components[2]
@@ -228,6 +249,7 @@ class Spec:
     def w_func(slyce):
         return 5
 
+    @timing.timed('fit')
     def try_fit(self, fit_func, xaxis, ax, guess_params=None, min_h=h_func,min_w=w_func):
         t_min = self.t_range[0]
         t_max = self.t_range[1]
@@ -237,6 +259,8 @@ class Spec:
         H = []
         self.fits = {}
         for i in range(self.img.shape[1]):
+            if self.progress is not None:
+                self.progress('Fitting', i, self.img.shape[1], 'columns')
             slyce = self.img[:,i]
 
             if self.integrate is not None:
@@ -271,17 +295,33 @@ class Spec:
                     H.append(abs(params[j]))
             else:
                 print("No fits at angle {}, {}".format(T, err))
+        if self.progress is not None:
+            self.progress('Fitting', self.img.shape[1], self.img.shape[1], 'columns')
+        self.fit_points = (X, Y, S)
         # Plots the error bars and points, Also produces a file containing them
+        # If ax is None, the plotting is left for plot_fits later
         if len(X) > 0:
-            ax.scatter(X,Y,c='y',s=4,label="Simulation")
-            ax.errorbar(X,Y,yerr=S, c='y',fmt='none',capsize=2)
+            if ax is not None:
+                self.plot_fits(ax)
+            fits = np.column_stack((np.array(X)-0.5, Y, S, H))
             fit_file = open(self.file.replace('.spec', '_fits.dat'), 'w')
             fit_file.write('Angle(Degrees)\tEnergy(eV)\tWidth(eV)\tScale\n')
-            for i in range(len(X)):
-                fit_file.write('{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}\n'.format(X[i]-0.5,Y[i],S[i],H[i]))
+            # Format all of the lines at once
+            fit_file.write(('%.2f\t%.2f\t%.2f\t%.2f\n' * len(fits)) % tuple(fits.ravel().tolist()))
             fit_file.close()
+            if self.write_npz:
+                np.savez(self.file.replace('.spec', '_fits.npz'), angle=fits[...,0],\
+                         energy=fits[...,1], width=fits[...,2], scale=fits[...,3])
+
+    # Plots the points and error bars from the last try_fit
+    def plot_fits(self, ax):
+        X, Y, S = self.fit_points
+        if len(X) > 0:
+            ax.scatter(X,Y,c='y',s=4,label="Simulation")
+            ax.errorbar(X,Y,yerr=S, c='y',fmt='none',capsize=2)
 
 if __name__ == "__main__" :
+    plt = pyplot()
     spec = Spec('./test.spec')
     spec.process_data()
     print(spec)
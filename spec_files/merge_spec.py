@@ -1,9 +1,12 @@
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt 
+import os
+import sys
+# misc is in the directory above this one, load_spec needs it
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 import load_spec
 import fit_esa as esa
-import os
 
 def merge(spec, scale, spec_in):
     if spec_in is None:
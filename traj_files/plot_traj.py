@@ -1,10 +1,113 @@
 import argparse                    # Parsing input arguments
 import numpy as np                 # Array processing
 import math                        # sqrt, etc
-import matplotlib                  # Plotting
-import matplotlib.pyplot as plt    # Plotting
+import os                          # stat of the files, for the cache
 import scipy.constants as consts   # Converting safari-time to seconds
 
+# Columns of a .traj file, in order
+TRAJ_DTYPE = np.dtype([('x', 'f8'), ('y', 'f8'), ('z', 'f8'),\
+                       ('px', 'f8'), ('py', 'f8'), ('pz', 'f8'),\
+                       ('t', 'f8'), ('n', 'i8'),\
+                       ('T', 'f8'), ('V', 'f8'), ('E', 'f8'),\
+                       ('near', 'i8'), ('dt', 'f8')])
+
+# The binary sidecar for a .traj file, this caches the parsed array
+def getCacheFile(filename):
+    return filename + '.npz'
+
+# Parses the .traj file into one structured array, with the columns of
+# TRAJ_DTYPE. Lines which are incomplete, such as the last one of a run
+# which is still going, are skipped.
+def parseTrajFile(filename):
+    names = TRAJ_DTYPE.names
+    try:
+        arr = np.loadtxt(filename, skiprows=1, usecols=range(len(names)), ndmin=2)
+    except (ValueError, IndexError):
+        # Otherwise do it line by line, skipping the errored ones.
+        rows = []
+        with open(filename, 'r', errors='ignore') as f:
+            f.readline()
+            for line in f:
+                args = line.split()
+                if len(args) < len(names):
+                    continue
+                try:
+                    rows.append([float(x) for x in args[0:len(names)]])
+                except ValueError:
+                    continue
+        arr = np.array(rows).reshape(-1, len(names))
+    data = np.zeros(len(arr), dtype=TRAJ_DTYPE)
+    for i, name in enumerate(names):
+        data[name] = arr[:,i]
+    return data
+
+# Loads the .traj file as a structured array, from the binary sidecar if
+# it is up to date with the file, otherwise it is parsed and then cached.
+def loadTrajArray(filename):
+    stat = os.stat(filename)
+    source = np.array([stat.st_mtime, stat.st_size])
+    cache_file = getCacheFile(filename)
+    if os.path.isfile(cache_file):
+        try:
+            with np.load(cache_file) as cache:
+                if np.array_equal(cache['source'], source):
+                    data = cache['data']
+                    if data.dtype == TRAJ_DTYPE:
+                        return data
+        except Exception as err:
+            print("Error reading cache {}, {}".format(cache_file, err))
+
+    data = parseTrajFile(filename)
+    try:
+        tmp_file = cache_file + '.tmp.npz'
+        np.savez(tmp_file, data=data, source=source)
+        os.replace(tmp_file, cache_file)
+    except OSError as err:
+        print("Error writing cache {}, {}".format(cache_file, err))
+    return data
+
+# Most points of a trajectory drawn at once in the 3D plot, rotating the
+# plot gets slow with many more than this.
+MAX_3D_POINTS = 2000
+
+# Indices of the points of the path x, y, z to draw, at most max_points of
+# them. These are the points where it turns by more than turn radians, up
+# to a quarter of them, and the rest are spaced evenly along the path by
+# arc length, along with both ends.
+def decimate(x, y, z, max_points=MAX_3D_POINTS, turn=np.radians(10)):
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+    steps = np.column_stack((np.diff(x), np.diff(y), np.diff(z)))
+    lengths = np.sqrt(np.sum(steps**2, axis=1))
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    # Angle turned at each point, from the steps before and after it
+    norms = lengths[:-1] * lengths[1:]
+    moving = norms > 0
+    cos = np.sum(steps[:-1] * steps[1:], axis=1) / np.where(moving, norms, 1)
+    sharp = np.nonzero(moving & (cos < np.cos(turn)))[0]
+    # For noisy paths, only keep the sharpest ones
+    if len(sharp) > max_points // 4:
+        sharp = sharp[np.argsort(cos[sharp])[:max_points // 4]]
+    keep[sharp + 1] = True
+
+    s = np.concatenate(([0], np.cumsum(lengths)))
+    sections = max_points - len(sharp) - 2
+    if s[-1] > 0 and sections > 0:
+        # First point in each of the sections of the path
+        section = np.floor(s * (sections / s[-1])).astype(np.int64)
+        keep[1:-1] |= section[1:-1] != section[:-2]
+    return np.nonzero(keep)[0]
+
+# Indices of the points of x, y, z inside the limits of ax, decimated, so
+# zooming in shows the path at full resolution.
+def visiblePoints(x, y, z, ax, max_points=MAX_3D_POINTS):
+    (x0, x1), (y0, y1), (z0, z1) = ax.get_xlim(), ax.get_ylim(), ax.get_zlim()
+    inside = np.nonzero((x >= x0) & (x <= x1) & (y >= y0) & (y <= y1) & (z >= z0) & (z <= z1))[0]
+    return inside[decimate(x[inside], y[inside], z[inside], max_points)]
+
 class Traj:
 
     # Returns the SAFARI time unit in seconds
@@ -14,74 +117,42 @@ class Traj:
         A = consts.angstrom
         return A*math.sqrt(amu/eV)
 
-    # Loads from the given .traj file
+    # Loads from the given .traj file, see loadTrajArray
     def load(self, filename):
+        data = loadTrajArray(filename)
+        # Contiguous copies of the columns, so that each is compact, rather
+        # than a strided view into the whole table
+        column = lambda name: np.ascontiguousarray(data[name])
 
         #Coordinates
-        self.x = []
-        self.y = []
-        self.z = []
+        self.x = column('x')
+        self.y = column('y')
+        self.z = column('z')
 
         #Momenta
-        self.px = []
-        self.py = []
-        self.pz = []
+        self.px = column('px')
+        self.py = column('py')
+        self.pz = column('pz')
 
         #Times
-        self.t = []  #Total Time
-        self.dt = [] #Current Time step
+        self.t = column('t')   #Total Time
+        self.dt = column('dt') #Current Time step
 
         #Energies
-        self.T = []  #Kinetic
-        self.V = []  #Potential
-        self.E = []  #Total
-        self.dV = [] #Potential Change
+        self.T = column('T')   #Kinetic
+        self.V = column('V')   #Potential
+        self.E = column('E')   #Total
 
         #Counters
-        self.n = []  #Time step
-        self.near=[] #Number nearby
-
-        traj_file = open(filename, 'r')
-        num = 0
-        for line in traj_file:
-            if num == 0:
-                num = num + 1
-                continue
-            num = num + 1
-            args = line.split()
-            self.x.append(float(args[0]))
-            self.y.append(float(args[1]))
-            self.z.append(float(args[2]))
-
-            self.px.append(float(args[3]))
-            self.py.append(float(args[4]))
-            self.pz.append(float(args[5]))
-
-            self.t.append(float(args[6]))
-            self.n.append(int(args[7]))
-
-            self.T.append(float(args[8]))
-            self.V.append(float(args[9]))
-            self.E.append(float(args[10]))
-
-            self.near.append(int(args[11]))
-            self.dt.append(float(args[12]))
-            
-        self.x = np.array(self.x)
-        self.y = np.array(self.y)
-        self.z = np.array(self.z)
-
-        self.px = np.array(self.px)
-        self.py = np.array(self.py)
-        self.pz = np.array(self.pz)
-
-        self.t = np.array(self.t)
+        self.n = column('n')       #Time step
+        self.near = column('near') #Number nearby
+
         #Convert to femtoseconds
         self.t = self.t * self.time_unit() * 1e15
 
-        self.T = np.array(self.T)
-        self.V = np.array(self.V)
-        self.E = np.array(self.E)
+    # The ((min, max) x, y, z) of the trajectory
+    def extent(self):
+        return tuple((np.min(v), np.max(v)) for v in [self.x, self.y, self.z])
 
     # Plots the various energies vs time
     def plot_energies(self, ax):
@@ -120,12 +191,23 @@ class Traj:
         dir_z = [z[-1]-z[-2]]
 
         ax.quiver([x[-1]], [y[-1]], [z[-1]], dir_x, dir_y, dir_z, length=1.0, normalize=True)
-        ax.scatter3D(x, y, z, c='red')
+        # Only some of the points are drawn, see decimate
+        shown = decimate(x, y, z)
+        points = ax.scatter3D(x[shown], y[shown], z[shown], c='red', depthshade=False)
         self.zoomed=True
 
+        # When zoomed, draws the points in view instead, see visiblePoints
+        def on_lims(axes):
+            shown = visiblePoints(x, y, z, ax)
+            points._offsets3d = (x[shown], y[shown], z[shown])
+            fig.canvas.draw_idle()
+
         min_z = np.min(z)
         max_z = np.max(z)
         ax.set_zlim(min_z, max_z)
+
+        for name in ['xlim_changed', 'ylim_changed', 'zlim_changed']:
+            ax.callbacks.connect(name, on_lims)
         
         # This will rescale the plot when double clicked
         def onclick(event):
@@ -162,6 +244,8 @@ class Traj:
         fig.canvas.mpl_connect('button_press_event', onclick)
 
 if __name__ == "__main__" :
+    import matplotlib.pyplot as plt    # Plotting
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--input", help="input file")
     parser.add_argument("-s", "--save", help="Whether to save the graphs", action='store_true')
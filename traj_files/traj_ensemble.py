@@ -0,0 +1,198 @@
+import argparse                    # Parsing input arguments
+import concurrent.futures          # Loading the files in parallel
+import glob                        # Finding the .traj files
+import os                          # Path related stuff
+import sys                         # Finding the other modules
+import warnings                    # Quietening the all-nan warnings
+import numpy as np                 # Array processing
+
+# The repo root, so traj_files can be imported when run from in here
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import traj_files.plot_traj as plot_traj
+
+# Statistics over many .traj files, such as a set of single shot runs.
+# Each trajectory is resampled onto a common time grid, so they can be
+# combined at each time, and a few values are also found per trajectory:
+#
+#   energy_loss  - E[0] - E(t), from the total energy of the projectile
+#   power        - -dE/dt, as in Traj.plot_power
+#   closest      - closest approach to the surface, the lowest z, and when
+#   peak_power   - the largest power transfer, and when
+#
+# Times are in fs, as in Traj. Past the end of a trajectory, its resampled
+# values are nan, and the statistics vs time only include the ones which
+# are still going, see alive.
+
+# Loads one file, this is run in the worker processes
+def loadTraj(filename):
+    traj = plot_traj.Traj()
+    traj.load(filename)
+    return traj
+
+class Ensemble:
+
+    def __init__(self):
+        self.files = []
+        self.trajs = []
+
+        # Common time grid, and the resampled values on it, these are
+        # (number of trajectories, number of times)
+        self.time = None
+        self.energy_loss = None
+        self.power = None
+        self.z = None
+
+    # Loads the .traj files, using workers processes, files which fail to
+    # load are skipped, with a message.
+    def load(self, files, workers=None):
+        files = sorted(files)
+        if workers == 1 or len(files) < 2:
+            results = []
+            for filename in files:
+                try:
+                    results.append(loadTraj(filename))
+                except Exception as err:
+                    results.append(err)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                futures = [pool.submit(loadTraj, filename) for filename in files]
+                results = [future.exception() or future.result() for future in futures]
+        for filename, result in zip(files, results):
+            if isinstance(result, Exception):
+                print("Error loading {}, {}".format(filename, result))
+                continue
+            if len(result.t) < 2:
+                print("Skipping {}, too short".format(filename))
+                continue
+            self.files.append(filename)
+            self.trajs.append(result)
+
+    # Loads all of the .traj files in directory
+    def load_directory(self, directory, pattern='*.traj', workers=None):
+        self.load(glob.glob(os.path.join(directory, pattern)), workers)
+
+    # Loads the .traj files listed in filename, one per line, such as the
+    # list saved by data_files/single_shot.py
+    def load_list(self, filename, workers=None):
+        with open(filename, 'r') as f:
+            files = [line.strip() for line in f if line.strip() != '']
+        self.load(files, workers)
+
+    # Resamples the trajectories onto points times from 0 to t_max, by
+    # default the end of the longest one. Raises ValueError if none loaded.
+    def resample(self, points=1000, t_max=None):
+        if len(self.trajs) == 0:
+            raise ValueError("No trajectories loaded, so there is nothing to resample")
+        if t_max is None:
+            t_max = max(traj.t[-1] for traj in self.trajs)
+        self.time = np.linspace(0, t_max, points)
+        shape = (len(self.trajs), points)
+        self.energy_loss = np.full(shape, np.nan)
+        self.power = np.full(shape, np.nan)
+        self.z = np.full(shape, np.nan)
+        for i, traj in enumerate(self.trajs):
+            power = -np.gradient(traj.E, traj.t)
+            self.energy_loss[i] = np.interp(self.time, traj.t, traj.E[0] - traj.E, left=np.nan, right=np.nan)
+            self.power[i] = np.interp(self.time, traj.t, power, left=np.nan, right=np.nan)
+            self.z[i] = np.interp(self.time, traj.t, traj.z, left=np.nan, right=np.nan)
+        return self.time
+
+    # Values for each trajectory, from the full resolution data
+    def per_trajectory(self):
+        out = {
+            'final_energy_loss': np.zeros(len(self.trajs)),
+            'closest': np.zeros(len(self.trajs)),
+            'closest_time': np.zeros(len(self.trajs)),
+            'peak_power': np.zeros(len(self.trajs)),
+            'peak_power_time': np.zeros(len(self.trajs)),
+            'duration': np.zeros(len(self.trajs)),
+        }
+        for i, traj in enumerate(self.trajs):
+            power = -np.gradient(traj.E, traj.t)
+            lowest = np.argmin(traj.z)
+            peak = np.argmax(power)
+            out['final_energy_loss'][i] = traj.E[0] - traj.E[-1]
+            out['closest'][i] = traj.z[lowest]
+            out['closest_time'][i] = traj.t[lowest]
+            out['peak_power'][i] = power[peak]
+            out['peak_power_time'][i] = traj.t[peak]
+            out['duration'][i] = traj.t[-1]
+        return out
+
+    # Mean and percentiles vs time of the resampled values, and the
+    # per_trajectory values, as a dict of name -> array
+    def statistics(self, percentiles=(10, 50, 90)):
+        if self.time is None:
+            self.resample()
+        out = {'time': self.time, 'alive': np.sum(~np.isnan(self.energy_loss), axis=0)}
+        # Times where none are left give nan, without the warnings
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for name, values in [('energy_loss', self.energy_loss), ('power', self.power), ('z', self.z)]:
+                out[name + '_mean'] = np.nanmean(values, axis=0)
+                for p in percentiles:
+                    out['{}_p{}'.format(name, p)] = np.nanpercentile(values, p, axis=0)
+        out.update(self.per_trajectory())
+        return out
+
+    # Saves the statistics, resampled values and file names to a .npz
+    def save(self, filename, percentiles=(10, 50, 90)):
+        out = self.statistics(percentiles)
+        np.savez(filename, files=np.array(self.files), energy_loss=self.energy_loss,\
+                 power=self.power, z=self.z, **out)
+
+    # Plots the mean and percentile band of the energy loss vs time
+    def plot_energy_loss(self, ax, low=10, high=90):
+        plotEnergyLoss(ax, self.statistics((low, 50, high)), low, high)
+
+# Plots the energy loss from stats, as returned by Ensemble.statistics,
+# which must include the low and high percentiles
+def plotEnergyLoss(ax, stats, low=10, high=90):
+    ax.fill_between(stats['time'], stats['energy_loss_p{}'.format(low)],\
+                    stats['energy_loss_p{}'.format(high)], alpha=0.3,\
+                    label="{}-{}%".format(low, high))
+    ax.plot(stats['time'], stats['energy_loss_p50'], label="Median")
+    ax.plot(stats['time'], stats['energy_loss_mean'], label="Mean")
+    ax.set_xlabel('Time (fs)')
+    ax.set_ylabel('Energy Loss (eV)')
+    ax.set_title('Energy Loss, {} Trajectories'.format(len(stats['final_energy_loss'])))
+    ax.legend()
+
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--directory", help="Directory of .traj files")
+    parser.add_argument("-l", "--list", help="File listing the .traj files, one per line")
+    parser.add_argument("-o", "--output", help="Save the statistics to this .npz file")
+    parser.add_argument("-n", "--points", type=int, default=1000, help="Number of times to resample onto")
+    parser.add_argument("-w", "--workers", type=int, help="Number of processes to load with")
+    parser.add_argument("-p", "--plot", help="Plot the energy loss", action='store_true')
+    args = parser.parse_args()
+
+    ensemble = Ensemble()
+    if args.list:
+        ensemble.load_list(args.list, workers=args.workers)
+    else:
+        ensemble.load_directory(args.directory, workers=args.workers)
+    print("Loaded {} trajectories".format(len(ensemble.trajs)))
+    if len(ensemble.trajs) == 0:
+        sys.exit(1)
+    ensemble.resample(args.points)
+
+    if args.output:
+        ensemble.save(args.output)
+
+    stats = ensemble.per_trajectory()
+    print("Final energy loss: {:.2f} eV mean, {:.2f} eV median".format(np.mean(stats['final_energy_loss']),\
+                                                                  np.median(stats['final_energy_loss'])))
+    print("Closest approach: {:.3f} Å mean, {:.3f} Å lowest".format(np.mean(stats['closest']),\
+                                                                  np.min(stats['closest'])))
+    print("Peak power: {:.3f} eV/fs mean, {:.3f} eV/fs highest".format(np.mean(stats['peak_power']),\
+                                                                    np.max(stats['peak_power'])))
+
+    if args.plot:
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots()
+        ensemble.plot_energy_loss(ax)
+        fig.show()
+        input("Enter to exit.")